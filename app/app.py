@@ -2,8 +2,9 @@ from flask import Flask
 from flask_cors import CORS
 from flask_restful import Api
 
-from app.common.json import MongoEncoder, MongoDecoder
+from app.common.json import MongoEncoder, output_json
 from app.common.url_map import ObjectIdConverter
+from app.resources import health
 from app.resources import notifications
 from app.resources import patients
 from app.resources import payments
@@ -17,18 +18,13 @@ from app.resources.vets import vets_bp
 
 app = Flask(__name__)
 app.json_encoder = MongoEncoder
-app.json_decoder = MongoDecoder
-app.config['RESTFUL_JSON'] = {
-    'separators': (', ', ': '),
-    'indent': 2,
-    'cls': MongoEncoder
-}
 app.url_map.converters['object_id'] = ObjectIdConverter
 app.url_map.converters['oid'] = ObjectIdConverter
 
 CORS(app)
 
 api = Api(app, prefix='/api/v1')
+api.representations['application/json'] = output_json
 
 app.register_blueprint(admin_bp)
 
@@ -36,12 +32,17 @@ app.register_blueprint(clients_bp)
 
 app.register_blueprint(hospitals_bp)
 
+api.add_resource(health.Mongo, '/health/mongo')
+api.add_resource(health.Upstreams, '/health/upstreams')
+api.add_resource(health.Indexes, '/health/indexes')
+
 api.add_resource(notifications.Orders, '/notifications/orders', endpoint='notifications_orders')
 api.add_resource(notifications.Registration, '/notifications/registration')
 
 app.register_blueprint(orders_bp)
 
 api.add_resource(patients.Patients, '/patients')
+api.add_resource(patients.Import, '/patients/import')
 
 api.add_resource(payments.Payments, '/payments')
 
@@ -0,0 +1,77 @@
+import time
+
+# Filter for live documents. Every document carries an explicit is_archived boolean (see
+# backfill below), so an equality predicate is exact and can use compound and partial indexes.
+ACTIVE = {'is_archived': False}
+
+# Old predicate, which also matched documents without the field. Kept for the benchmark.
+LEGACY_ACTIVE = {'is_archived': {'$in': [None, False]}}
+
+COLLECTIONS = ['clients', 'hospitals', 'orders', 'patients', 'pharmacies', 'products', 'subscriptions',
+               'treatment_plans', 'vets']
+
+
+def backfill(db, collection, batch_size=1000, pause=0.1):
+    """Set is_archived to False wherever it is missing or null, one batch at a time.
+
+    Sleeping `pause` seconds between batches keeps the write load on a live primary low.
+    Returns the number of documents updated.
+    """
+    updated = 0
+    while True:
+        ids = [doc['_id'] for doc in db[collection].find({'is_archived': None}, projection={'_id': True},
+                                                         limit=batch_size)]
+        if not ids:
+            return updated
+        updated += db[collection].update_many(
+            {'_id': {'$in': ids}, 'is_archived': None}, {'$set': {'is_archived': False}}).modified_count
+        time.sleep(pause)
+
+
+def _plan_summary(explain):
+    """Reduce an explain('executionStats') document to the winning plan's stages and counters."""
+    stages = []
+    stage = explain['queryPlanner']['winningPlan']
+    while stage:
+        name = stage['stage']
+        if 'indexName' in stage:
+            name = f"{name}({stage['indexName']})"
+        stages.append(name)
+        stage = stage.get('inputStage')
+    stats = explain['executionStats']
+    return {
+        'plan': ' <- '.join(stages),
+        'keys_examined': stats['totalKeysExamined'],
+        'docs_examined': stats['totalDocsExamined'],
+        'returned': stats['nReturned'],
+        'ms': stats['executionTimeMillis'],
+    }
+
+
+def benchmark(db, rounds=20, limit=20):
+    """Compare the legacy and equality predicates on the orders, patients and products listings.
+
+    For each listing and predicate: the winning plan with keys/documents examined, and the
+    median wall-clock latency of `rounds` runs of the page query.
+    """
+    listings = {
+        'orders': ({}, None),
+        'patients': ({}, None),
+        'products': ({}, [('product_name', 1)]),
+    }
+    report = {}
+    for collection, (query, sort) in listings.items():
+        for label, predicate in (('legacy', LEGACY_ACTIVE), ('equality', ACTIVE)):
+            q = dict(query, **predicate)
+            cursor = db[collection].find(q, limit=limit, sort=sort)
+            summary = _plan_summary(cursor.explain())
+
+            timings = []
+            for _ in range(rounds):
+                started = time.time()
+                list(db[collection].find(q, limit=limit, sort=sort))
+                timings.append((time.time() - started) * 1000)
+            summary['median_ms'] = round(sorted(timings)[len(timings) // 2], 3)
+
+            report[f'{collection}.{label}'] = summary
+    return report
@@ -0,0 +1,203 @@
+import codecs
+import collections
+import csv
+import datetime
+import itertools
+
+import boto3
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.common import counts
+from app.common import formulary
+from app.common import product_types
+from app.common.env import *
+
+DEFAULT_IMAGE_URL = 'https://images-na.ssl-images-amazon.com/images/I/4197CuIS0gL.jpg'
+
+PRODUCT_FIELDS = ('ndc', 'image_url', 'type', 'category')
+
+DUPLICATE_KEY = 11000
+
+
+def _s3():
+    return boto3.client(
+        's3',
+        aws_access_key_id=AWS_ACCESS_KEY,
+        aws_secret_access_key=AWS_SECRET_KEY)
+
+
+def open_s3(key):
+    """Stream a catalog object from the bucket as text lines; nothing is written to disk."""
+    body = _s3().get_object(Bucket=AWS_BUCKET_NAME, Key=key)['Body']
+    return codecs.getreader('utf-8-sig')(body)
+
+
+def exists(key):
+    """Raise botocore's ClientError unless the catalog object is in the bucket."""
+    _s3().head_object(Bucket=AWS_BUCKET_NAME, Key=key)
+
+
+def read_rows(lines):
+    """Split catalog lines (tab or comma separated, with a header) into raw rows, lazily."""
+    lines = iter(lines)
+    header = next(lines, '')
+    return csv.reader(lines, delimiter='\t' if '\t' in header else ',')
+
+
+def parse_row(row):
+    """Product fields of one catalog row, or None when the row is malformed."""
+    if len(row) < 10:
+        return None
+    return {
+        'ndc': row[0],
+        'product_name': row[1].title(),
+        'strength': row[2] if row[2] else 'Generic',
+        'image_url': DEFAULT_IMAGE_URL,  # replace with "image_url_prefix + row[3]"
+        'manufacturer_name': row[5],
+        'type': 'OTC' if 'OTC' in row[7] else 'RX',
+        'category': row[8],
+        'price': row[9],
+    }
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _bulk_write(db, requests, keys):
+    """Run an unordered bulk write; returns {key: error code} of the requests that failed."""
+    try:
+        db.products.bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        return {keys[error['index']]: error['code'] for error in e.details['writeErrors']}
+    return {}
+
+
+def write_chunk(db, rows):
+    """Upsert a chunk of parsed rows keyed on (product_name, manufacturer_name) of the live products.
+
+    The first unordered bulk write creates or refreshes the products, the second sets the
+    price of each strength, adding the strength when the product does not offer it yet.
+    The key is unique, so when two imports create the same product at once the loser's upsert
+    fails with a duplicate key and is retried as an update of the winner's product.
+    Orders containing a product whose type the chunk changed get their has_rx recomputed.
+    Returns (rows written, rows failed).
+    """
+    products, prices, row_counts = {}, {}, collections.Counter()
+    for row in rows:
+        key = (row['product_name'], row['manufacturer_name'])
+        products[key] = {field: row[field] for field in PRODUCT_FIELDS}
+        prices[key + (row['strength'],)] = row['price']
+        row_counts[key] += 1
+
+    retyped = []
+    names = list({name for name, _ in products})
+    for product in db.products.find({'product_name': {'$in': names}, 'is_archived': False},
+                                    projection={'product_name': True, 'manufacturer_name': True, 'type': True}):
+        key = (product['product_name'], product.get('manufacturer_name'))
+        if key in products and products[key]['type'] != product.get('type'):
+            retyped.append(product['_id'])
+
+    upserts = {
+        (name, manufacturer): UpdateOne({'product_name': name, 'manufacturer_name': manufacturer, 'is_archived': False},
+                                        {'$set': products[name, manufacturer],
+                                         '$setOnInsert': {'available_options': []}},
+                                        upsert=True)
+        for name, manufacturer in products
+    }
+    keys = list(upserts)
+    failed = _bulk_write(db, list(upserts.values()), keys)
+    retry = [key for key, code in failed.items() if code == DUPLICATE_KEY]
+    if retry:
+        for key in retry:
+            del failed[key]
+        failed.update(_bulk_write(db, [upserts[key] for key in retry], retry))
+    failed = set(failed)
+
+    options, option_keys = [], []
+    for (name, manufacturer, strength), price in prices.items():
+        if (name, manufacturer) in failed:
+            continue
+        key = {'product_name': name, 'manufacturer_name': manufacturer, 'is_archived': False}
+        options.append(UpdateOne(dict(key, **{'available_options.strength': strength}),
+                                 {'$set': {'available_options.$.price': price}}))
+        options.append(UpdateOne(dict(key, **{'available_options.strength': {'$ne': strength}}),
+                                 {'$push': {'available_options': {'strength': strength, 'price': price}}}))
+        option_keys += [(name, manufacturer)] * 2
+    if options:
+        failed |= set(_bulk_write(db, options, option_keys))
+
+    product_types.refresh(db, retyped)
+
+    failed_rows = sum(row_counts[key] for key in failed)
+    return len(rows) - failed_rows, failed_rows
+
+
+def dedupe(db):
+    """Archive all but the oldest live product of each (product_name, manufacturer_name), so the key
+    can carry its unique index. Strengths only a duplicate offers are added to the product kept.
+
+    Returns the number of products archived.
+    """
+    pipeline = [
+        {'$match': {'is_archived': False}},
+        {'$sort': {'_id': 1}},
+        {'$group': {'_id': {'product_name': '$product_name', 'manufacturer_name': '$manufacturer_name'},
+                    'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+    ]
+    archived = 0
+    for group in db.products.aggregate(pipeline, allowDiskUse=True):
+        keep, duplicates = group['ids'][0], group['ids'][1:]
+        kept = db.products.find_one({'_id': keep}, projection={'available_options': True})
+        strengths = {option.get('strength') for option in kept.get('available_options') or []}
+        extra = []
+        for product in db.products.find({'_id': {'$in': duplicates}}, projection={'available_options': True},
+                                        sort=[('_id', 1)]):
+            for option in product.get('available_options') or []:
+                if option.get('strength') not in strengths:
+                    strengths.add(option.get('strength'))
+                    extra.append(option)
+        if extra:
+            db.products.update_one({'_id': keep}, {'$push': {'available_options': {'$each': extra}}})
+        archived += db.products.update_many({'_id': {'$in': duplicates}}, {'$set': {
+            'is_archived': True,
+            'merged_into': keep,
+            'history.archived_on': datetime.datetime.utcnow()}}).modified_count
+        product_types.refresh(db, duplicates)
+    if archived:
+        counts.invalidate(db, 'products')
+    return archived
+
+
+def ingest(db, lines, chunk_size=CATALOG_CHUNK_SIZE, progress=None):
+    """Load a catalog from an iterable of lines, holding at most `chunk_size` rows in memory.
+
+    `progress`, if given, is called with the running counts after every chunk.
+    """
+    summary = {'parsed': 0, 'upserted': 0, 'skipped': 0, 'failed': 0}
+    for chunk in _chunks(read_rows(lines), chunk_size):
+        rows = [row for row in map(parse_row, chunk) if row is not None]
+        summary['parsed'] += len(chunk)
+        summary['skipped'] += len(chunk) - len(rows)
+        if rows:
+            upserted, failed = write_chunk(db, rows)
+            summary['upserted'] += upserted
+            summary['failed'] += failed
+        if progress:
+            progress(summary)
+    counts.invalidate(db, 'products')
+    return summary
+
+
+def import_job(db, params, progress):
+    """Job handler: ingest the uploaded catalog `params['s3_file']` and publish it."""
+    summary = ingest(db, open_s3(params['s3_file']), progress=progress)
+    formulary.publish_default(db)
+    return summary
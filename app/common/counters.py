@@ -0,0 +1,82 @@
+import os
+import threading
+
+from pymongo import ReturnDocument
+
+from app.common.env import *
+
+
+class BlockAllocator:
+    """Hands out unique, increasing integers from a document of the `counters` collection.
+
+    Each process reserves `block_size` numbers at a time with an atomic $inc and serves them
+    locally, so allocation costs one round trip per block. Numbers are unique across workers,
+    but not gap-free: a worker that exits discards the rest of its block.
+    """
+
+    def __init__(self, name, start, block_size, seed_field=None, seed_collection=None):
+        self.name = name
+        self.start = start
+        self.block_size = max(1, block_size)
+        self._seed_field = seed_field
+        self._seed_collection = seed_collection
+        self._lock = threading.Lock()
+        self._pid = None
+        self._next = 0
+        self._end = 0
+        self._seeded = False
+
+    def _seed(self, db):
+        """Make sure the counter is at least past every number already stored."""
+        floor = self.start - 1
+        if self._seed_collection:
+            last = db[self._seed_collection].find_one(
+                {self._seed_field: {'$exists': True}},
+                projection={self._seed_field: True},
+                sort=[(self._seed_field, -1)])
+            if last:
+                floor = max(floor, int(last[self._seed_field]))
+        db.counters.update_one({'_id': self.name}, {'$max': {'value': floor}}, upsert=True)
+        self._seeded = True
+
+    def _reserve(self, db, count):
+        counter = db.counters.find_one_and_update(
+            {'_id': self.name},
+            {'$inc': {'value': count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER)
+        end = counter['value'] + 1
+        return end - count, end
+
+    def allocate(self, db, count=1):
+        """Return a list of `count` numbers.
+
+        Requests that fit in a block are served from the local block; larger ones get a
+        dedicated contiguous range straight from the counter.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._next = self._end = 0
+                self._seeded = False
+
+            if not self._seeded:
+                self._seed(db)
+
+            if count > self.block_size:
+                first, end = self._reserve(db, count)
+                return list(range(first, end))
+
+            if self._end - self._next < count:
+                self._next, self._end = self._reserve(db, self.block_size)
+
+            numbers = list(range(self._next, self._next + count))
+            self._next += count
+            return numbers
+
+    def next(self, db):
+        return self.allocate(db, 1)[0]
+
+
+order_numbers = BlockAllocator('order_number', ORDER_NUMBER_START, ORDER_NUMBER_BLOCK_SIZE,
+                               seed_field='order_number', seed_collection='orders')
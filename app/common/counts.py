@@ -0,0 +1,57 @@
+import datetime
+import hashlib
+
+from bson import json_util
+
+from app.common import archive
+from app.common.env import *
+
+EXACT = 'exact'
+ESTIMATE = 'estimate'
+MODES = (EXACT, ESTIMATE)
+
+ARCHIVED = {'is_archived': True}
+
+
+def _key(collection, query):
+    shape = json_util.dumps(query, sort_keys=True)
+    return f"{collection}:{hashlib.sha1(shape.encode()).hexdigest()}"
+
+
+def count(db, collection, query, mode=EXACT):
+    """Total number of documents matching `query`, for a listing's `count` field.
+
+    Exact counts are cached in the `counts` collection for COUNT_CACHE_SECONDS, shared by all
+    workers, and dropped whenever a resource writes to `collection` (see invalidate). With
+    mode 'estimate', an unfiltered count is answered from collection statistics without touching
+    the documents. collstats includes archived documents, so a count of the live ones subtracts
+    the cached count of the archived ones; other filters still get the cached exact count.
+    """
+    if mode == ESTIMATE and query == {}:
+        return db.command('collstats', collection)['count']
+    if mode == ESTIMATE and query == archive.ACTIVE:
+        return count(db, collection, {}, mode) - count(db, collection, ARCHIVED)
+
+    return cached(db, _key(collection, query), [collection], lambda: db[collection].count(query))
+
+
+def cached(db, key, collections, compute, seconds=COUNT_CACHE_SECONDS):
+    """compute() cached in `counts` under `key` for `seconds`, dropped early when any of `collections`
+    is invalidated."""
+    now = datetime.datetime.utcnow()
+    hit = db.counts.find_one({'_id': key, 'expires_on': {'$gt': now}}, projection={'value': True})
+    if hit is not None:
+        return hit['value']
+
+    value = compute()
+    db.counts.replace_one({'_id': key}, {
+        'collection': list(collections),
+        'value': value,
+        'expires_on': now + datetime.timedelta(seconds=seconds),
+    }, upsert=True)
+    return value
+
+
+def invalidate(db, *collections):
+    """Forget the cached counts of `collections`; call after inserting, archiving or re-filing documents."""
+    db.counts.delete_many({'collection': {'$in': list(collections)}})
@@ -19,3 +19,64 @@ SUBSCRIPTION_CLIENT_TEMPLATE = os.environ.get('SUBSCRIPTION_CLIENT_TEMPLATE')
 AWS_ACCESS_KEY = os.environ['AWS_ACCESS_KEY']
 AWS_SECRET_KEY = os.environ['AWS_SECRET_KEY']
 AWS_BUCKET_NAME = os.environ['AWS_BUCKET_NAME']
+
+# mongo connection pool
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 1000))
+MONGO_WAIT_QUEUE_MULTIPLE = int(os.environ.get('MONGO_WAIT_QUEUE_MULTIPLE', 4))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 2000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+
+# benchmarks: where they seed and drop their synthetic collections, never the application database
+BENCH_MONGO_HOST = os.environ.get('BENCH_MONGO_HOST', MONGO_HOST)
+BENCH_MONGO_DB = os.environ.get('BENCH_MONGO_DB', 'bench')
+
+# order numbers
+ORDER_NUMBER_START = int(os.environ.get('ORDER_NUMBER_START', 100001))
+ORDER_NUMBER_BLOCK_SIZE = int(os.environ.get('ORDER_NUMBER_BLOCK_SIZE', 10))
+
+# notification outbox
+OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', 8))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 8))
+OUTBOX_BACKOFF_SECONDS = int(os.environ.get('OUTBOX_BACKOFF_SECONDS', 15))
+OUTBOX_LOCK_SECONDS = int(os.environ.get('OUTBOX_LOCK_SECONDS', 300))
+OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', 1))
+
+# upstream http services
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 2))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 10))
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 10))
+UPSTREAM_FAILURE_THRESHOLD = int(os.environ.get('UPSTREAM_FAILURE_THRESHOLD', 5))
+UPSTREAM_RESET_SECONDS = float(os.environ.get('UPSTREAM_RESET_SECONDS', 30))
+
+# product catalog import
+CATALOG_CHUNK_SIZE = int(os.environ.get('CATALOG_CHUNK_SIZE', 1000))
+
+# background jobs
+JOBS_POLL_SECONDS = float(os.environ.get('JOBS_POLL_SECONDS', 2))
+JOBS_LOCK_SECONDS = int(os.environ.get('JOBS_LOCK_SECONDS', 600))
+JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', 3))
+
+# listing counts
+COUNT_CACHE_SECONDS = int(os.environ.get('COUNT_CACHE_SECONDS', 30))
+VET_SUMMARY_CACHE_SECONDS = int(os.environ.get('VET_SUMMARY_CACHE_SECONDS', 5))
+
+# response encoding: auto, orjson or stdlib
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto')
+
+# subscription renewals
+RENEWALS_BATCH_SIZE = int(os.environ.get('RENEWALS_BATCH_SIZE', 500))
+
+# bulk order creation
+ORDERS_BATCH_MAX = int(os.environ.get('ORDERS_BATCH_MAX', 100))
+
+# streaming patient import
+PATIENTS_IMPORT_CHUNK = int(os.environ.get('PATIENTS_IMPORT_CHUNK', 1000))
+PATIENTS_IMPORT_MAX_ERRORS = int(os.environ.get('PATIENTS_IMPORT_MAX_ERRORS', 100))
+
+# order exports
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))
+
+# vet patient search: most clients whose name matches the query that are searched for patients
+PATIENT_SEARCH_MAX_CLIENTS = int(os.environ.get('PATIENT_SEARCH_MAX_CLIENTS', 100))
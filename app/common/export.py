@@ -0,0 +1,131 @@
+import csv
+import io
+import itertools
+
+from flask import Response, stream_with_context
+from pymongo import ASCENDING
+
+from app.common import archive
+from app.common import json
+from app.common import loader
+from app.common.env import *
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+FORMATS = (CSV, NDJSON)
+
+MIMETYPES = {
+    CSV: 'text/csv',
+    NDJSON: 'application/x-ndjson',
+}
+
+COLUMNS = ['order_id', 'order_number', 'order_date', 'order_status', 'type', 'box_no',
+           'client_name', 'client_email', 'patient_name', 'vet_name', 'hospital_name', 'pharmacy_name',
+           'shipping_method', 'shipping_date', 'tracking_number',
+           'subtotal_price', 'tax', 'shipping_amount', 'total_price']
+
+PROJECTION = {
+    'order_number': True, 'history.created_on': True, 'order_status': True, 'type': True, 'box_no': True,
+    'client_id': True, 'patient_id': True, 'vet_id': True, 'hospital_id': True, 'pharmacy_id': True,
+    'shipping_method': True, 'shipping_date': True, 'tracking_number': True,
+    'subtotal_price': True, 'tax': True, 'shipping_amount': True, 'total_price': True,
+}
+
+REFS = {
+    'client_id': ('clients', {'first_name': True, 'last_name': True, 'email_address': True}),
+    'patient_id': ('patients', {'name': True}),
+    'vet_id': ('vets', {'first_name': True, 'last_name': True}),
+    'hospital_id': ('hospitals', {'name': True}),
+    'pharmacy_id': ('pharmacies', {'name': True}),
+}
+
+SORT = [('history.created_on', ASCENDING), ('_id', ASCENDING)]
+
+
+def query(created_from=None, created_to=None, hospital_id=None, pharmacy_id=None):
+    """Orders filter for an export: live orders created in [created_from, created_to), optionally of one
+    hospital and/or one pharmacy."""
+    q = dict(archive.ACTIVE)
+    if hospital_id is not None:
+        q['hospital_id'] = hospital_id
+    if pharmacy_id is not None:
+        q['pharmacy_id'] = pharmacy_id
+    if created_from is not None or created_to is not None:
+        q['history.created_on'] = {}
+        if created_from is not None:
+            q['history.created_on']['$gte'] = created_from
+        if created_to is not None:
+            q['history.created_on']['$lt'] = created_to
+    return q
+
+
+def _name(doc, *fields):
+    return ' '.join(str(doc.get(f, '')) for f in fields) if doc else ''
+
+
+def _row(order, refs):
+    client = refs['client_id'].get(order.get('client_id'))
+    return {
+        'order_id': order['_id'],
+        'order_number': order.get('order_number'),
+        'order_date': order.get('history', {}).get('created_on'),
+        'order_status': order.get('order_status'),
+        'type': order.get('type'),
+        'box_no': order.get('box_no'),
+        'client_name': _name(client, 'first_name', 'last_name'),
+        'client_email': client.get('email_address', '') if client else '',
+        'patient_name': _name(refs['patient_id'].get(order.get('patient_id')), 'name'),
+        'vet_name': _name(refs['vet_id'].get(order.get('vet_id')), 'first_name', 'last_name'),
+        'hospital_name': _name(refs['hospital_id'].get(order.get('hospital_id')), 'name'),
+        'pharmacy_name': _name(refs['pharmacy_id'].get(order.get('pharmacy_id')), 'name'),
+        'shipping_method': order.get('shipping_method'),
+        'shipping_date': order.get('shipping_date'),
+        'tracking_number': order.get('tracking_number'),
+        'subtotal_price': order.get('subtotal_price'),
+        'tax': order.get('tax'),
+        'shipping_amount': order.get('shipping_amount'),
+        'total_price': order.get('total_price'),
+    }
+
+
+def chunks(db, q, chunk_size=EXPORT_CHUNK_SIZE):
+    """Lists of export rows for the orders matching `q`, `chunk_size` at a time.
+
+    Orders come from one cursor fetching `chunk_size` documents per round trip, and the names they
+    refer to are resolved per chunk with one query per collection, so only a chunk is ever in memory.
+    """
+    cursor = db.orders.find(q, projection=PROJECTION, sort=SORT, batch_size=chunk_size)
+    try:
+        while True:
+            orders = list(itertools.islice(cursor, chunk_size))
+            if not orders:
+                return
+            refs = loader.load_refs(db, orders, REFS)
+            yield [_row(order, refs) for order in orders]
+    finally:
+        cursor.close()
+
+
+def _csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, COLUMNS)
+    writer.writeheader()
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _ndjson(chunks):
+    for rows in chunks:
+        yield b''.join(json.dumps(row, False) + b'\n' for row in rows)
+
+
+def response(db, q, fmt, filename):
+    """A streamed response writing the orders matching `q` as CSV or NDJSON."""
+    encode = _csv if fmt == CSV else _ndjson
+    return Response(stream_with_context(encode(chunks(db, q))), mimetype=MIMETYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename={filename}.{fmt}'})
@@ -0,0 +1,189 @@
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
+
+# hospital_id of the default formulary entries
+DEFAULT = None
+DEFAULT_MARGIN = '10%'
+
+# What the functions below need from a hospital document. Load hospitals with this projection,
+# never with the embedded `formulary` array that unmigrated hospitals still carry.
+HOSPITAL_PROJECTION = {'inherits_formulary': True}
+
+ENTRY_PROJECTION = {'_id': False, 'hospital_id': True, 'product_id': True, 'available_options': True,
+                    'margin': True}
+
+
+def migrated(hospital):
+    return 'inherits_formulary' in hospital
+
+
+def _scope(hospital):
+    """hospital_id predicate of the entries visible to `hospital`."""
+    if hospital['inherits_formulary']:
+        return {'$in': [hospital['_id'], DEFAULT]}
+    return hospital['_id']
+
+
+def product_ids(db, hospital):
+    """Ids of every product on the hospital's formulary."""
+    if not migrated(hospital):
+        doc = db.hospitals.find_one({'_id': hospital['_id']}, projection={'formulary.product_id': True})
+        return [entry['product_id'] for entry in doc.get('formulary') or []]
+    return db.formulary.distinct('product_id', {'hospital_id': _scope(hospital)})
+
+
+def entries(db, hospital, product_ids):
+    """The hospital's formulary entries for `product_ids`, as {product_id: entry}.
+
+    A hospital's own entry overrides the default entry for the same product.
+    """
+    product_ids = list(set(product_ids))
+    if not migrated(hospital):
+        doc = next(db.hospitals.aggregate([
+            {'$match': {'_id': hospital['_id']}},
+            {'$project': {'formulary': {'$filter': {
+                'input': '$formulary',
+                'as': 'entry',
+                'cond': {'$in': ['$$entry.product_id', product_ids]}
+            }}}}
+        ]), None) or {}
+        return {entry['product_id']: entry for entry in doc.get('formulary') or []}
+
+    found = {}
+    for entry in db.formulary.find({'hospital_id': _scope(hospital), 'product_id': {'$in': product_ids}},
+                                   projection=ENTRY_PROJECTION):
+        if entry['product_id'] not in found or entry['hospital_id'] == hospital['_id']:
+            found[entry['product_id']] = entry
+    return found
+
+
+def set_price(db, hospital, product_id, strength, price):
+    """Set the hospital's price for one strength of a product; returns whether a price changed.
+
+    The first change to an inherited entry copies it into an entry of the hospital's own.
+    """
+    if not migrated(hospital):
+        return _set_embedded_price(db, hospital['_id'], product_id, strength, price)
+
+    entry = entries(db, hospital, [product_id]).get(product_id)
+    if entry is None or strength not in [option.get('strength') for option in entry['available_options'] or []]:
+        return False
+
+    key = {'hospital_id': hospital['_id'], 'product_id': product_id}
+    if entry['hospital_id'] != hospital['_id']:
+        db.formulary.update_one(key, {'$setOnInsert': {'available_options': entry['available_options'],
+                                                       'margin': entry.get('margin')}}, upsert=True)
+    result = db.formulary.update_one(dict(key, **{'available_options.strength': strength}),
+                                     {'$set': {'available_options.$.price': price}})
+    return bool(result.modified_count)
+
+
+def _set_embedded_price(db, hospital_id, product_id, strength, price):
+    hospital = db.hospitals.find_one({'_id': hospital_id}, projection={'formulary': True})
+    embedded = hospital.get('formulary') or []
+    for entry in embedded:
+        if entry['product_id'] == product_id:
+            for option in entry['available_options']:
+                if option['strength'] == strength:
+                    option['price'] = price
+    return bool(db.hospitals.update_one({'_id': hospital_id, 'inherits_formulary': {'$exists': False}},
+                                        {'$set': {'formulary': embedded}}).modified_count)
+
+
+def replace(db, hospital_id, new_entries):
+    """Give the hospital exactly `new_entries` as its formulary, detached from the default.
+
+    The new entries are upserted and the others deleted in one bulk write before the hospital stops
+    inheriting, so orders priced meanwhile always find a formulary, and a failed write leaves the old
+    one in place.
+    """
+    new_entries = {entry['product_id']: entry for entry in new_entries if entry.get('product_id')}
+    writes = [ReplaceOne({'hospital_id': hospital_id, 'product_id': product_id},
+                         dict(entry, hospital_id=hospital_id), upsert=True)
+              for product_id, entry in new_entries.items()]
+    writes.append(DeleteMany({'hospital_id': hospital_id, 'product_id': {'$nin': list(new_entries)}}))
+    db.formulary.bulk_write(writes, ordered=True)
+    db.hospitals.update_one({'_id': hospital_id}, {'$set': {'inherits_formulary': False}, '$unset': {'formulary': ''}})
+
+
+def publish_default(db, batch_size=1000):
+    """Refresh the default formulary from the catalog's available_options; returns entries changed."""
+    changed = 0
+    batch = []
+    for product in db.products.find({}, projection={'available_options': True}):
+        batch.append(UpdateOne({'hospital_id': DEFAULT, 'product_id': product['_id']},
+                               {'$set': {'available_options': product.get('available_options', [])},
+                                '$setOnInsert': {'margin': DEFAULT_MARGIN}}, upsert=True))
+        if len(batch) == batch_size:
+            result = db.formulary.bulk_write(batch, ordered=False)
+            changed += result.upserted_count + result.modified_count
+            batch = []
+    if batch:
+        result = db.formulary.bulk_write(batch, ordered=False)
+        changed += result.upserted_count + result.modified_count
+    return changed
+
+
+def defaults(db):
+    """The default formulary as {product_id: entry}."""
+    return {entry['product_id']: entry
+            for entry in db.formulary.find({'hospital_id': DEFAULT}, projection=ENTRY_PROJECTION)}
+
+
+def _overrides(entry, default):
+    """Whether a hospital's entry differs from the default entry, in its options or a margin of its own."""
+    return (entry.get('available_options') != default.get('available_options')
+            or entry.get('margin') not in (None, default.get('margin')))
+
+
+def migrate_hospital(db, hospital_id, default_entries, batch_size=1000):
+    """Move a hospital's embedded formulary into the formulary collection.
+
+    A hospital listing exactly the default products inherits the default formulary and keeps
+    only the entries whose options or margin differ from it; any other hospital keeps a full copy. The
+    embedded array is dropped only if nobody changed it meanwhile, otherwise the move is
+    retried. Returns whether the hospital inherits, or None if it had already been migrated.
+    """
+    while True:
+        hospital = db.hospitals.find_one({'_id': hospital_id, 'inherits_formulary': {'$exists': False}},
+                                         projection={'formulary': True})
+        if hospital is None:
+            return None
+        embedded = hospital.get('formulary')
+        own = {entry['product_id']: entry for entry in embedded or [] if entry.get('product_id')}
+
+        inherits = set(own) == set(default_entries)
+        if inherits:
+            own = {product_id: entry for product_id, entry in own.items()
+                   if _overrides(entry, default_entries[product_id])}
+
+        db.formulary.delete_many({'hospital_id': hospital_id})
+        batch = [UpdateOne({'hospital_id': hospital_id, 'product_id': product_id},
+                           {'$set': {'available_options': entry.get('available_options'),
+                                     'margin': entry.get('margin')}}, upsert=True)
+                 for product_id, entry in own.items()]
+        for start in range(0, len(batch), batch_size):
+            db.formulary.bulk_write(batch[start:start + batch_size], ordered=False)
+
+        result = db.hospitals.update_one(
+            {'_id': hospital_id, 'inherits_formulary': {'$exists': False}, 'formulary': embedded},
+            {'$set': {'inherits_formulary': inherits}, '$unset': {'formulary': ''}})
+        if result.modified_count:
+            return inherits
+
+
+def migrate(db, batch_size=1000):
+    """Online migration of every hospital still carrying an embedded formulary.
+
+    Readers fall back to the embedded array until their hospital is migrated, so this can run
+    while the API serves traffic. Returns (hospitals inheriting, hospitals with their own copy).
+    """
+    publish_default(db, batch_size)
+    default_entries = defaults(db)
+    inheriting = custom = 0
+    for hospital in db.hospitals.find({'inherits_formulary': {'$exists': False}}, projection={'_id': True}):
+        inherits = migrate_hospital(db, hospital['_id'], default_entries, batch_size)
+        if inherits:
+            inheriting += 1
+        elif inherits is not None:
+            custom += 1
+    return inheriting, custom
@@ -0,0 +1,166 @@
+from bson import json_util
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from app.common import mongo
+
+
+def _index(*keys, **kwargs):
+    keys = [k if isinstance(k, tuple) else (k, ASCENDING) for k in keys]
+    kwargs.setdefault('name', '_'.join(f'{field}_{direction}' for field, direction in keys))
+    return IndexModel(keys, background=True, **kwargs)
+
+
+# Every query shape issued from app/resources, grouped by collection.
+REGISTRY = {
+    'orders': [
+        _index('is_archived', '_id'),
+        _index('vet_id', 'is_archived', '_id'),
+        _index('vet_id', 'is_archived', 'has_rx', '_id'),
+        _index('order_contents.product_id', '_id'),
+        _index('vet_id', 'is_archived', 'order_status'),
+        _index('vet_id', 'patient_id', 'is_archived'),
+        _index('vet_id', 'feedback.is_feedback_read', 'is_archived'),
+        _index('client_id', 'is_archived', ('history.created_on', DESCENDING)),
+        _index('is_archived', 'history.created_on', '_id'),
+        _index('pharmacy_id', 'is_archived', 'history.created_on', '_id'),
+        _index('hospital_id', 'is_archived', 'history.created_on', '_id'),
+        _index(('order_number', DESCENDING)),
+        _index('subscription_id', ('order_number', DESCENDING)),
+        _index('renewal_key', unique=True, sparse=True),
+    ],
+    'patients': [
+        _index('is_archived', '_id'),
+        _index('vet_id', 'is_archived', 'name'),
+        _index('vet_id', 'is_archived', 'name_normalized'),
+        _index('vet_id', 'client_id', 'is_archived'),
+        _index('client_id', 'is_archived'),
+    ],
+    'clients': [
+        _index('is_archived'),
+        _index('user_id'),
+        _index('vet_ids', 'client_name_normalized'),
+    ],
+    'vets': [
+        _index('is_archived'),
+        _index('user_id'),
+        _index('hospital_id', 'is_archived'),
+    ],
+    'pharmacies': [
+        _index('is_archived', '_id'),
+        _index('user_id'),
+    ],
+    'hospitals': [
+        _index('is_archived', '_id'),
+        _index('pharmacies.Retail'),
+        _index('pharmacies.Compounded'),
+        _index('pharmacies.502b'),
+    ],
+    'formulary': [
+        _index('hospital_id', 'product_id', unique=True),
+    ],
+    'products': [
+        _index('is_archived', 'product_name', '_id'),
+        _index('product_name', 'manufacturer_name', unique=True, partialFilterExpression={'is_archived': False}),
+        _index('manufacturer_name'),
+        _index('category'),
+    ],
+    'users': [
+        _index('email_address'),
+        _index('confirmation_token', sparse=True),
+        _index('forgot_token', sparse=True),
+    ],
+    'treatment_plans': [
+        _index('vet_id', 'is_archived'),
+    ],
+    'subscriptions': [
+        _index('client_id', 'subscription_status'),
+        _index('client_id', 'is_archived'),
+        _index('vet_id', 'subscription_status', 'is_archived'),
+        _index('subscription_status', 'is_archived', 'upcoming_shipment_date', '_id'),
+    ],
+    'daily_sales': [
+        _index('day', 'hospital_id', 'pharmacy_id', 'type', unique=True),
+        _index('pharmacy_id', 'day'),
+        _index('hospital_id', 'day'),
+    ],
+    'outbox': [
+        _index('status', 'next_attempt_on'),
+        _index('status', 'locked_on'),
+    ],
+    'counts': [
+        _index('collection'),
+        _index('expires_on', expireAfterSeconds=0),
+    ],
+    'jobs': [
+        _index('status', 'history.created_on'),
+        _index('status', 'locked_on'),
+    ],
+}
+
+
+def _keys(index):
+    return tuple((field, int(direction) if isinstance(direction, (int, float)) else direction)
+                 for field, direction in index)
+
+
+def _shape(spec):
+    """Key pattern plus the options that change what an index enforces, of a model document or an
+    index_information() entry."""
+    key = spec['key'].items() if isinstance(spec['key'], dict) else spec['key']
+    return _keys(key), bool(spec.get('unique')), json_util.dumps(spec.get('partialFilterExpression'), sort_keys=True)
+
+
+def ensure(db=None, collections=None):
+    """Create every registered index that is missing; existing ones are left untouched.
+
+    Indexes are built in the background, so this is safe to run against a live database. An index
+    on the same keys that lacks the registered unique or partial filter options is dropped first, as
+    the server refuses two indexes on one key pattern; for a unique index the duplicates must be gone
+    (see catalog.dedupe). Returns the names of the indexes created.
+    """
+    db = mongo.get_db() if db is None else db
+    created = []
+    for name, models in REGISTRY.items():
+        if collections and name not in collections:
+            continue
+        info = db[name].index_information()
+        existing = {_shape(spec) for spec in info.values()}
+        todo = [m for m in models if _shape(m.document) not in existing]
+        for model in todo:
+            keys = _keys(model.document['key'].items())
+            for index_name, spec in info.items():
+                if index_name != '_id_' and _keys(spec['key']) == keys:
+                    db[name].drop_index(index_name)
+        if todo:
+            created += [f'{name}.{n}' for n in db[name].create_indexes(todo)]
+    return created
+
+
+def missing(db=None):
+    """Names of the registered indexes absent from the database."""
+    db = mongo.get_db() if db is None else db
+    absent = []
+    for name, models in REGISTRY.items():
+        existing = {_shape(spec) for spec in db[name].index_information().values()}
+        absent += [f"{name}.{m.document['name']}" for m in models if _shape(m.document) not in existing]
+    return absent
+
+
+def usage(db=None):
+    """Split the database's indexes into registered-but-unused and unregistered ones.
+
+    Usage comes from $indexStats, which counts operations since the server started.
+    """
+    db = mongo.get_db() if db is None else db
+    unused, unregistered = [], []
+    for name, models in REGISTRY.items():
+        registered = {_keys(m.document['key'].items()) for m in models}
+        for stat in db[name].aggregate([{'$indexStats': {}}]):
+            if stat['name'] == '_id_':
+                continue
+            label = f"{name}.{stat['name']}"
+            if _keys(stat['key'].items()) not in registered:
+                unregistered.append(label)
+            elif not stat['accesses']['ops']:
+                unused.append(label)
+    return {'unused': unused, 'unregistered': unregistered}
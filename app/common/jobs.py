@@ -0,0 +1,91 @@
+import datetime
+import logging
+import time
+
+from pymongo import ReturnDocument
+
+from app.common import catalog
+from app.common import mongo
+from app.common.env import *
+
+log = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# kind -> handler(db, params, progress) returning the final progress counts
+HANDLERS = {
+    'catalog_import': catalog.import_job,
+}
+
+
+def submit(kind, params):
+    """Queue a job for the worker; returns its id."""
+    return mongo.get_db().jobs.insert_one({
+        'kind': kind,
+        'params': params,
+        'status': QUEUED,
+        'progress': {},
+        'attempts': 0,
+        'history': {'created_on': datetime.datetime.utcnow()},
+    }).inserted_id
+
+
+def get(job_id):
+    return mongo.get_db().jobs.find_one({'_id': job_id}, projection={'params': False})
+
+
+class Worker:
+    """Runs queued jobs one at a time, outside the request workers.
+
+    Jobs are claimed atomically, so several workers can run side by side. A running job
+    refreshes its lock whenever it reports progress; a job whose lock goes stale (its worker
+    died) is claimed again, up to `max_attempts` times.
+    """
+
+    def __init__(self, poll=JOBS_POLL_SECONDS, lock_seconds=JOBS_LOCK_SECONDS, max_attempts=JOBS_MAX_ATTEMPTS):
+        self.poll = poll
+        self.lock_seconds = lock_seconds
+        self.max_attempts = max_attempts
+
+    def claim(self):
+        now = datetime.datetime.utcnow()
+        return mongo.get_db().jobs.find_one_and_update(
+            {'$or': [
+                {'status': QUEUED},
+                {'status': RUNNING, 'locked_on': {'$lte': now - datetime.timedelta(seconds=self.lock_seconds)}}
+            ]},
+            {'$set': {'status': RUNNING, 'locked_on': now, 'history.started_on': now}, '$inc': {'attempts': 1}},
+            sort=[('history.created_on', 1)],
+            return_document=ReturnDocument.AFTER)
+
+    def process(self, job):
+        db = mongo.get_db()
+
+        def progress(counts):
+            db.jobs.update_one({'_id': job['_id']},
+                               {'$set': {'progress': counts, 'locked_on': datetime.datetime.utcnow()}})
+
+        if job['attempts'] > self.max_attempts:
+            update = {'status': FAILED, 'error': 'Too many attempts'}
+        else:
+            try:
+                update = {'status': DONE, 'progress': HANDLERS[job['kind']](db, job['params'], progress)}
+            except Exception as e:
+                log.exception('job %s failed', job['_id'])
+                update = {'status': FAILED, 'error': str(e)}
+        update['history.finished_on'] = datetime.datetime.utcnow()
+        db.jobs.update_one({'_id': job['_id']}, {'$set': update, '$unset': {'locked_on': ''}})
+        return update['status'] == DONE
+
+    def run(self, once=False):
+        while True:
+            job = self.claim()
+            if job is not None:
+                self.process(job)
+            elif once:
+                return
+            else:
+                time.sleep(self.poll)
@@ -2,25 +2,119 @@ import datetime
 import json
 
 from bson.objectid import ObjectId
+from flask import current_app, make_response, request
+
+from app.common.env import *
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+PRETTY = {'indent': 2, 'separators': (', ', ': ')}
+COMPACT = {'separators': (',', ':')}
+
+# exact-type lookups first; isinstance is only needed for subclasses
+_ENCODERS = {
+    ObjectId: str,
+    datetime.datetime: str,
+}
+
+
+def _encode(o):
+    encode = _ENCODERS.get(type(o))
+    if encode is None:
+        for cls, fn in _ENCODERS.items():
+            if isinstance(o, cls):
+                encode = fn
+                break
+        else:
+            raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+    return encode(o)
 
 
 class MongoEncoder(json.JSONEncoder):
     def default(self, o):
-        if isinstance(o, ObjectId):
-            return str(o)
-        if isinstance(o, datetime.datetime):
-            return str(o)
-        return json.JSONEncoder.default(self, o)
-
-
-class MongoDecoder(json.JSONDecoder):
-    def __init__(self, *args, **kwargs):
-        super().__init__(object_hook=self.objectid_hook, *args, **kwargs)
-
-    def objectid_hook(self, o):
-        for k, v in o.items():
-            if k in ['pims_id', 'clinic_id', 'payment_customer_id']:
-                continue
-            if k.endswith('_id'):
-                o[k] = ObjectId(v)
-        return o
+        try:
+            return _encode(o)
+        except TypeError:
+            return json.JSONEncoder.default(self, o)
+
+
+def _stdlib_dumps(data, pretty=False):
+    return json.dumps(data, cls=MongoEncoder, **(PRETTY if pretty else COMPACT)).encode()
+
+
+def _orjson_dumps(data, pretty=False):
+    if pretty:
+        return _stdlib_dumps(data, pretty)
+    try:
+        # datetimes are passed through so they keep the str() format the stdlib encoder produces
+        return orjson.dumps(data, default=_encode, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    except TypeError:
+        # non-string keys, integers beyond 64 bits, ... - let the stdlib encoder decide
+        return _stdlib_dumps(data)
+
+
+BACKENDS = {'stdlib': _stdlib_dumps}
+if orjson is not None:
+    BACKENDS['orjson'] = _orjson_dumps
+
+
+def _backend(name):
+    if name == 'auto':
+        return BACKENDS.get('orjson', _stdlib_dumps)
+    if name not in BACKENDS:
+        raise ValueError(f'JSON backend {name!r} is not available, choose from {sorted(BACKENDS)}')
+    return BACKENDS[name]
+
+
+dumps = _backend(JSON_BACKEND)
+
+
+def output_json(data, code, headers=None):
+    """Flask-RESTful representation for application/json.
+
+    Responses are compact unless the request asks for ?pretty=1 or the app runs in debug mode.
+    """
+    pretty = current_app.debug or request.args.get('pretty', '').lower() in ('1', 'true')
+    resp = make_response(dumps(data, pretty) + b'\n', code)
+    resp.headers.extend(headers or {})
+    return resp
+
+
+def benchmark(orders=20, products=20, rounds=200):
+    """Time the legacy pretty encoder against each backend on admin orders and products listing payloads."""
+    import timeit
+
+    now = datetime.datetime.utcnow()
+    order = {
+        '_id': ObjectId(), 'order_number': 100001, 'type': 'one_time', 'status': 'processing',
+        'client_id': ObjectId(), 'patient_id': ObjectId(), 'vet_id': ObjectId(), 'hospital_id': ObjectId(),
+        'pharmacy_id': ObjectId(), 'pharmacy_type': 'Retail', 'client_name': 'Jane Doe', 'patient_name': 'Rex',
+        'vet_name': 'Dr. John Smith', 'hospital_name': 'Main Street Animal Hospital',
+        'subtotal_price': '59.90', 'total_price': '69.90', 'tax': '5.00', 'shipping_amount': '5.00',
+        'history': {'created_on': now, 'modified_on': now},
+        'order_contents': [{'product_id': ObjectId(), 'product_name': 'Carprofen', 'strength': '75mg',
+                            'quantity': 2, 'product_price': '29.95', 'type': 'RX'} for _ in range(3)],
+    }
+    product = {
+        '_id': ObjectId(), 'product_name': 'Carprofen Chewable Tablets', 'manufacturer_name': 'Zoetis',
+        'ndc': '00000-0000-00', 'stc': '1234', 'type': 'RX', 'category': 'Pain', 'image_url': 'https://x/y.png',
+        'description': 'Non-steroidal anti-inflammatory drug for dogs. ' * 4,
+        'available_options': [{'strength': f'{s}mg', 'price': f'{s}.95'} for s in (25, 75, 100)],
+    }
+    payloads = {
+        'orders': {'orders': [dict(order, _id=ObjectId()) for _ in range(orders)], 'count': 5000},
+        'products': {'products': [dict(product, _id=ObjectId()) for _ in range(products)], 'count': 5000},
+    }
+
+    encoders = {'legacy': lambda data: json.dumps(data, cls=MongoEncoder, **PRETTY)}
+    encoders.update(BACKENDS)
+
+    report = {}
+    for label, data in payloads.items():
+        report[label] = {name: round(timeit.timeit(lambda: encode(data), number=rounds) / rounds * 1e6, 1)
+                         for name, encode in encoders.items()}
+        report[label]['bytes'] = {name: len(encode(data)) for name, encode in encoders.items()}
+    return report
@@ -0,0 +1,58 @@
+def _collect(docs, field):
+    """Gather the distinct, non-null values of `field` across `docs`.
+
+    `field` may point into a list with a dotted path, e.g. 'order_contents.product_id'.
+    """
+    head, _, tail = field.partition('.')
+    ids = set()
+    for doc in docs:
+        value = doc.get(head)
+        if value is None:
+            continue
+        if tail:
+            items = value if isinstance(value, list) else [value]
+            ids |= _collect([i for i in items if isinstance(i, dict)], tail)
+        elif isinstance(value, dict):
+            ids |= {v for v in value.values() if v is not None}
+        elif isinstance(value, list):
+            ids |= {v for v in value if v is not None}
+        else:
+            ids.add(value)
+    return ids
+
+
+def load_by_ids(db, collection, ids, projection=None):
+    """Fetch every document of `collection` whose _id is in `ids` with one $in query.
+
+    Returns a dict keyed by _id; missing ids are simply absent.
+    """
+    ids = [_ for _ in set(ids) if _ is not None]
+    if not ids:
+        return {}
+    return {doc['_id']: doc for doc in db[collection].find({'_id': {'$in': ids}}, projection=projection)}
+
+
+def load_refs(db, docs, refs):
+    """Resolve the foreign keys of a page of documents, one query per collection.
+
+    `refs` maps a field of `docs` to a (collection, projection) pair. Dict-valued fields
+    (like hospital['pharmacies']) and list fields are expanded. The result maps each field
+    to {_id: referenced document}.
+    """
+    docs = list(docs)
+    return {field: load_by_ids(db, collection, _collect(docs, field), projection)
+            for field, (collection, projection) in refs.items()}
+
+
+def count_by(db, collection, field, ids, query=None):
+    """Count documents of `collection` grouped by `field`, restricted to `ids`, in one aggregate."""
+    ids = [_ for _ in set(ids) if _ is not None]
+    if not ids:
+        return {}
+    match = dict(query or {})
+    match[field] = {'$in': ids}
+    pipeline = [
+        {'$match': match},
+        {'$group': {'_id': f'${field}', 'count': {'$sum': 1}}}
+    ]
+    return {row['_id']: row['count'] for row in db[collection].aggregate(pipeline)}
@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+
+from pymongo import MongoClient, monitoring
+
+from app.common.env import *
+
+DATABASE = 'db'
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+_listener = None
+
+
+class CommandStats(monitoring.CommandListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created_on = time.time()
+        self.commands = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def started(self, event):
+        with self._lock:
+            self.in_flight += 1
+
+    def succeeded(self, event):
+        self._finish(event.duration_micros, error=False)
+
+    def failed(self, event):
+        self._finish(event.duration_micros, error=True)
+
+    def _finish(self, duration_micros, error):
+        ms = duration_micros / 1000.0
+        with self._lock:
+            self.in_flight -= 1
+            self.commands += 1
+            self.errors += int(error)
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'commands': self.commands,
+                'errors': self.errors,
+                'in_flight': self.in_flight,
+                'avg_ms': round(self.total_ms / self.commands, 3) if self.commands else 0.0,
+                'max_ms': round(self.max_ms, 3),
+                'uptime_s': round(time.time() - self.created_on, 1),
+            }
+
+
+def _pool_options():
+    return {
+        'maxPoolSize': MONGO_MAX_POOL_SIZE,
+        'minPoolSize': MONGO_MIN_POOL_SIZE,
+        'waitQueueTimeoutMS': MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        'waitQueueMultiple': MONGO_WAIT_QUEUE_MULTIPLE,
+        'connectTimeoutMS': MONGO_CONNECT_TIMEOUT_MS,
+        'serverSelectionTimeoutMS': MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    }
+
+
+def get_client():
+    """Return the MongoClient shared by every request of this worker process.
+
+    The client is built lazily on first use and rebuilt when the pid changes, so a client
+    inherited from the uWSGI master is never used by a forked worker.
+    """
+    global _client, _client_pid, _listener
+
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _lock:
+        if _client is None or _client_pid != pid:
+            _listener = CommandStats()
+            _client = MongoClient(host=MONGO_HOST, connect=False,
+                                  event_listeners=[_listener], **_pool_options())
+            _client_pid = pid
+
+    return _client
+
+
+def get_db():
+    return get_client()[DATABASE]
+
+
+def get_bench_db(host=BENCH_MONGO_HOST, name=BENCH_MONGO_DB):
+    """A database of its own for benchmarks to seed and drop collections in."""
+    if name == DATABASE and host == MONGO_HOST:
+        raise ValueError(f'refusing to benchmark in the application database {name!r}')
+    return MongoClient(host=host, connect=False, **_pool_options())[name]
+
+
+def stats():
+    get_client()
+    return {
+        'pid': _client_pid,
+        'pool': _pool_options(),
+        'commands': _listener.snapshot(),
+    }
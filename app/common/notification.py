@@ -1,16 +1,28 @@
-import requests
 from flask import abort
-from pymongo import MongoClient
 
+from app.common import loader
+from app.common import mongo
+from app.common import outbox
 from app.common.env import *
 
-mongo_cli = MongoClient(host=MONGO_HOST, connect=False)
+CHANNELS = ('emails', 'sms')
+
+
+def _queue(email, sms):
+    outbox.enqueue_many([('emails', email), ('sms', sms)])
+
+    resp = {
+        'email': 'queued',
+        'sms': 'queued',
+    }
+
+    return resp, 200
 
 
 def send_confirmation(name, email, phone, token):
     confirm_link = f'{FRONTEND_URL}/confirm?token={token}'
 
-    payload = {
+    body = {
         'from_email': 'noreply@zolutia.com',
         'from_name': 'Zolutia',
         'to_email': email,
@@ -22,8 +34,6 @@ def send_confirmation(name, email, phone, token):
             '{name}': name
         }
     }
-    url = f'{NOTIFICATION_HOST}/api/v1/notifications/emails'
-    email_resp = requests.post(url, json=payload)
 
     sms_text = f'Dear {name},You have been registered to Zolutia. Let’s get started. Click here to complete your ' \
                f'registration.{confirm_link} '
@@ -31,20 +41,11 @@ def send_confirmation(name, email, phone, token):
         'to': phone,
         'message': sms_text
     }
-    url = f'{NOTIFICATION_HOST}/api/v1/notifications/sms'
-    sms_resp = requests.post(url, json=payload)
-
-    resp = {
-        'email': 'sent' if email_resp.status_code == 200 else email_resp.json(),
-        'sms': 'sent' if sms_resp.status_code == 200 else sms_resp.json(),
-    }
-
-    return resp, 200
 
+    return _queue(body, payload)
 
-def notify_pharmacy_order(pharmacy_id, order_no):
-    pharmacy = mongo_cli.db.pharmacies.find_one({'_id': pharmacy_id})
 
+def _pharmacy_order(pharmacy, order_no):
     body = {
         'from_email': 'noreply@zolutia.com',
         'from_name': 'Zolutia',
@@ -57,28 +58,23 @@ def notify_pharmacy_order(pharmacy_id, order_no):
             '{order_no}': str(order_no),
         }
     }
-    url = f'{NOTIFICATION_HOST}/api/v1/notifications/emails'
-    email_resp = requests.post(url, json=body)
 
     sms_text = f"Dear {pharmacy['name']}, you have a new order no{order_no} in Zolutia. For more details, log in."
     payload = {
         'to': pharmacy['phone'],
         'message': sms_text
     }
-    url = f'{NOTIFICATION_HOST}/api/v1/notifications/sms'
-    sms_resp = requests.post(url, json=payload)
 
-    resp = {
-        'email': 'sent' if email_resp.status_code == 200 else email_resp.json(),
-        'sms': 'sent' if sms_resp.status_code == 200 else sms_resp.json(),
-    }
+    return body, payload
 
-    return resp, 200
 
+def notify_pharmacy_order(pharmacy_id, order_no):
+    pharmacy = mongo.get_db().pharmacies.find_one({'_id': pharmacy_id})
 
-def notify_client_order(client_id, order_no):
-    client = mongo_cli.db.clients.find_one({'_id': client_id})
+    return _queue(*_pharmacy_order(pharmacy, order_no))
 
+
+def _client_order(client, order_no):
     body = {
         'from_email': 'sales@zolutia.com',
         'from_name': 'Zolutia',
@@ -91,8 +87,6 @@ def notify_client_order(client_id, order_no):
             '{order}': str(order_no)
         }
     }
-    url = f'{NOTIFICATION_HOST}/api/v1/notifications/emails'
-    email_resp = requests.post(url, json=body)
     client_name = f"{client['first_name']} {client['last_name']}"
 
     sms_text = f"Dear {client_name}, you have a new order no{order_no} in Zolutia. For more details, log in."
@@ -100,19 +94,18 @@ def notify_client_order(client_id, order_no):
         'to': client['phone']['cell'],
         'message': sms_text
     }
-    url = f'{NOTIFICATION_HOST}/api/v1/notifications/sms'
-    sms_resp = requests.post(url, json=payload)
 
-    resp = {
-        'email': 'sent' if email_resp.status_code == 200 else email_resp.json(),
-        'sms': 'sent' if sms_resp.status_code == 200 else sms_resp.json(),
-    }
+    return body, payload
 
-    return resp, 200
+
+def notify_client_order(client_id, order_no):
+    client = mongo.get_db().clients.find_one({'_id': client_id})
+
+    return _queue(*_client_order(client, order_no))
 
 
 def notify_client_shipping(client_id, order_no, tracking_no):
-    client = mongo_cli.db.clients.find_one({'_id': client_id})
+    client = mongo.get_db().clients.find_one({'_id': client_id})
 
     body = {
         'from_email': 'sales@zolutia.com',
@@ -127,8 +120,6 @@ def notify_client_shipping(client_id, order_no, tracking_no):
             '{tracking}': str(tracking_no)
         }
     }
-    url = f'{NOTIFICATION_HOST}/api/v1/notifications/emails'
-    email_resp = requests.post(url, json=body)
     client_name = f"{client['first_name']} {client['last_name']}"
 
     sms_text = f"Hello {client_name}, Your Zolutia Box for order no{order_no} has been shipped! Please click " \
@@ -137,19 +128,11 @@ def notify_client_shipping(client_id, order_no, tracking_no):
         'to': client['phone']['cell'],
         'message': sms_text
     }
-    url = f'{NOTIFICATION_HOST}/api/v1/notifications/sms'
-    sms_resp = requests.post(url, json=payload)
 
-    resp = {
-        'email': 'sent' if email_resp.status_code == 200 else email_resp.json(),
-        'sms': 'sent' if sms_resp.status_code == 200 else sms_resp.json(),
-    }
+    return _queue(body, payload)
 
-    return resp, 200
 
-
-def notify_client_subscription(client_id, order_date):
-    client = mongo_cli.db.clients.find_one({'_id': client_id})
+def _client_subscription(client, order_date):
     client_name = f"{client['first_name']} {client['last_name']}"
 
     body = {
@@ -163,43 +146,65 @@ def notify_client_subscription(client_id, order_date):
             '{order_date}': str(order_date.strftime('%Y-%m-%d')),
         }
     }
-    url = f'{NOTIFICATION_HOST}/api/v1/notifications/emails'
-    email_resp = requests.post(url, json=body)
 
     sms_text = "Your first Care Plan order is being processed! Access your account here www.Zolutia.com."
     payload = {
         'to': client['phone']['cell'],
         'message': sms_text
     }
-    url = f'{NOTIFICATION_HOST}/api/v1/notifications/sms'
-    sms_resp = requests.post(url, json=payload)
 
-    resp = {
-        'email': 'sent' if email_resp.status_code == 200 else email_resp.json(),
-        'sms': 'sent' if sms_resp.status_code == 200 else sms_resp.json(),
-    }
+    return body, payload
+
+
+def notify_client_subscription(client_id, order_date):
+    client = mongo.get_db().clients.find_one({'_id': client_id})
+
+    return _queue(*_client_subscription(client, order_date))
 
-    return resp, 200
+
+def notify_orders(orders, subscriptions_started=False):
+    """Queue the pharmacy and client notifications of several new orders with one outbox insert.
+
+    Pharmacies and clients are loaded with one query each. With `subscriptions_started`, subscription
+    orders also get the notice that their subscription has started.
+    """
+    db = mongo.get_db()
+    pharmacies = loader.load_by_ids(db, 'pharmacies', [order.get('pharmacy_id') for order in orders])
+    clients = loader.load_by_ids(db, 'clients', [order['client_id'] for order in orders])
+
+    messages = []
+    for order in orders:
+        pharmacy = pharmacies.get(order.get('pharmacy_id'))
+        client = clients.get(order['client_id'])
+        if pharmacy:
+            messages += zip(CHANNELS, _pharmacy_order(pharmacy, order['order_number']))
+        if client:
+            messages += zip(CHANNELS, _client_order(client, order['order_number']))
+            if subscriptions_started and order['type'] == 'subscription':
+                messages += zip(CHANNELS, _client_subscription(client, order['shipping_date']))
+
+    outbox.enqueue_many(messages)
+    return len(messages)
 
 
 def notify_forgot_password(email, token):
-    user = mongo_cli.db.users.find_one({'email_address': email})
+    user = mongo.get_db().users.find_one({'email_address': email})
     if not user:
         abort(400)
     elif user['role'] == 'vet':
-        vet = mongo_cli.db.vets.find_one({'user_id': user['_id']})
+        vet = mongo.get_db().vets.find_one({'user_id': user['_id']})
         if not vet:
             abort(400)
         user['name'] = f"{vet['first_name']} {vet['last_name']}"
         user['phone'] = vet['phone']['work']
     elif user['role'] == 'pharmacy':
-        pharmacy = mongo_cli.db.pharmacies.find_one({'user_id': user['_id']})
+        pharmacy = mongo.get_db().pharmacies.find_one({'user_id': user['_id']})
         if not pharmacy:
             abort(400)
         user['name'] = pharmacy['name']
         user['phone'] = pharmacy['phone']
     elif user['role'] == 'client':
-        client = mongo_cli.db.client.find_one({'user_id': user['_id']})
+        client = mongo.get_db().client.find_one({'user_id': user['_id']})
         if not client:
             abort(400)
         user['name'] = f"{client['first_name']} {client['last_name']}"
@@ -217,8 +222,6 @@ def notify_forgot_password(email, token):
             '{link}': confirm_link,
         }
     }
-    url = f'{NOTIFICATION_HOST}/api/v1/notifications/emails'
-    email_resp = requests.post(url, json=body)
 
     sms_text = f"We’ve received a request to reset your password. " \
                f"Click here to reset your Zolutia password: {confirm_link}."
@@ -226,35 +229,28 @@ def notify_forgot_password(email, token):
         'to': user['phone'],
         'message': sms_text
     }
-    url = f'{NOTIFICATION_HOST}/api/v1/notifications/sms'
-    sms_resp = requests.post(url, json=payload)
-
-    resp = {
-        'email': 'sent' if email_resp.status_code == 200 else email_resp.json(),
-        'sms': 'sent' if sms_resp.status_code == 200 else sms_resp.json(),
-    }
 
-    return resp, 200
+    return _queue(body, payload)
 
 
 def notify_successful_registration(token):
-    user = mongo_cli.db.users.find_one({'confirmation_token': token})
+    user = mongo.get_db().users.find_one({'confirmation_token': token})
     if not user:
         abort(400)
     elif user['role'] == 'vet':
-        vet = mongo_cli.db.vets.find_one({'user_id': user['_id']})
+        vet = mongo.get_db().vets.find_one({'user_id': user['_id']})
         if not vet:
             abort(400)
         user['name'] = f"{vet['first_name']} {vet['last_name']}"
         user['phone'] = vet['phone']['work']
     elif user['role'] == 'pharmacy':
-        pharmacy = mongo_cli.db.pharmacies.find_one({'user_id': user['_id']})
+        pharmacy = mongo.get_db().pharmacies.find_one({'user_id': user['_id']})
         if not pharmacy:
             abort(400)
         user['name'] = pharmacy['name']
         user['phone'] = pharmacy['phone']
     elif user['role'] == 'client':
-        client = mongo_cli.db.clients.find_one({'user_id': user['_id']})
+        client = mongo.get_db().clients.find_one({'user_id': user['_id']})
         if not client:
             abort(400)
         user['name'] = f"{client['first_name']} {client['last_name']}"
@@ -268,20 +264,11 @@ def notify_successful_registration(token):
         'subject': 'Welcome to Zolutia!',
         'template_id': WELCOME_TEMPLATE,
     }
-    url = f'{NOTIFICATION_HOST}/api/v1/notifications/emails'
-    email_resp = requests.post(url, json=body)
 
     sms_text = 'Welcome to Zolutia! Access your new account here: www.Zolutia.com'
     payload = {
         'to': user['phone'],
         'message': sms_text
     }
-    url = f'{NOTIFICATION_HOST}/api/v1/notifications/sms'
-    sms_resp = requests.post(url, json=payload)
-
-    resp = {
-        'email': 'sent' if email_resp.status_code == 200 else email_resp.json(),
-        'sms': 'sent' if sms_resp.status_code == 200 else sms_resp.json(),
-    }
 
-    return resp, 200
+    return _queue(body, payload)
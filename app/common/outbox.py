@@ -0,0 +1,119 @@
+import datetime
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from pymongo import ReturnDocument
+
+from app.common import mongo
+from app.common import upstream
+from app.common.env import *
+
+log = logging.getLogger(__name__)
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+DEAD = 'dead'
+
+
+def enqueue_many(messages):
+    """Store (channel, payload) messages for the notification service with one insert; `channel` is
+    'emails' or 'sms'."""
+    now = datetime.datetime.utcnow()
+    docs = [{
+        'channel': channel,
+        'payload': payload,
+        'status': PENDING,
+        'attempts': 0,
+        'next_attempt_on': now,
+        'history': {'created_on': now},
+    } for channel, payload in messages]
+    if not docs:
+        return []
+    return mongo.get_db().outbox.insert_many(docs, ordered=False).inserted_ids
+
+
+class DeliveryError(Exception):
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+class Dispatcher:
+    """Drains the outbox with a bounded thread pool.
+
+    Messages are claimed atomically, so several dispatchers can run side by side. Failed
+    deliveries are retried with exponential backoff; 4xx answers (other than 429) and
+    messages that run out of attempts are dead-lettered with status 'dead'.
+    """
+
+    def __init__(self, workers=OUTBOX_WORKERS, max_attempts=OUTBOX_MAX_ATTEMPTS,
+                 backoff=OUTBOX_BACKOFF_SECONDS, lock_seconds=OUTBOX_LOCK_SECONDS, poll=OUTBOX_POLL_SECONDS):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lock_seconds = lock_seconds
+        self.poll = poll
+
+    def claim(self):
+        now = datetime.datetime.utcnow()
+        return mongo.get_db().outbox.find_one_and_update(
+            {'$or': [
+                {'status': PENDING, 'next_attempt_on': {'$lte': now}},
+                {'status': SENDING, 'locked_on': {'$lte': now - datetime.timedelta(seconds=self.lock_seconds)}}
+            ]},
+            {'$set': {'status': SENDING, 'locked_on': now}, '$inc': {'attempts': 1}},
+            sort=[('next_attempt_on', 1)],
+            return_document=ReturnDocument.AFTER)
+
+    def deliver(self, message):
+        try:
+            resp = upstream.notification.post(f"/api/v1/notifications/{message['channel']}", json=message['payload'])
+        except requests.RequestException as e:
+            raise DeliveryError(str(e))
+        if resp.status_code == 200:
+            return
+        permanent = 400 <= resp.status_code < 500 and resp.status_code != 429
+        raise DeliveryError(f'{resp.status_code} {resp.text[:200]}', permanent=permanent)
+
+    def process(self, message):
+        db = mongo.get_db()
+        now = datetime.datetime.utcnow()
+        try:
+            self.deliver(message)
+        except DeliveryError as e:
+            if e.permanent or message['attempts'] >= self.max_attempts:
+                log.warning('dead-lettering outbox message %s: %s', message['_id'], e)
+                update = {'status': DEAD, 'last_error': str(e), 'history.dead_on': now}
+            else:
+                delay = min(self.backoff * 2 ** (message['attempts'] - 1), 3600)
+                update = {'status': PENDING, 'last_error': str(e),
+                          'next_attempt_on': now + datetime.timedelta(seconds=delay)}
+            db.outbox.update_one({'_id': message['_id']}, {'$set': update, '$unset': {'locked_on': ''}})
+            return False
+
+        db.outbox.update_one({'_id': message['_id']},
+                             {'$set': {'status': SENT, 'history.sent_on': now}, '$unset': {'locked_on': ''}})
+        return True
+
+    def drain(self, pool):
+        """Claim up to one message per worker and wait for the batch; returns messages handled."""
+        batch = []
+        while len(batch) < self.workers:
+            message = self.claim()
+            if message is None:
+                break
+            batch.append(message)
+        list(pool.map(self.process, batch))
+        return len(batch)
+
+    def run(self, once=False):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                handled = self.drain(pool)
+                if once and not handled:
+                    return
+                if not handled:
+                    time.sleep(self.poll)
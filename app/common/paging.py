@@ -0,0 +1,164 @@
+import base64
+import binascii
+import time
+
+from bson import json_util
+from flask_restful import abort
+from pymongo import ASCENDING, DESCENDING
+
+NEXT = 'next'
+PREV = 'prev'
+
+
+def _get(doc, field):
+    for part in field.split('.'):
+        doc = doc.get(part) if isinstance(doc, dict) else None
+    return doc
+
+
+def encode(doc, sort, direction=NEXT):
+    """Opaque cursor token pointing just past (or before, for PREV) `doc` in `sort` order."""
+    key = [_get(doc, field) for field, _ in sort]
+    raw = json_util.dumps({'k': key, 'd': direction})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode(token, sort):
+    """(key, direction) of a cursor token; aborts with 400 if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        cursor = json_util.loads(raw)
+        key, direction = cursor['k'], cursor['d']
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        abort(400, message='Invalid cursor')
+    if len(key) != len(sort) or direction not in (NEXT, PREV):
+        abort(400, message='Invalid cursor')
+    return key, direction
+
+
+def _beyond(field, value, direction):
+    """Predicate for values of `field` strictly after `value` when scanning in `direction`."""
+    if value is None:
+        # null sorts first: everything non-null follows it, nothing precedes it
+        return {field: {'$ne': None}} if direction == ASCENDING else None
+    if direction == ASCENDING:
+        return {field: {'$gt': value}}
+    # $lt would skip null and missing values, which sort before any value of the field
+    return {field: {'$not': {'$gte': value}}}
+
+
+def keyset(sort, key):
+    """Filter selecting the documents that come after `key` in `sort` order.
+
+    Expands to (f1 > v1) or (f1 = v1 and f2 > v2) or ..., plus a range bound on the leading
+    field so the query planner can seek into the index instead of filtering a full scan.
+    """
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        beyond = _beyond(field, key[i], direction)
+        if beyond is None:
+            continue
+        clause = {f: v for (f, _), v in zip(sort[:i], key[:i])}
+        clause.update(beyond)
+        clauses.append(clause)
+
+    if not clauses:
+        return {'_id': {'$exists': False}}  # nothing comes after the key
+    if len(clauses) == 1:
+        return clauses[0]
+
+    field, direction = sort[0]
+    if key[0] is None:
+        return {'$or': clauses}
+    bound = {'$gte': key[0]} if direction == ASCENDING else {'$not': {'$gt': key[0]}}
+    return {field: bound, '$or': clauses}
+
+
+def _projection(projection, sort):
+    """`projection` adjusted so the sort fields needed for the cursor tokens are returned."""
+    if not projection:
+        return projection
+    fields = [field for field, _ in sort]
+    if any(value for field, value in projection.items() if field != '_id'):
+        return dict(projection, **{field: True for field in fields})
+    return {field: value for field, value in projection.items() if field not in fields}
+
+
+def _reverse(sort):
+    return [(field, DESCENDING if direction == ASCENDING else ASCENDING) for field, direction in sort]
+
+
+def page(collection, query, sort, limit, cursor=None, offset=0, projection=None):
+    """Fetch one page of `collection`, by cursor token if given, otherwise by offset.
+
+    `sort` must end with _id so every position is unique. Returns (documents, cursors), where
+    cursors holds the 'next' and 'prev' tokens, None at either end of the listing.
+    """
+    if sort[-1][0] != '_id':
+        sort = list(sort) + [('_id', ASCENDING)]
+    limit = max(limit, 1)
+    projection = _projection(projection, sort)
+
+    if cursor is None:
+        docs = list(collection.find(query, projection=projection, sort=sort, skip=offset, limit=limit + 1))
+        more, backward, has_prev = len(docs) > limit, False, offset > 0
+    else:
+        key, direction = decode(cursor, sort)
+        backward = direction == PREV
+        scan = _reverse(sort) if backward else sort
+        docs = list(collection.find({'$and': [query, keyset(scan, key)]}, projection=projection,
+                                    sort=scan, limit=limit + 1))
+        more, has_prev = len(docs) > limit, True
+
+    docs = docs[:limit]
+    if backward:
+        docs.reverse()
+        more, has_prev = True, more
+
+    if not docs:
+        return docs, {NEXT: None, PREV: None}
+    return docs, {
+        NEXT: encode(docs[-1], sort, NEXT) if more else None,
+        PREV: encode(docs[0], sort, PREV) if has_prev else None,
+    }
+
+
+def benchmark(db, count=1000000, limit=20, pages=(1, 10, 100, 1000, 5000), rounds=5):
+    """Compare offset and cursor latency at increasing page depth on a synthetic orders collection.
+
+    The collection `bench_orders` of `db` is dropped and seeded with `count` documents when it holds
+    fewer, so pass a scratch database such as mongo.get_bench_db(), not the application's. Cursor
+    tokens for deep pages are derived from the boundary document rather than by walking pages.
+    """
+    import datetime
+
+    collection = db.bench_orders
+    if collection.count() < count:
+        collection.drop()
+        start = datetime.datetime(2017, 1, 1)
+        for base in range(0, count, 10000):
+            collection.insert_many([{'is_archived': False, 'order_number': n,
+                                     'history': {'created_on': start + datetime.timedelta(minutes=n)}}
+                                    for n in range(base, min(base + 10000, count))], ordered=False)
+        collection.create_index([('is_archived', ASCENDING), ('_id', ASCENDING)])
+
+    query, sort = {'is_archived': False}, [('_id', ASCENDING)]
+
+    def median(fn):
+        timings = []
+        for _ in range(rounds):
+            started = time.time()
+            fn()
+            timings.append((time.time() - started) * 1000)
+        return round(sorted(timings)[len(timings) // 2], 3)
+
+    report = {}
+    for number in pages:
+        offset = (number - 1) * limit
+        boundary = next(collection.find(query, sort=sort, skip=offset - 1, limit=1), None) if offset else None
+        token = encode(boundary, sort) if boundary else None
+        report[number] = {
+            'offset_ms': median(lambda: page(collection, query, sort, limit, offset=offset)),
+            'cursor_ms': median(lambda: page(collection, query, sort, limit, cursor=token)),
+        }
+    return report
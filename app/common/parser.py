@@ -1,11 +1,161 @@
+import inspect
+
 from bson.objectid import ObjectId
+from flask import current_app, request
 from flask_restful import reqparse
+from werkzeug.datastructures import MultiDict
 
 from app.common.datetime import strptime
 from app.common.fake_request import FakeRequest
 from app.common.types import strphone
 
-address = reqparse.RequestParser()
+# builtins whose (value, name, op) and (value, name) calls always fail, so Argument.convert ends on type(value)
+_SINGLE_ARGUMENT_TYPES = (str, int, float, bool, dict, list)
+
+
+def _converter(arg):
+    """arg.type as Argument.convert ends up calling it for a non-null value, decided once rather than per value.
+
+    Argument.convert tries type(value, name, op), then type(value, name), then type(value), catching the
+    TypeError of each mismatch. None means the type takes a name or operator and is left to convert.
+    """
+    if arg.type in _SINGLE_ARGUMENT_TYPES:
+        return arg.type
+    try:
+        signature = inspect.signature(arg.type)
+    except (TypeError, ValueError):
+        return None
+    for args in (('value', arg.name, '='), ('value', arg.name)):
+        try:
+            signature.bind(*args)
+            return None
+        except TypeError:
+            pass
+    return arg.type
+
+
+class Parser(reqparse.RequestParser):
+    """RequestParser that compiles its arguments on first use and validates nested objects in the same call.
+
+    Results and 400 errors are the same as RequestParser's, but the request source is read once per
+    call rather than once per argument. `nest` declares a field whose object, or list of objects, is
+    parsed by another Parser once the top-level arguments are through, so a treatment plan or a
+    formulary is validated by a single parse_args.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._nested = {}
+        self._compiled = None
+
+    def add_argument(self, *args, **kwargs):
+        self._compiled = None
+        return super().add_argument(*args, **kwargs)
+
+    def replace_argument(self, *args, **kwargs):
+        self._compiled = None
+        return super().replace_argument(*args, **kwargs)
+
+    def remove_argument(self, name):
+        self._compiled = None
+        return super().remove_argument(name)
+
+    def copy(self):
+        parser_copy = super().copy()
+        parser_copy._nested = dict(self._nested)
+        return parser_copy
+
+    def nest(self, name, parser):
+        """Parse the value of argument `name` with `parser`; returns self so declarations can chain."""
+        self._nested[name] = parser
+        self._compiled = None
+        return self
+
+    def _compile(self):
+        dests = {arg.name: arg.dest or arg.name for arg in self.args}
+        nested = [(dests.get(name, name), parser) for name, parser in self._nested.items()]
+        return self._compile_args(), nested
+
+    def _compile_args(self):
+        # a single location reads the raw mapping instead of a MultiDict; leave that and the rarer
+        # argument options to RequestParser
+        locations = {tuple(arg.location) if isinstance(arg.location, (list, tuple)) else None for arg in self.args}
+        if None in locations or len(locations) > 1:
+            return None
+        if any(tuple(arg.operators) != ('=',) or arg.trim or arg.ignore or not arg.case_sensitive for arg in self.args):
+            return None
+
+        compiled = []
+        for arg in self.args:
+            missing = 'Missing required parameter in {0}'.format(
+                ' or '.join(reqparse._friendly_location.get(_, _) for _ in arg.location))
+            compiled.append((arg, arg.dest or arg.name, _converter(arg), missing))
+        return next(iter(locations), ()), compiled
+
+    @staticmethod
+    def _source(req, location):
+        values = MultiDict()
+        for l in location:
+            value = getattr(req, l, None)
+            if callable(value):
+                value = value()
+            if value is not None:
+                values.update(value)
+        return values
+
+    def parse_args(self, req=None, strict=False):
+        if req is None:
+            req = request
+        elif not isinstance(req, FakeRequest) and isinstance(req, dict):
+            req = FakeRequest(req)
+
+        if self._compiled is None:
+            self._compiled = self._compile()
+        compiled, nested = self._compiled
+        if compiled is None or strict or self.bundle_errors or current_app.config.get('BUNDLE_ERRORS', False):
+            namespace = super().parse_args(req, strict)
+        else:
+            namespace = self._parse(req, *compiled)
+
+        for dest, parser in nested:
+            value = namespace.get(dest)
+            if isinstance(value, list):
+                namespace[dest] = [parser.parse_args(req=item) for item in value]
+            elif value is not None:
+                namespace[dest] = parser.parse_args(req=value)
+
+        return namespace
+
+    def _parse(self, req, location, compiled):
+        source = self._source(req, location)
+        namespace = self.namespace_class()
+        for arg, dest, convert, missing in compiled:
+            results = []
+            for value in source.getlist(arg.name):
+                try:
+                    value = convert(value) if convert and value is not None else arg.convert(value, '=')
+                except Exception as error:
+                    arg.handle_validation_error(error, False)
+                if arg.choices and value not in arg.choices:
+                    arg.handle_validation_error(ValueError(u'{0} is not a valid choice'.format(value)), False)
+                results.append(value)
+
+            if not results:
+                if arg.required:
+                    arg.handle_validation_error(ValueError(missing), False)
+                if arg.store_missing:
+                    namespace[dest] = arg.default() if callable(arg.default) else arg.default
+            elif arg.action == 'append':
+                namespace[dest] = results
+            elif arg.action == 'store' or len(results) == 1:
+                namespace[dest] = results[0]
+            else:
+                namespace[dest] = results
+
+        return namespace
+
+
+address = Parser()
 address.add_argument('street_1')
 address.add_argument('street_2')
 address.add_argument('city')
@@ -13,20 +163,20 @@ address.add_argument('state')
 address.add_argument('zip')
 address.add_argument('zip4')
 
-phone = reqparse.RequestParser()
+phone = Parser()
 phone.add_argument('cell', type=strphone)
 phone.add_argument('work', type=strphone)
 
-formulary = reqparse.RequestParser()
+options = Parser()
+options.add_argument('strength')
+options.add_argument('price')
+
+formulary = Parser().nest('available_options', options)
 formulary.add_argument('product_id', type=ObjectId)
 formulary.add_argument('margin')
 formulary.add_argument('available_options', type=FakeRequest, action='append')
 
-options = reqparse.RequestParser()
-options.add_argument('strength')
-options.add_argument('price')
-
-order = reqparse.RequestParser()
+order = Parser()
 order.add_argument('auto_refill')
 order.add_argument('expires', type=strptime)
 order.add_argument('quantity')
@@ -36,7 +186,61 @@ order.add_argument('product_price')
 order.add_argument('strength')
 order.add_argument('product_id', type=ObjectId)
 
-pharmacies = reqparse.RequestParser()
+pharmacies = Parser()
 pharmacies.add_argument('Retail', type=ObjectId)
 pharmacies.add_argument('Compounded', type=ObjectId)
 pharmacies.add_argument('502b', type=ObjectId)
+
+
+def error_message(e):
+    """What abort() or a parser said in the 400 `e`, for reporting one refused item of a bulk request."""
+    data = getattr(e, 'data', None) or {}
+    return data.get('message', e.description)
+
+
+def _legacy_parse(parser, req=None):
+    """parse_args as resources did before Parser: a freshly built RequestParser, nested values one at a time."""
+    legacy = reqparse.RequestParser()
+    for arg in parser.args:
+        legacy.add_argument(arg.name, dest=arg.dest, type=arg.type, required=arg.required, default=arg.default,
+                            choices=arg.choices, action=arg.action)
+    args = legacy.parse_args(req=req)
+    for name, child in parser._nested.items():
+        value = args.get(name)
+        if isinstance(value, list):
+            args[name] = [_legacy_parse(child, item) for item in value]
+        elif value is not None:
+            args[name] = _legacy_parse(child, value)
+    return args
+
+
+def benchmark(boxes=4, items=5, contents=10, rounds=500):
+    """Per-request validation cost of a treatment plan and an admin order body, before and after Parser."""
+    import json
+    import timeit
+
+    from app.app import app
+    from app.resources.admin.orders import Orders
+    from app.resources.vets.treatment_plans import TreatmentPlans
+
+    item = {'product_id': str(ObjectId()), 'product_name': 'Carprofen', 'size': '75mg', 'quantity': 2,
+            'instructions': 'Once daily', 'notes': '', 'product_price': '29.95'}
+    plan = {'vet_id': str(ObjectId()), 'treatment_plan_name': 'Arthritis',
+            'boxes': [{'box_price': '59.90', 'shipping_date': '2018-01-01', 'box_no': n, 'items': [item] * items}
+                      for n in range(boxes)]}
+    content = {'product_id': str(ObjectId()), 'strength': '75mg', 'quantity': '2', 'product_price': '29.95',
+               'expires': '2019-01-01', 'refills': '3', 'auto_refill': 'true', 'instructions': 'Once daily'}
+    order = {'client_id': str(ObjectId()), 'patient_id': str(ObjectId()), 'vet_id': str(ObjectId()),
+             'hospital_id': str(ObjectId()), 'pharmacy_id': str(ObjectId()), 'order_type': 'one_time',
+             'shipping_method': 'ground', 'shipping_amount': '5.00', 'tax': '1.00',
+             'order_contents': [content] * contents}
+
+    report = {}
+    for label, parser, body in (('treatment_plan', TreatmentPlans._parser_post_root, plan),
+                                ('admin_order', Orders._parser_post, order)):
+        with app.test_request_context('/', method='POST', data=json.dumps(body), content_type='application/json'):
+            report[label] = {
+                'before_us': round(timeit.timeit(lambda: _legacy_parse(parser), number=rounds) / rounds * 1e6, 1),
+                'after_us': round(timeit.timeit(parser.parse_args, number=rounds) / rounds * 1e6, 1),
+            }
+    return report
@@ -0,0 +1,109 @@
+from app.common import formulary
+from app.common import loader
+
+
+class PricingError(Exception):
+    pass
+
+
+class PricingEngine:
+    """Prices order contents and routes them to a pharmacy from data loaded up front.
+
+    The hospital formulary is flattened into a (product_id, strength) -> price index and
+    product types into product_id -> type, so pricing an order is a single in-memory pass.
+    """
+
+    def __init__(self, entries, products, pharmacies=None):
+        self._prices = {}
+        for entry in entries or []:
+            for option in entry.get('available_options') or []:
+                self._prices[(entry['product_id'], option.get('strength'))] = option.get('price')
+
+        self._types = {product_id: (product.get('type') or '').lower()
+                       for product_id, product in products.items()}
+        self._pharmacies = pharmacies or {}
+
+    @classmethod
+    def load(cls, db, hospital_id, product_ids):
+        """Build an engine from the hospital, its formulary entries for `product_ids` and the products."""
+        hospital = db.hospitals.find_one({'_id': hospital_id},
+                                         projection=dict(formulary.HOSPITAL_PROJECTION, pharmacies=True))
+        if hospital is None:
+            raise PricingError('Hospital not found')
+
+        entries = formulary.entries(db, hospital, product_ids)
+        products = loader.load_by_ids(db, 'products', product_ids, projection={'type': True})
+
+        return cls(entries.values(), products, hospital.get('pharmacies'))
+
+    def price_of(self, product_id, strength):
+        try:
+            return self._prices[(product_id, strength)]
+        except KeyError:
+            raise PricingError(f'No price for product {product_id} ({strength})')
+
+    def pharmacy_type(self, product_ids):
+        product_types = set()
+        for product_id in product_ids:
+            if product_id not in self._types:
+                raise PricingError(f'Unknown product {product_id}')
+            product_types.add(self._types[product_id])
+
+        if {'otc'} == product_types:
+            return 'OTC'
+        elif '502b' in product_types:
+            return '502b'
+        elif 'compounded' in product_types:
+            return 'Compounded'
+        return 'Retail'
+
+    def quote(self, order_contents, tax, shipping_amount):
+        """Fill in product_price on each item and return the order's price and routing fields."""
+        subtotal = 0.0
+        for item in order_contents:
+            item['product_price'] = self.price_of(item['product_id'], item.get('strength', item.get('size')))
+            subtotal += float(item['product_price']) * int(item['quantity'])
+        total = subtotal + float(tax) + float(shipping_amount)
+
+        pharmacy_type = self.pharmacy_type([_['product_id'] for _ in order_contents])
+        if pharmacy_type != 'OTC':
+            try:
+                pharmacy_id = self._pharmacies[pharmacy_type]
+            except KeyError:
+                raise PricingError(f'Hospital has no {pharmacy_type} pharmacy')
+        else:
+            pharmacy_id = None
+
+        return {
+            'subtotal_price': str(round(subtotal, 2)),
+            'total_price': str(round(total, 2)),
+            'pharmacy_type': pharmacy_type,
+            'pharmacy_id': pharmacy_id,
+        }
+
+
+def benchmark(products=2000, strengths=4, items=10, rounds=1000):
+    """Time index construction and quoting on a synthetic formulary; no database needed."""
+    import random
+    import timeit
+
+    from bson.objectid import ObjectId
+
+    ids = [ObjectId() for _ in range(products)]
+    entries = [{'product_id': _, 'available_options': [{'strength': f'{s}mg', 'price': f'{s + 1}.50'}
+                                                       for s in range(strengths)]} for _ in ids]
+    types = {_: {'type': random.choice(['RX', 'OTC', 'Compounded'])} for _ in ids}
+    pharmacies = {'Retail': ObjectId(), 'Compounded': ObjectId(), '502b': ObjectId()}
+
+    build = timeit.timeit(lambda: PricingEngine(entries, types, pharmacies), number=10) / 10
+    engine = PricingEngine(entries, types, pharmacies)
+
+    def order():
+        return [{'product_id': random.choice(ids), 'strength': '1mg', 'quantity': 2} for _ in range(items)]
+
+    orders = [order() for _ in range(rounds)]
+    it = iter(orders)
+    quote = timeit.timeit(lambda: engine.quote(next(it), '1.00', '5.00'), number=rounds) / rounds
+
+    return {'build_ms': round(build * 1000, 3), 'quote_us': round(quote * 1e6, 3)}
+
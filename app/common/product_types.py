@@ -0,0 +1,83 @@
+import time
+
+from pymongo import UpdateOne
+
+from app.common import counts
+from app.common import loader
+
+RX = 'rx'
+
+
+def _fields(order, products):
+    types = set()
+    for item in order.get('order_contents') or []:
+        product = products.get(item.get('product_id'))
+        if product and not product.get('is_archived') and product.get('type'):
+            types.add(product['type'].lower())
+    return {'has_rx': RX in types, 'product_types': sorted(types)}
+
+
+def _products(db, orders):
+    ids = [item.get('product_id') for order in orders for item in order.get('order_contents') or []]
+    return loader.load_by_ids(db, 'products', ids, projection={'type': True, 'is_archived': True})
+
+
+def annotate(db, orders):
+    """Set has_rx and product_types on orders about to be written, loading their products with one query.
+
+    product_types are the lowercased types of the live products an order contains, and has_rx tells
+    whether one of them is rx; the vet orders type filter and dashboard read them instead of the products.
+    """
+    orders = list(orders)
+    products = _products(db, orders)
+    for order in orders:
+        order.update(_fields(order, products))
+    return orders
+
+
+def fields(db, order_contents):
+    """has_rx and product_types for an order being updated to `order_contents`."""
+    order = {'order_contents': order_contents}
+    return _fields(order, _products(db, [order]))
+
+
+def _recompute(db, query, batch_size, pause):
+    updated, last = 0, None
+    while True:
+        q = dict(query, _id={'$gt': last}) if last is not None else query
+        orders = list(db.orders.find(q, projection={'order_contents.product_id': True},
+                                     sort=[('_id', 1)], limit=batch_size))
+        if not orders:
+            break
+        last = orders[-1]['_id']
+        products = _products(db, orders)
+        result = db.orders.bulk_write([UpdateOne({'_id': order['_id']}, {'$set': _fields(order, products)})
+                                       for order in orders], ordered=False)
+        updated += result.modified_count
+        if pause:
+            time.sleep(pause)
+    if updated:
+        counts.invalidate(db, 'orders')
+    return updated
+
+
+def refresh(db, product_ids, batch_size=1000, pause=0):
+    """Recompute has_rx and product_types of the orders containing `product_ids`.
+
+    Call it after the type of a product changed or it was archived. Returns the number of orders updated.
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return 0
+    return _recompute(db, {'order_contents.product_id': {'$in': product_ids}}, batch_size, pause)
+
+
+def backfill(db, batch_size=1000, pause=0.1, recompute=False):
+    """Set has_rx and product_types on every order that lacks them, one batch at a time.
+
+    With `recompute`, every order is recomputed instead, repairing values left stale by product changes.
+    Sleeping `pause` seconds between batches keeps the write load on a live primary low.
+    Returns the number of orders updated.
+    """
+    query = {} if recompute else {'has_rx': {'$exists': False}}
+    return _recompute(db, query, batch_size, pause)
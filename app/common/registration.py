@@ -1,6 +1,4 @@
-import requests
-
-from app.common.env import *
+from app.common import upstream
 
 
 class TakenEmailError(Exception):
@@ -12,9 +10,7 @@ def register_user(email, role):
         'email': email,
         'role': role
     }
-    url = f'{AUTH_HOST}/api/v1/auth/register'
-
-    resp = requests.post(url, json=payload)
+    resp = upstream.auth.post('/api/v1/auth/register', json=payload)
     if resp.status_code != 200:
         raise TakenEmailError(resp.json().get('message'))
 
@@ -0,0 +1,247 @@
+import datetime
+import logging
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.common import archive
+from app.common import counters
+from app.common import counts
+from app.common import notification
+from app.common import paging
+from app.common import pricing
+from app.common import product_types
+from app.common import sales
+from app.common.env import *
+
+log = logging.getLogger(__name__)
+
+ACTIVE = 'Active'
+RUNNING = 'running'
+DONE = 'done'
+
+# days between two boxes of a subscription, as laid out by orders.Orders.post
+BOX_INTERVAL = datetime.timedelta(days=90)
+FUTURE_BOXES = 3
+
+DUE_SORT = [('upcoming_shipment_date', ASCENDING), ('_id', ASCENDING)]
+DUPLICATE_KEY = 11000
+
+# fields of a subscription's last order that its renewals copy
+LAST_ORDER_FIELDS = ('shipping_method', 'shipping_amount', 'shipping_address', 'tax')
+
+
+def renewal_key(subscription):
+    """Identifies one shipment of a subscription; orders.renewal_key is unique, so a box is ordered once."""
+    return f"{subscription['_id']}:{subscription['upcoming_shipment_date']:%Y%m%d%H%M%S}"
+
+
+def _box(subscription, box_no):
+    for box in subscription.get('boxes') or []:
+        if box.get('box_no') == box_no:
+            return box
+    return None
+
+
+def roll_forward(subscription):
+    """The subscription fields after its upcoming box ships: the first future box becomes the upcoming one
+    and a box is appended to future_boxes, continuing through the plan and then repeating its last box.
+    """
+    boxes = subscription.get('boxes') or []
+    future = list(subscription.get('future_boxes') or [])
+    if not future:
+        future = [{'box_no': subscription['upcoming_box_no'],
+                   'shipment_date': subscription['upcoming_shipment_date'] + BOX_INTERVAL}]
+
+    upcoming, future = future[0], future[1:]
+    box_nos = [box.get('box_no') for box in boxes]
+    while len(future) < FUTURE_BOXES:
+        last = future[-1] if future else upcoming
+        position = box_nos.index(last['box_no']) + 1 if last['box_no'] in box_nos else len(boxes)
+        box_no = box_nos[position] if position < len(boxes) else last['box_no']
+        future.append({'box_no': box_no, 'shipment_date': last['shipment_date'] + BOX_INTERVAL})
+
+    return {
+        'upcoming_box_no': upcoming['box_no'],
+        'upcoming_shipment_date': upcoming['shipment_date'],
+        'future_boxes': future,
+    }
+
+
+def _last_orders(db, subscription_ids):
+    """Most recent order of each subscription, for the shipping details a renewal reuses.
+
+    The orders are sorted and grouped on the server, so only one order per subscription comes back.
+    """
+    pipeline = [
+        {'$match': {'subscription_id': {'$in': subscription_ids}, **archive.ACTIVE}},
+        {'$sort': {'subscription_id': ASCENDING, 'order_number': DESCENDING}},
+        {'$group': {'_id': '$subscription_id',
+                    **{field: {'$first': f'${field}'} for field in LAST_ORDER_FIELDS}}},
+    ]
+    return {order.pop('_id'): order for order in db.orders.aggregate(pipeline)}
+
+
+def _engines(db, subscriptions):
+    """One PricingEngine per hospital of the batch, loaded for all the products its due boxes contain."""
+    products = {}
+    for subscription in subscriptions:
+        box = _box(subscription, subscription.get('upcoming_box_no')) or {}
+        products.setdefault(subscription['hospital_id'], set()).update(
+            item['product_id'] for item in box.get('items') or [])
+
+    engines = {}
+    for hospital_id, product_ids in products.items():
+        try:
+            engines[hospital_id] = pricing.PricingEngine.load(db, hospital_id, list(product_ids))
+        except pricing.PricingError as e:
+            engines[hospital_id] = e
+    return engines
+
+
+def build_orders(db, subscriptions, now):
+    """(orders, failures) for a batch of due subscriptions; failures maps subscription id to a reason."""
+    last_orders = _last_orders(db, [_['_id'] for _ in subscriptions])
+    engines = _engines(db, subscriptions)
+
+    orders, failures = [], {}
+    for subscription in subscriptions:
+        box = _box(subscription, subscription.get('upcoming_box_no'))
+        last = last_orders.get(subscription['_id'])
+        engine = engines.get(subscription['hospital_id'])
+        if not box or not box.get('items'):
+            failures[subscription['_id']] = f"No box {subscription.get('upcoming_box_no')} in the plan"
+            continue
+        if last is None:
+            failures[subscription['_id']] = 'No previous order to take shipping details from'
+            continue
+        if isinstance(engine, pricing.PricingError):
+            failures[subscription['_id']] = str(engine)
+            continue
+
+        contents = [dict(item) for item in box['items']]
+        try:
+            quote = engine.quote(contents, last.get('tax') or 0, last.get('shipping_amount') or 0)
+        except pricing.PricingError as e:
+            failures[subscription['_id']] = str(e)
+            continue
+
+        orders.append({
+            'vet_id': subscription['vet_id'],
+            'client_id': subscription['client_id'],
+            'patient_id': subscription['patient_id'],
+            'hospital_id': subscription['hospital_id'],
+            'treatment_plan_id': subscription.get('treatment_plan_id'),
+            'subscription_id': subscription['_id'],
+            'renewal_key': renewal_key(subscription),
+            'type': 'subscription',
+            'order_contents': contents,
+            'shipping_method': last.get('shipping_method'),
+            'shipping_amount': last.get('shipping_amount'),
+            'shipping_address': last.get('shipping_address'),
+            'tax': last.get('tax'),
+            **quote,
+            'history': {'created_on': now},
+            'order_status': 'pending',
+            'shipping_date': subscription['upcoming_shipment_date'],
+            'delivery_date': None,
+            'tracking_number': None,
+            'tracking_status': None,
+            'box_no': str(subscription['upcoming_box_no']),
+            'is_archived': False,
+        })
+    return orders, failures
+
+
+def _insert(db, orders):
+    """Insert `orders`, skipping the ones a previous attempt already created; returns the inserted ones."""
+    if not orders:
+        return []
+    try:
+        db.orders.insert_many(orders, ordered=False)
+        return orders
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(error['code'] != DUPLICATE_KEY for error in errors):
+            raise
+        duplicates = {error['index'] for error in errors}
+        return [order for i, order in enumerate(orders) if i not in duplicates]
+
+
+def renew_batch(db, subscriptions, now):
+    """Order the upcoming box of each subscription and roll the subscriptions forward.
+
+    Orders go in with one unordered insert and carry a unique renewal_key, so a batch that is
+    replayed after a crash skips the orders it already created. Each subscription only advances
+    if its upcoming_shipment_date is still the one that was ordered, so it advances once.
+    """
+    orders, failures = build_orders(db, subscriptions, now)
+    numbers = counters.order_numbers.allocate(db, len(orders)) if orders else []
+    for order, number in zip(orders, numbers):
+        order['order_number'] = number
+    product_types.annotate(db, orders)
+
+    inserted = _insert(db, orders)
+    if inserted:
+        counts.invalidate(db, 'orders')
+        sales.add(db, inserted)
+
+    renewed = {order['subscription_id'] for order in orders}
+    updates = []
+    for subscription in subscriptions:
+        if subscription['_id'] in renewed:
+            update = {'$set': dict(roll_forward(subscription), **{'history.renewed_on': now}),
+                      '$unset': {'renewal_error': ''}}
+        else:
+            update = {'$set': {'renewal_error': failures[subscription['_id']]}}
+        updates.append(UpdateOne({'_id': subscription['_id'],
+                                  'upcoming_shipment_date': subscription['upcoming_shipment_date']}, update))
+    if updates:
+        db.subscriptions.bulk_write(updates, ordered=False)
+
+    try:
+        notification.notify_orders(inserted)
+    except Exception:
+        log.exception('could not queue notifications for %d renewed orders', len(inserted))
+
+    return {'renewed': len(inserted), 'skipped': len(orders) - len(inserted), 'failed': len(failures)}
+
+
+def run(db, now=None, batch_size=RENEWALS_BATCH_SIZE, progress=None):
+    """Renew every active, unarchived subscription due by the start of today's run, in batches of `batch_size`.
+
+    The run is recorded in `renewals` under today's date with its cutoff time, counts and the
+    position of the last finished batch. A crashed run resumes from that position; running again
+    once it is done returns the recorded counts.
+    """
+    now = now or datetime.datetime.utcnow()
+    state = db.renewals.find_one_and_update(
+        {'_id': now.strftime('%Y-%m-%d')},
+        {'$setOnInsert': {'status': RUNNING, 'cutoff': now, 'cursor': None,
+                          'counts': {'renewed': 0, 'skipped': 0, 'failed': 0},
+                          'history': {'started_on': now}}},
+        upsert=True, return_document=ReturnDocument.AFTER)
+    if state['status'] == DONE:
+        return state['counts']
+
+    query = {'subscription_status': ACTIVE, **archive.ACTIVE, 'upcoming_shipment_date': {'$lte': state['cutoff']}}
+    cursor, totals = state['cursor'], state['counts']
+    while True:
+        scan = query if cursor is None else {'$and': [query, paging.keyset(DUE_SORT, cursor)]}
+        batch = list(db.subscriptions.find(scan, sort=DUE_SORT, limit=batch_size))
+        if not batch:
+            break
+
+        # a subscription overdue by more than a box interval comes due again after rolling forward;
+        # its next box waits for the next run
+        due = [_ for _ in batch if _.get('history', {}).get('renewed_on', state['cutoff']) <= state['cutoff']]
+        result = renew_batch(db, due, datetime.datetime.utcnow())
+        cursor = [batch[-1]['upcoming_shipment_date'], batch[-1]['_id']]
+        totals = {k: totals.get(k, 0) + v for k, v in result.items()}
+        db.renewals.update_one({'_id': state['_id']}, {'$set': {'cursor': cursor, 'counts': totals}})
+        if progress:
+            progress(totals)
+
+    db.renewals.update_one({'_id': state['_id']},
+                           {'$set': {'status': DONE, 'history.finished_on': datetime.datetime.utcnow()}})
+    return totals
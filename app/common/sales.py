@@ -0,0 +1,161 @@
+import datetime
+
+from pymongo import UpdateOne
+
+from app.common import indexes
+
+# order fields a daily_sales bucket is computed from; fetch at least these before changing an order
+FIELDS = {
+    'history.created_on': True, 'hospital_id': True, 'pharmacy_id': True, 'type': True, 'order_status': True,
+    'subtotal_price': True, 'tax': True, 'shipping_amount': True, 'total_price': True, 'is_archived': True,
+}
+
+KEY = ('day', 'hospital_id', 'pharmacy_id', 'type')
+
+# amounts are summed in cents so repeated increments do not drift
+AMOUNTS = {
+    'subtotal_cents': 'subtotal_price',
+    'tax_cents': 'tax',
+    'shipping_cents': 'shipping_amount',
+    'total_cents': 'total_price',
+}
+
+GROUPS = ('day', 'hospital', 'pharmacy', 'type')
+
+
+def _cents(value):
+    try:
+        return int(round(float(value) * 100))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _day(order):
+    created_on = (order.get('history') or {}).get('created_on')
+    if created_on is None:
+        return None
+    return datetime.datetime(created_on.year, created_on.month, created_on.day)
+
+
+def _bucket(order):
+    """(key, increments) an order adds to daily_sales, or None for archived orders."""
+    if not order or order.get('is_archived') or _day(order) is None:
+        return None
+    key = (_day(order), order.get('hospital_id'), order.get('pharmacy_id'), order.get('type'))
+    inc = {'orders': 1, f"statuses.{order.get('order_status') or 'unknown'}": 1}
+    inc.update({field: _cents(order.get(source)) for field, source in AMOUNTS.items()})
+    return key, inc
+
+
+def _apply(db, deltas):
+    updates = []
+    for key, inc in deltas.items():
+        inc = {k: v for k, v in inc.items() if v}
+        if inc:
+            updates.append(UpdateOne(dict(zip(KEY, key)), {'$inc': inc}, upsert=True))
+    if updates:
+        db.daily_sales.bulk_write(updates, ordered=False)
+
+
+def _add(deltas, bucket, sign):
+    if bucket is None:
+        return
+    key, inc = bucket
+    totals = deltas.setdefault(key, {})
+    for field, value in inc.items():
+        totals[field] = totals.get(field, 0) + sign * value
+
+
+def add(db, orders):
+    """Count newly inserted orders into their daily_sales buckets."""
+    deltas = {}
+    for order in orders:
+        _add(deltas, _bucket(order), 1)
+    _apply(db, deltas)
+
+
+def change(db, before, updates):
+    """Move an order's contribution after `updates` were $set on it; `before` must include FIELDS."""
+    if not before:
+        return
+    deltas = {}
+    _add(deltas, _bucket(before), -1)
+    _add(deltas, _bucket(dict(before, **updates)), 1)
+    _apply(db, deltas)
+
+
+def _nest(inc):
+    doc = {}
+    for field, value in inc.items():
+        head, _, tail = field.partition('.')
+        if tail:
+            doc.setdefault(head, {})[tail] = value
+        else:
+            doc[field] = value
+    return doc
+
+
+def rebuild(db, batch_size=1000):
+    """Recompute daily_sales from every order.
+
+    The buckets are summed in memory (one per day, hospital, pharmacy and order type) and written to an
+    indexed scratch collection that then replaces daily_sales, so reports keep answering during the
+    rebuild. Orders written while it runs are only counted if the scan reaches them. Returns the number
+    of buckets.
+    """
+    deltas = {}
+    for order in db.orders.find({}, projection=FIELDS, batch_size=batch_size):
+        _add(deltas, _bucket(order), 1)
+
+    scratch = db.daily_sales_rebuild
+    scratch.drop()
+    scratch.create_indexes(indexes.REGISTRY['daily_sales'])
+    docs = [dict(zip(KEY, key), **_nest(inc)) for key, inc in deltas.items()]
+    for start in range(0, len(docs), batch_size):
+        scratch.insert_many(docs[start:start + batch_size], ordered=False)
+    if docs:
+        scratch.rename('daily_sales', dropTarget=True)
+    else:
+        db.daily_sales.delete_many({})
+    return len(docs)
+
+
+def report(db, created_from=None, created_to=None, group='day', hospital_id=None, pharmacy_id=None, order_type=None):
+    """Sales totals from daily_sales for days in [created_from, created_to), one row per `group` value.
+
+    Rows carry the order count, a count per order status and the subtotal, tax, shipping and total
+    amounts, ordered by the group value.
+    """
+    q = {}
+    if created_from is not None or created_to is not None:
+        q['day'] = {}
+        if created_from is not None:
+            q['day']['$gte'] = created_from
+        if created_to is not None:
+            q['day']['$lt'] = created_to
+    if hospital_id is not None:
+        q['hospital_id'] = hospital_id
+    if pharmacy_id is not None:
+        q['pharmacy_id'] = pharmacy_id
+    if order_type is not None:
+        q['type'] = order_type
+
+    field = {'hospital': 'hospital_id', 'pharmacy': 'pharmacy_id'}.get(group, group)
+    rows = {}
+    for bucket in db.daily_sales.find(q, projection={'_id': False}):
+        row = rows.setdefault(bucket.get(field), {'orders': 0, 'statuses': {}, **{k: 0 for k in AMOUNTS}})
+        row['orders'] += bucket.get('orders', 0)
+        for status, n in (bucket.get('statuses') or {}).items():
+            row['statuses'][status] = row['statuses'].get(status, 0) + n
+        for k in AMOUNTS:
+            row[k] += bucket.get(k, 0)
+
+    result = []
+    for value, row in sorted(rows.items(), key=lambda item: (item[0] is None, str(item[0]))):
+        result.append({
+            field: value,
+            'orders': row['orders'],
+            'statuses': {k: v for k, v in row['statuses'].items() if v},
+            **{k[:-len('_cents')]: round(row[k] / 100, 2) for k in AMOUNTS},
+        })
+    return result
@@ -0,0 +1,86 @@
+import unicodedata
+
+from pymongo import UpdateOne
+
+from app.common import archive
+
+
+def normalize(text):
+    """Case-fold, strip accents and collapse whitespace so prefix matching is index friendly."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.casefold().split())
+
+
+def client_name_key(first_name, last_name):
+    return normalize(f'{first_name or ""} {last_name or ""}')
+
+
+def prefix_range(prefix):
+    """Range predicate matching every normalized key that starts with `prefix`."""
+    prefix = normalize(prefix)
+    return {'$gte': prefix, '$lt': prefix + '\uffff'}
+
+
+def backfill_patients(db, batch_size=1000):
+    """Populate name_normalized on every patient; returns patients updated."""
+    updated = 0
+    batch = []
+    for patient in db.patients.find({}, projection={'name': True}):
+        batch.append(UpdateOne({'_id': patient['_id']}, {'$set': {'name_normalized': normalize(patient.get('name'))}}))
+        if len(batch) == batch_size:
+            updated += db.patients.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += db.patients.bulk_write(batch, ordered=False).modified_count
+
+    return updated
+
+
+def add_client_vets(db, pairs):
+    """Record that each (client_id, vet_id) client has a patient with that vet."""
+    requests = [UpdateOne({'_id': client_id}, {'$addToSet': {'vet_ids': vet_id}})
+                for client_id, vet_id in set(pairs) if client_id and vet_id]
+    if requests:
+        db.clients.bulk_write(requests, ordered=False)
+
+
+def remove_client_vets(db, pairs):
+    """Forget each (client_id, vet_id) vet of a client that has no other active patient with it.
+
+    Call it with the old pair after a patient moved to another vet or client, or was archived.
+    """
+    requests = []
+    for client_id, vet_id in set(pairs):
+        if not client_id or not vet_id:
+            continue
+        if db.patients.find_one({'client_id': client_id, 'vet_id': vet_id, **archive.ACTIVE}, projection={'_id': True}):
+            continue
+        requests.append(UpdateOne({'_id': client_id}, {'$pull': {'vet_ids': vet_id}}))
+    if requests:
+        db.clients.bulk_write(requests, ordered=False)
+
+
+def backfill_clients(db, batch_size=1000):
+    """Populate client_name_normalized and vet_ids on every client; returns clients updated."""
+    memberships = {}
+    for row in db.patients.aggregate([
+        {'$match': {**archive.ACTIVE, 'vet_id': {'$ne': None}}},
+        {'$group': {'_id': '$client_id', 'vet_ids': {'$addToSet': '$vet_id'}}}
+    ], allowDiskUse=True):
+        memberships[row['_id']] = row['vet_ids']
+
+    updated = 0
+    batch = []
+    for client in db.clients.find({}, projection={'first_name': True, 'last_name': True}):
+        batch.append(UpdateOne({'_id': client['_id']}, {'$set': {
+            'client_name_normalized': client_name_key(client.get('first_name'), client.get('last_name')),
+            'vet_ids': memberships.get(client['_id'], []),
+        }}))
+        if len(batch) == batch_size:
+            updated += db.clients.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += db.clients.bulk_write(batch, ordered=False).modified_count
+
+    return updated
@@ -1,5 +1,33 @@
 import re
 
+from bson.objectid import ObjectId
+
 
 def strphone(phone):
     return re.sub('[^0-9]', '', phone)
+
+
+class Schema:
+    """reqparse type for JSON values stored as sent: converts the declared ObjectId fields.
+
+    `ids` name the ObjectId fields of the object; keyword arguments give the Schema of nested
+    objects or lists of objects. Lists of objects are decoded item by item.
+    """
+
+    def __init__(self, *ids, **nested):
+        self._ids = frozenset(ids)
+        self._nested = nested
+
+    def __call__(self, value):
+        if isinstance(value, list):
+            return [self(item) for item in value]
+        if not isinstance(value, dict):
+            raise ValueError(f'expected an object, got {type(value).__name__}')
+
+        for field in self._ids.intersection(value):
+            if value[field] is not None:
+                value[field] = ObjectId(value[field])
+        for field, schema in self._nested.items():
+            if value.get(field) is not None:
+                value[field] = schema(value[field])
+        return value
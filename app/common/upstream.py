@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from werkzeug.exceptions import ServiceUnavailable
+
+from app.common.env import *
+
+
+class UpstreamUnavailable(requests.ConnectionError, ServiceUnavailable):
+    """Raised without touching the network while an upstream's circuit is open.
+
+    It is a requests.ConnectionError for code that already handles request failures, and a
+    503 HTTPException so resources answer 503 instead of 500 when it propagates.
+    """
+
+    def __init__(self, name):
+        requests.ConnectionError.__init__(self, f'{name} service is unavailable')
+        ServiceUnavailable.__init__(self, description=f'{name} service is unavailable')
+
+
+class Upstream:
+    """Keep-alive client for one internal service, with a circuit breaker and counters.
+
+    After `failure_threshold` consecutive failed calls (any exception, or a 5xx answer) the
+    circuit opens and calls fail fast for `reset_seconds`; then one trial call is let
+    through, and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name, base_url, connect_timeout=UPSTREAM_CONNECT_TIMEOUT, read_timeout=UPSTREAM_READ_TIMEOUT,
+                 pool_size=UPSTREAM_POOL_SIZE, failure_threshold=UPSTREAM_FAILURE_THRESHOLD,
+                 reset_seconds=UPSTREAM_RESET_SECONDS):
+        self.name = name
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+
+        self._failures = 0
+        self._opened_on = None
+        self._trial = False
+
+        self._counters = {'requests': 0, 'errors': 0, 'timeouts': 0, 'rejected': 0}
+        self._total_ms = 0.0
+        self._max_ms = 0.0
+
+    @property
+    def session(self):
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+                    self._pid = os.getpid()
+        return self._session
+
+    def _allow(self):
+        with self._lock:
+            if self._opened_on is None:
+                return True
+            if not self._trial and time.time() - self._opened_on >= self.reset_seconds:
+                self._trial = True
+                return True
+            self._counters['rejected'] += 1
+            return False
+
+    def _record(self, elapsed_ms, ok, timeout=False):
+        with self._lock:
+            self._counters['requests'] += 1
+            self._total_ms += elapsed_ms
+            self._max_ms = max(self._max_ms, elapsed_ms)
+            if ok:
+                self._failures = 0
+                self._opened_on = None
+            else:
+                self._counters['errors'] += 1
+                self._counters['timeouts'] += int(timeout)
+                self._failures += 1
+                if self._trial or self._failures >= self.failure_threshold:
+                    self._opened_on = time.time()
+            self._trial = False
+
+    def request(self, method, path, **kwargs):
+        if not self._allow():
+            raise UpstreamUnavailable(self.name)
+
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.time()
+        try:
+            resp = self.session.request(method, self.base_url + path, **kwargs)
+        except requests.Timeout:
+            self._record((time.time() - started) * 1000, ok=False, timeout=True)
+            raise
+        except Exception:
+            # anything else the call raises still counts, or a trial call would leave the circuit half-open
+            self._record((time.time() - started) * 1000, ok=False)
+            raise
+
+        self._record((time.time() - started) * 1000, ok=resp.status_code < 500)
+        return resp
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['avg_ms'] = round(self._total_ms / stats['requests'], 3) if stats['requests'] else 0.0
+            stats['max_ms'] = round(self._max_ms, 3)
+            stats['circuit'] = 'closed' if self._opened_on is None else 'open'
+            return stats
+
+
+auth = Upstream('auth', AUTH_HOST)
+payment = Upstream('payment', PAYMENT_HOST)
+notification = Upstream('notification', NOTIFICATION_HOST)
+
+
+def stats():
+    return {u.name: u.stats() for u in (auth, payment, notification)}
@@ -1,38 +1,38 @@
 import datetime
 
-from flask_restful import Resource, reqparse
-from pymongo import MongoClient
-
+from flask_restful import Resource
+
+from app.common import archive
+from app.common import counts
+from app.common import formulary
+from app.common import loader
+from app.common import mongo
+from app.common import paging
 from app.common import parser
-from app.common.env import *
 from app.common.fake_request import FakeRequest
 from app.common.types import strphone
 
 
 class Hospital(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_put = reqparse.RequestParser()
-        self._parser_put.add_argument('name')
-        self._parser_put.add_argument('email')
-        self._parser_put.add_argument('phone', type=strphone)
-        self._parser_put.add_argument('fax')
-        self._parser_put.add_argument('address', type=FakeRequest)
-        self._parser_put.add_argument('formulary', type=FakeRequest, action='append')
-        self._parser_put.add_argument('pharmacies', type=FakeRequest)
-        self._parser_put.add_argument('pims_id')
-        self._parser_put.add_argument('clinic_id')
-        self._parser_put.add_argument('owner_name')
-        self._parser_put.add_argument('parent_account')
-
-        self._parser_address = parser.address.copy()
-        self._parser_formulary = parser.formulary.copy()
-        self._parser_options = parser.options.copy()
-        self._parser_pharmacies = parser.pharmacies.copy()
+    _parser_put = parser.Parser()
+    _parser_put.add_argument('name')
+    _parser_put.add_argument('email')
+    _parser_put.add_argument('phone', type=strphone)
+    _parser_put.add_argument('fax')
+    _parser_put.add_argument('address', type=FakeRequest)
+    _parser_put.add_argument('formulary', type=FakeRequest, action='append')
+    _parser_put.add_argument('pharmacies', type=FakeRequest)
+    _parser_put.add_argument('pims_id')
+    _parser_put.add_argument('clinic_id')
+    _parser_put.add_argument('owner_name')
+    _parser_put.add_argument('parent_account')
+    _parser_put.nest('formulary', parser.formulary)
+
+    _parser_address = parser.address.copy()
+    _parser_pharmacies = parser.pharmacies.copy()
 
     def get(self, hospital_id):
-        db = MongoClient(host=MONGO_HOST).db
+        db = mongo.get_db()
         projection = {
             'name': True,
             'email': True,
@@ -51,7 +51,7 @@ class Hospital(Resource):
         hospital = db.hospitals.find_one(
             {
                 '_id': hospital_id,
-                'is_archived': {'$in': [None, False]}
+                **archive.ACTIVE
             },
             projection=projection)
 
@@ -67,7 +67,7 @@ class Hospital(Resource):
         return hospital, 200
 
     def put(self, hospital_id):
-        db = MongoClient(host=MONGO_HOST).db
+        db = mongo.get_db()
         args = {k: v for k, v in self._parser_put.parse_args().items() if v is not None}
 
         if 'address' in args:
@@ -75,17 +75,7 @@ class Hospital(Resource):
                                self._parser_address.parse_args(req=args['address']).items() if v is not None}
 
         if 'formulary' in args:
-            products = []
-            for product in args['formulary']:
-                p = self._parser_formulary.parse_args(req=product)
-                if 'available_options' in p:
-                    options = []
-                    for option in p['available_options']:
-                        o = self._parser_options.parse_args(req=option)
-                        options.append(o)
-                    p['available_options'] = options
-                products.append(p)
-            args['formulary'] = products
+            formulary.replace(db, hospital_id, args.pop('formulary'))
 
         if 'pharmacies' in args:
             for k, v in self._parser_pharmacies.parse_args(req=args['pharmacies']).items():
@@ -100,12 +90,13 @@ class Hospital(Resource):
         return {'updated': bool(result.modified_count)}, 200
 
     def delete(self, hospital_id):
-        db = MongoClient(host=MONGO_HOST).db
+        db = mongo.get_db()
 
         result = db.hospitals.update_one({'_id': hospital_id},
                                          {'$set': {
                                              'is_archived': True,
                                              'history.archived_on': datetime.datetime.utcnow()}})
+        counts.invalidate(db, 'hospitals')
 
         if result.modified_count:
             hospital = db.hospitals.find_one({'_id': hospital_id})
@@ -117,32 +108,30 @@ class Hospital(Resource):
 
 
 class Hospitals(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_get = reqparse.RequestParser()
-        self._parser_get.add_argument('offset', type=int, default=0)
-        self._parser_get.add_argument('limit', type=int, default=20)
-
-        self._parser_post = reqparse.RequestParser()
-        self._parser_post.add_argument('name', required=True)
-        self._parser_post.add_argument('email', required=True)
-        self._parser_post.add_argument('phone', required=True, type=strphone)
-        self._parser_post.add_argument('address', type=FakeRequest, required=True)
-        self._parser_post.add_argument('formulary', type=FakeRequest, action='append')
-        self._parser_post.add_argument('pharmacies', type=FakeRequest)
-        self._parser_post.add_argument('pims_id')
-        self._parser_post.add_argument('clinic_id')
-        self._parser_post.add_argument('owner_name')
-        self._parser_post.add_argument('parent_account')
-
-        self._parser_address = parser.address.copy()
-        self._parser_formulary = parser.formulary.copy()
-        self._parser_options = parser.options.copy()
-        self._parser_pharmacies = parser.pharmacies.copy()
+    _parser_get = parser.Parser()
+    _parser_get.add_argument('offset', type=int, default=0)
+    _parser_get.add_argument('limit', type=int, default=20)
+    _parser_get.add_argument('cursor')
+    _parser_get.add_argument('count', choices=counts.MODES, default=counts.EXACT)
+
+    _parser_post = parser.Parser()
+    _parser_post.add_argument('name', required=True)
+    _parser_post.add_argument('email', required=True)
+    _parser_post.add_argument('phone', required=True, type=strphone)
+    _parser_post.add_argument('address', type=FakeRequest, required=True)
+    _parser_post.add_argument('formulary', type=FakeRequest, action='append')
+    _parser_post.add_argument('pharmacies', type=FakeRequest)
+    _parser_post.add_argument('pims_id')
+    _parser_post.add_argument('clinic_id')
+    _parser_post.add_argument('owner_name')
+    _parser_post.add_argument('parent_account')
+    _parser_post.nest('formulary', parser.formulary)
+
+    _parser_address = parser.address.copy()
+    _parser_pharmacies = parser.pharmacies.copy()
 
     def get(self):
-        db = MongoClient(host=MONGO_HOST).db
+        db = mongo.get_db()
         projection = {
             'name': True,
             'email': True,
@@ -159,24 +148,25 @@ class Hospitals(Resource):
         }
 
         args = self._parser_get.parse_args()
-        hospitals = list(db.hospitals.find({'is_archived': {'$in': [None, False]}},
-                                           projection=projection, skip=args['offset'], limit=args['limit']))
+        hospitals, cursor = paging.page(db.hospitals, archive.ACTIVE, [('_id', 1)], args['limit'],
+                                        cursor=args['cursor'], offset=args['offset'], projection=projection)
+
+        hospitals_count = counts.count(db, 'hospitals', archive.ACTIVE, args['count'])
 
-        hospitals_count = db.hospitals.count()
+        refs = loader.load_refs(db, hospitals, {'pharmacies': ('pharmacies', {'name': True})})
 
         for hospital in hospitals:
             hospital['hospital_id'] = hospital.pop('_id')
             if 'pharmacies' in hospital:
                 for pharmacy_type, pharmacy_id in dict(hospital['pharmacies']).items():
-                    pharmacy = db.pharmacies.find_one(
-                        {'_id': pharmacy_id}, projection={'name': True})
+                    pharmacy = refs['pharmacies'].get(pharmacy_id)
                     if pharmacy:
                         hospital['pharmacies'][f'{pharmacy_type}_name'] = pharmacy['name']
 
-        return {'hospitals': hospitals, 'count': hospitals_count}, 200
+        return {'hospitals': hospitals, 'count': hospitals_count, 'cursor': cursor}, 200
 
     def post(self):
-        db = MongoClient(host=MONGO_HOST).db
+        db = mongo.get_db()
         args = self._parser_post.parse_args()
 
         # try:
@@ -194,29 +184,17 @@ class Hospitals(Resource):
                           if v is not None}
             args['pharmacies'] = pharmacies
 
-        products = []
-        if 'formulary' in args and args['formulary']:
-            for product in args['formulary']:
-                p = self._parser_formulary.parse_args(req=product)
-                options = []
-                for option in p['available_options']:
-                    o = self._parser_options.parse_args(req=option)
-                    options.append(o)
-                p['available_options'] = options
-                products.append(p)
-            args['formulary'] = products
-        else:
-            products = list(db.products.find({}, projection={'available_options': True}))
-            for product in products:
-                product['product_id'] = product.pop('_id')
-                product['margin'] = '10%'
-            args['formulary'] = products
+        products = args.pop('formulary') or []
 
         args['history'] = {'created_on': datetime.datetime.utcnow()}
         args['is_archived'] = False
         args['status'] = 'Pending'
+        args['inherits_formulary'] = not products
 
         hospital_id = db.hospitals.insert_one(args).inserted_id
+        counts.invalidate(db, 'hospitals')
+        if products:
+            formulary.replace(db, hospital_id, products)
 
         # confirmation = notification.send_confirmation(
         #     args['name'], args['email'], args['phone'], token)
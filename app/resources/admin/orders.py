@@ -1,44 +1,47 @@
 import datetime
 
 from bson.objectid import ObjectId
-from flask_restful import Resource, reqparse
-from pymongo import MongoClient
-
+from flask_restful import Resource
+from pymongo import ReturnDocument
+
+from app.common import archive
+from app.common import counts
+from app.common import export
+from app.common import loader
+from app.common import mongo
+from app.common import paging
 from app.common import parser
+from app.common import product_types
+from app.common import sales
 from app.common.datetime import strptime
-from app.common.env import *
 from app.common.fake_request import FakeRequest
 from app.common import notification
 
 
 class Order(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_put = reqparse.RequestParser()
-        self._parser_put.add_argument('vet_id', type=ObjectId)
-        self._parser_put.add_argument('client_id', type=ObjectId)
-        self._parser_put.add_argument('patient_id', type=ObjectId)
-        self._parser_put.add_argument('hospital_id', type=ObjectId)
-        self._parser_put.add_argument('pharmacy_id', type=ObjectId)
-        self._parser_put.add_argument('subscription_id', type=ObjectId)
-        self._parser_put.add_argument('shipping_method')
-        self._parser_put.add_argument('shipping_amount')
-        self._parser_put.add_argument('shipping_date', type=strptime)
-        self._parser_put.add_argument('delivered_date', type=strptime)
-        self._parser_put.add_argument('tax')
-        self._parser_put.add_argument('order_type')
-        self._parser_put.add_argument('order_status')
-        self._parser_put.add_argument('box_name')
-        self._parser_put.add_argument('total_price')
-        self._parser_put.add_argument('tracking_number')
-        self._parser_put.add_argument('order_number', type=int)
-        self._parser_put.add_argument('order_contents', type=FakeRequest, action='append')
-
-        self._parser_order = parser.order.copy()
+    _parser_put = parser.Parser()
+    _parser_put.add_argument('vet_id', type=ObjectId)
+    _parser_put.add_argument('client_id', type=ObjectId)
+    _parser_put.add_argument('patient_id', type=ObjectId)
+    _parser_put.add_argument('hospital_id', type=ObjectId)
+    _parser_put.add_argument('pharmacy_id', type=ObjectId)
+    _parser_put.add_argument('subscription_id', type=ObjectId)
+    _parser_put.add_argument('shipping_method')
+    _parser_put.add_argument('shipping_amount')
+    _parser_put.add_argument('shipping_date', type=strptime)
+    _parser_put.add_argument('delivered_date', type=strptime)
+    _parser_put.add_argument('tax')
+    _parser_put.add_argument('order_type')
+    _parser_put.add_argument('order_status')
+    _parser_put.add_argument('box_name')
+    _parser_put.add_argument('total_price')
+    _parser_put.add_argument('tracking_number')
+    _parser_put.add_argument('order_number', type=int)
+    _parser_put.add_argument('order_contents', type=FakeRequest, action='append')
+    _parser_put.nest('order_contents', parser.order)
 
     def get(self, order_id):
-        db = MongoClient(host=MONGO_HOST).db
+        db = mongo.get_db()
         projection = {
             'history': False,
             'is_archived': False,
@@ -58,7 +61,7 @@ class Order(Resource):
         client = db.clients.find_one(
             {
                 '_id': order['client_id'],
-                'is_archived': {'$in': [None, False]}
+                **archive.ACTIVE
             },
             projection={'first_name': True, 'last_name': True}) or {}
         order['client_name'] = '{} {}'.format(client.get('first_name'), client.get('last_name'))
@@ -66,7 +69,7 @@ class Order(Resource):
         patient = db.patients.find_one(
             {
                 '_id': order['patient_id'],
-                'is_archived': {'$in': [None, False]}
+                **archive.ACTIVE
             },
             projection={'name': True}) or {}
         order['patient_name'] = patient.get('name')
@@ -74,7 +77,7 @@ class Order(Resource):
         vet = db.vets.find_one(
             {
                 '_id': order['vet_id'],
-                'is_archived': {'$in': [None, False]}
+                **archive.ACTIVE
             },
             projection={'first_name': True, 'last_name': True}) or {}
         order['vet_name'] = '{} {}'.format(vet.get('first_name'), vet.get('last_name'))
@@ -82,7 +85,7 @@ class Order(Resource):
         hospital = db.hospitals.find_one(
             {
                 '_id': order['hospital_id'],
-                'is_archived': {'$in': [None, False]}
+                **archive.ACTIVE
             },
             projection={'name': True}) or {}
         order['hospital_name'] = hospital.get('name')
@@ -90,7 +93,7 @@ class Order(Resource):
         pharmacy = db.pharmacies.find_one(
             {
                 '_id': order['pharmacy_id'],
-                'is_archived': {'$in': [None, False]}
+                **archive.ACTIVE
             },
             projection={'name': True}) or {}
         order['pharmacy_name'] = pharmacy.get('name')
@@ -105,7 +108,7 @@ class Order(Resource):
         return order, 200
 
     def put(self, order_id):
-        db = MongoClient(host=MONGO_HOST).db
+        db = mongo.get_db()
         args = {k: v for k, v in self._parser_put.parse_args().items() if v is not None}
 
         subtotal = 0.0
@@ -113,8 +116,8 @@ class Order(Resource):
 
         if 'order_contents' in args:
             for product in args['order_contents']:
-                product = self._parser_order.parse_args(req=product)
                 subtotal += float(product['product_price']) * int(product['quantity'])
+            args.update(product_types.fields(db, args['order_contents']))
         else:
             subtotal = float(order['subtotal_price'])
 
@@ -126,57 +129,61 @@ class Order(Resource):
 
         args['history.modified_on'] = datetime.datetime.utcnow()
 
-        result = db.orders.update_one({'_id': order_id}, {'$set': args})
+        before = db.orders.find_one_and_update({'_id': order_id}, {'$set': args}, projection=sales.FIELDS,
+                                               return_document=ReturnDocument.BEFORE)
+        counts.invalidate(db, 'orders')
+        sales.change(db, before, args)
         order_no = order.get('order_number', None)
         client_id = order.get('client_id', None)
         tracking_number = order.get('tracking_number', None)
         if client_id and order_no and tracking_number:
             notification.notify_client_shipping(client_id, order_no, tracking_number)
 
-        return {'updated': bool(result.modified_count)}, 200
+        return {'updated': before is not None}, 200
 
     def delete(self, order_id):
-        db = MongoClient(host=MONGO_HOST).db
+        db = mongo.get_db()
 
-        result = db.orders.update_one({'_id': order_id},
-                                      {'$set': {
-                                          'is_archived': True,
-                                          'history.archived_on': datetime.datetime.utcnow()}})
+        before = db.orders.find_one_and_update({'_id': order_id, **archive.ACTIVE},
+                                               {'$set': {
+                                                   'is_archived': True,
+                                                   'history.archived_on': datetime.datetime.utcnow()}},
+                                               projection=sales.FIELDS, return_document=ReturnDocument.BEFORE)
+        counts.invalidate(db, 'orders')
+        sales.change(db, before, {'is_archived': True})
 
-        return {'deleted': bool(result.modified_count)}, 200
+        return {'deleted': before is not None}, 200
 
 
 class Orders(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_get = reqparse.RequestParser()
-        self._parser_get.add_argument('offset', type=int, default=0)
-        self._parser_get.add_argument('limit', type=int, default=20)
-
-        self._parser_post = reqparse.RequestParser()
-        self._parser_post.add_argument('vet_id', type=ObjectId, required=True)
-        self._parser_post.add_argument('client_id', type=ObjectId, required=True)
-        self._parser_post.add_argument('patient_id', type=ObjectId, required=True)
-        self._parser_post.add_argument('hospital_id', type=ObjectId, required=True)
-        self._parser_post.add_argument('pharmacy_id', type=ObjectId, required=True)
-        self._parser_post.add_argument('subscription_id', type=ObjectId)
-        self._parser_post.add_argument('shipping_method', required=True)
-        self._parser_post.add_argument('shipping_amount', required=True)
-        self._parser_post.add_argument('shipping_date', type=strptime)
-        self._parser_post.add_argument('delivered_date', type=strptime)
-        self._parser_post.add_argument('tax')
-        self._parser_post.add_argument('order_type', required=True)
-        self._parser_post.add_argument('box_name')
-        self._parser_post.add_argument('total_price')
-        self._parser_post.add_argument('tracking_number')
-        self._parser_post.add_argument('order_number', type=int)
-        self._parser_post.add_argument('order_contents', type=FakeRequest, action='append')
-
-        self._parser_order = parser.order.copy()
+    _parser_get = parser.Parser()
+    _parser_get.add_argument('offset', type=int, default=0)
+    _parser_get.add_argument('limit', type=int, default=20)
+    _parser_get.add_argument('cursor')
+    _parser_get.add_argument('count', choices=counts.MODES, default=counts.EXACT)
+
+    _parser_post = parser.Parser()
+    _parser_post.add_argument('vet_id', type=ObjectId, required=True)
+    _parser_post.add_argument('client_id', type=ObjectId, required=True)
+    _parser_post.add_argument('patient_id', type=ObjectId, required=True)
+    _parser_post.add_argument('hospital_id', type=ObjectId, required=True)
+    _parser_post.add_argument('pharmacy_id', type=ObjectId, required=True)
+    _parser_post.add_argument('subscription_id', type=ObjectId)
+    _parser_post.add_argument('shipping_method', required=True)
+    _parser_post.add_argument('shipping_amount', required=True)
+    _parser_post.add_argument('shipping_date', type=strptime)
+    _parser_post.add_argument('delivered_date', type=strptime)
+    _parser_post.add_argument('tax')
+    _parser_post.add_argument('order_type', required=True)
+    _parser_post.add_argument('box_name')
+    _parser_post.add_argument('total_price')
+    _parser_post.add_argument('tracking_number')
+    _parser_post.add_argument('order_number', type=int)
+    _parser_post.add_argument('order_contents', type=FakeRequest, action='append')
+    _parser_post.nest('order_contents', parser.order)
 
     def get(self):
-        db = MongoClient(host=MONGO_HOST).db
+        db = mongo.get_db()
         projection = {
             'is_archived': False,
             'card': False,
@@ -185,10 +192,18 @@ class Orders(Resource):
         }
 
         args = self._parser_get.parse_args()
-        orders = list(db.orders.find({'is_archived': {'$in': [None, False]}},
-                                     projection=projection, skip=args['offset'], limit=args['limit']))
+        orders, cursor = paging.page(db.orders, archive.ACTIVE, [('_id', 1)], args['limit'],
+                                     cursor=args['cursor'], offset=args['offset'], projection=projection)
+
+        orders_count = counts.count(db, 'orders', archive.ACTIVE, args['count'])
 
-        orders_count = db.orders.count({'is_archived': {'$in': [None, False]}})
+        refs = loader.load_refs(db, orders, {
+            'client_id': ('clients', {'first_name': True, 'last_name': True, 'email_address': True, 'phone': True}),
+            'patient_id': ('patients', {'name': True, 'birthday': True}),
+            'vet_id': ('vets', {'first_name': True, 'last_name': True}),
+            'hospital_id': ('hospitals', {'name': True}),
+            'pharmacy_id': ('pharmacies', {'name': True}),
+        })
 
         for order in orders:
             order['order_id'] = order.pop('_id')
@@ -197,15 +212,7 @@ class Orders(Resource):
                 order['box_no'] = 0
 
             try:
-                client = db.clients.find_one(
-                    {
-                        '_id': order['client_id'],
-                    },
-                    projection={
-                        'first_name': True,
-                        'last_name': True,
-                        'email_address': True,
-                        'phone': True})
+                client = refs['client_id'][order['client_id']]
                 order['client_name'] = '{} {}'.format(client['first_name'], client['last_name'])
                 order['email'] = client['email_address']
                 order['phone'] = client['phone']['cell']
@@ -213,57 +220,40 @@ class Orders(Resource):
                 pass
 
             try:
-                patient = db.patients.find_one(
-                    {
-                        '_id': order['patient_id'],
-                    },
-                    projection={'name': True, 'birthday': True})
+                patient = refs['patient_id'][order['patient_id']]
                 order['patient_name'] = patient['name']
                 order['date_of_birth'] = patient['birthday']
             except:
                 pass
 
             try:
-                vet = db.vets.find_one(
-                    {
-                        '_id': order['vet_id'],
-                    },
-                    projection={'first_name': True, 'last_name': True})
+                vet = refs['vet_id'][order['vet_id']]
                 order['vet_name'] = '{} {}'.format(vet['first_name'], vet['last_name'])
             except:
                 pass
 
             try:
-                hospital = db.hospitals.find_one(
-                    {
-                        '_id': order['hospital_id'],
-                    },
-                    projection={'name': True})
+                hospital = refs['hospital_id'][order['hospital_id']]
                 order['hospital_name'] = hospital['name']
             except:
                 pass
 
             try:
-                pharmacy = db.pharmacies.find_one(
-                    {
-                        '_id': order['pharmacy_id'],
-                    },
-                    projection={'name': True})
+                pharmacy = refs['pharmacy_id'][order['pharmacy_id']]
                 order['pharmacy_name'] = pharmacy['name']
             except:
                 pass
 
-        return {'orders': orders, 'count': orders_count}, 200
+        return {'orders': orders, 'count': orders_count, 'cursor': cursor}, 200
 
     def post(self):
-        db = MongoClient(host=MONGO_HOST).db
+        db = mongo.get_db()
         args = {k: v for k, v in self._parser_post.parse_args().items() if v is not None}
 
         subtotal = 0.0
 
         if 'order_contents' in args:
             for product in args['order_contents']:
-                product = self._parser_order.parse_args(req=product)
                 subtotal += float(product['product_price']) * float(product['quantity'])
 
         total = subtotal + float(args['tax']) + float(args['shipping_amount'])
@@ -275,7 +265,25 @@ class Orders(Resource):
 
         args['history'] = {'created_on': datetime.datetime.utcnow()}
         args['is_archived'] = False
+        product_types.annotate(db, [args])
 
         order_id = db.orders.insert_one(args).inserted_id
+        counts.invalidate(db, 'orders')
+        sales.add(db, [args])
 
         return {'order_id': order_id}, 200
+
+
+class Export(Resource):
+    _parser_get = parser.Parser()
+    _parser_get.add_argument('format', choices=export.FORMATS, default=export.CSV)
+    _parser_get.add_argument('from', type=strptime, dest='created_from')
+    _parser_get.add_argument('to', type=strptime, dest='created_to')
+    _parser_get.add_argument('hospital_id', type=ObjectId)
+    _parser_get.add_argument('pharmacy_id', type=ObjectId)
+
+    def get(self):
+        args = self._parser_get.parse_args()
+        fmt = args.pop('format')
+
+        return export.response(mongo.get_db(), export.query(**args), fmt, 'orders')
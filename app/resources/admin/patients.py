@@ -1,40 +1,41 @@
 import datetime
 
 from bson.objectid import ObjectId
-from flask_restful import Resource, reqparse
-from pymongo import MongoClient
+from flask_restful import Resource
 
+from app.common import archive
+from app.common import counts
+from app.common import loader
+from app.common import mongo
+from app.common import paging
 from app.common import parser, notification, registration
+from app.common import search
 from app.common.datetime import strptime
-from app.common.env import *
 from app.common.fake_request import FakeRequest
 
 class Patient(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_put = reqparse.RequestParser()
-        self._parser_put.add_argument('client_id', type=ObjectId)
-        self._parser_put.add_argument('hospital_id', type=ObjectId)
-        self._parser_put.add_argument('vet_id', type=ObjectId)
-        self._parser_put.add_argument('name')
-        self._parser_put.add_argument('species')
-        self._parser_put.add_argument('breed')
-        self._parser_put.add_argument('gender')
-        self._parser_put.add_argument('age')
-        self._parser_put.add_argument('birthday', type=strptime)
-        self._parser_put.add_argument('weight')
-        self._parser_put.add_argument('first_name')
-        self._parser_put.add_argument('last_name')
-        self._parser_put.add_argument('phone', type=FakeRequest)
-        self._parser_put.add_argument('shipping_address', type=FakeRequest)
-        self._parser_put.add_argument('billing_address', type=FakeRequest)
-
-        self._parser_address = parser.address.copy()
-        self._parser_phone = parser.phone.copy()
+    _parser_put = parser.Parser()
+    _parser_put.add_argument('client_id', type=ObjectId)
+    _parser_put.add_argument('hospital_id', type=ObjectId)
+    _parser_put.add_argument('vet_id', type=ObjectId)
+    _parser_put.add_argument('name')
+    _parser_put.add_argument('species')
+    _parser_put.add_argument('breed')
+    _parser_put.add_argument('gender')
+    _parser_put.add_argument('age')
+    _parser_put.add_argument('birthday', type=strptime)
+    _parser_put.add_argument('weight')
+    _parser_put.add_argument('first_name')
+    _parser_put.add_argument('last_name')
+    _parser_put.add_argument('phone', type=FakeRequest)
+    _parser_put.add_argument('shipping_address', type=FakeRequest)
+    _parser_put.add_argument('billing_address', type=FakeRequest)
+
+    _parser_address = parser.address.copy()
+    _parser_phone = parser.phone.copy()
 
     def get(self, patient_id):
-        db = MongoClient(host=MONGO_HOST).db
+        db = mongo.get_db()
         projection = {
             'history': False,
             'is_archived': False,
@@ -44,7 +45,7 @@ class Patient(Resource):
         patient = db.patients.find_one(
             {
                 '_id': patient_id,
-                'is_archived': {'$in': [None, False]}
+                **archive.ACTIVE
             },
             projection=projection)
 
@@ -54,7 +55,7 @@ class Patient(Resource):
         client = db.clients.find_one(
             {
                 '_id': patient['client_id'],
-                'is_archived': {'$in': [None, False]}
+                **archive.ACTIVE
             },
             projection={
                 'first_name': True,
@@ -70,7 +71,7 @@ class Patient(Resource):
         vet = db.vets.find_one(
             {
                 '_id': patient['vet_id'],
-                'is_archived': {'$in': [None, False]}
+                **archive.ACTIVE
             },
             projection={
                 'suffix': True,
@@ -83,7 +84,7 @@ class Patient(Resource):
         hospital = db.hospitals.find_one(
             {
                 '_id': patient['hospital_id'],
-                'is_archived': {'$in': [None, False]}
+                **archive.ACTIVE
             },
             projection={'name': True})
         patient['hospital_name'] = ""
@@ -93,7 +94,7 @@ class Patient(Resource):
         return patient, 200
 
     def put(self, patient_id):
-        db = MongoClient(host=MONGO_HOST).db
+        db = mongo.get_db()
         args = {k: v for k, v in self._parser_put.parse_args().items() if v is not None}
         if 'phone' in args:
             args['phone'] = {k: v for k, v in
@@ -119,62 +120,83 @@ class Patient(Resource):
 
         args['history.modified_on'] = datetime.datetime.utcnow()
 
+        if 'first_name' in client or 'last_name' in client:
+            current = db.clients.find_one({'_id': patient['client_id']},
+                                          projection={'first_name': True, 'last_name': True}) or {}
+            client['client_name_normalized'] = search.client_name_key(
+                client.get('first_name', current.get('first_name')), client.get('last_name', current.get('last_name')))
+
         if client:
             client_result = db.clients.update_one(
                 {'_id': patient['client_id']}, {'$set': client}).modified_count
         else:
             client_result = False
 
+        if 'name' in patient:
+            patient['name_normalized'] = search.normalize(patient['name'])
+
         if patient:
-            patient_result = db.patients.update_one(
-                {'_id': patient_id}, {'$set': patient}).modified_count
+            before = db.patients.find_one_and_update({'_id': patient_id}, {'$set': patient},
+                                                     projection={'client_id': True, 'vet_id': True})
+            patient_result = before is not None
+            counts.invalidate(db, 'patients')
         else:
-            patient_result = False
+            before, patient_result = None, False
+
+        if before is not None:
+            old = (before.get('client_id'), before.get('vet_id'))
+            new = (patient.get('client_id', old[0]), patient.get('vet_id', old[1]))
+            if new != old:
+                search.remove_client_vets(db, [old])
+                search.add_client_vets(db, [new])
 
         return {'client_updated': bool(client_result),
                 'patient_updated': bool(patient_result)}, 200
 
     def delete(self, patient_id):
-        db = MongoClient(host=MONGO_HOST).db
-        result = db.patients.update_one({'_id': patient_id},
-                                        {'$set': {
-                                            'is_archived': True,
-                                            'history.archived_on': datetime.datetime.utcnow()}})
+        db = mongo.get_db()
+        before = db.patients.find_one_and_update({'_id': patient_id},
+                                                 {'$set': {
+                                                     'is_archived': True,
+                                                     'history.archived_on': datetime.datetime.utcnow()}},
+                                                 projection={'client_id': True, 'vet_id': True})
+        counts.invalidate(db, 'patients')
+        if before is not None:
+            search.remove_client_vets(db, [(before.get('client_id'), before.get('vet_id'))])
 
-        return {'deleted': bool(result.modified_count)}, 200
+        return {'deleted': before is not None}, 200
 
 
 class Patients(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_get = reqparse.RequestParser()
-        self._parser_get.add_argument('offset', type=int, default=0)
-        self._parser_get.add_argument('limit', type=int, default=20)
-
-        self._parser_post = reqparse.RequestParser()
-        self._parser_post.add_argument('client_id', type=ObjectId)
-        self._parser_post.add_argument('hospital_id', type=ObjectId)
-        self._parser_post.add_argument('vet_id', type=ObjectId)
-        self._parser_post.add_argument('first_name', required=True)
-        self._parser_post.add_argument('last_name', required=True)
-        self._parser_post.add_argument('email_address', required=True)
-        self._parser_post.add_argument('phone', required=True, type=FakeRequest)
-        self._parser_post.add_argument('shipping_address', type=FakeRequest)
-        self._parser_post.add_argument('billing_address', type=FakeRequest)
-        self._parser_post.add_argument('name', required=True)
-        self._parser_post.add_argument('species', required=True)
-        self._parser_post.add_argument('breed', required=True)
-        self._parser_post.add_argument('gender', required=True)
-        self._parser_post.add_argument('age', required=True)
-        self._parser_post.add_argument('birthday', type=strptime, required=True)
-        self._parser_post.add_argument('weight', required=True)
-
-        self._parser_address = parser.address.copy()
-        self._parser_phone = parser.phone.copy()
+    _parser_get = parser.Parser()
+    _parser_get.add_argument('offset', type=int, default=0)
+    _parser_get.add_argument('limit', type=int, default=20)
+    _parser_get.add_argument('cursor')
+    _parser_get.add_argument('count', choices=counts.MODES, default=counts.EXACT)
+
+    _parser_post = parser.Parser()
+    _parser_post.add_argument('client_id', type=ObjectId)
+    _parser_post.add_argument('hospital_id', type=ObjectId)
+    _parser_post.add_argument('vet_id', type=ObjectId)
+    _parser_post.add_argument('first_name', required=True)
+    _parser_post.add_argument('last_name', required=True)
+    _parser_post.add_argument('email_address', required=True)
+    _parser_post.add_argument('phone', required=True, type=FakeRequest)
+    _parser_post.add_argument('shipping_address', type=FakeRequest)
+    _parser_post.add_argument('billing_address', type=FakeRequest)
+    _parser_post.add_argument('name', required=True)
+    _parser_post.add_argument('species', required=True)
+    _parser_post.add_argument('breed', required=True)
+    _parser_post.add_argument('gender', required=True)
+    _parser_post.add_argument('age', required=True)
+    _parser_post.add_argument('birthday', type=strptime, required=True)
+    _parser_post.add_argument('weight', required=True)
+
+    _parser_address = parser.address.copy()
+    _parser_phone = parser.phone.copy()
 
     def get(self):
-        db = MongoClient(host=MONGO_HOST).db
+        db = mongo.get_db()
         projection = {
             'history': False,
             'is_archived': False,
@@ -183,48 +205,39 @@ class Patients(Resource):
 
         args = self._parser_get.parse_args()
 
-        patients = list(db.patients.find({'is_archived': {'$in': [None, False]}},
-                                         projection=projection, skip=args['offset'], limit=args['limit']))
+        patients, cursor = paging.page(db.patients, archive.ACTIVE, [('_id', 1)], args['limit'],
+                                       cursor=args['cursor'], offset=args['offset'], projection=projection)
+
+        patients_count = counts.count(db, 'patients', archive.ACTIVE, args['count'])
 
-        patients_count = db.patients.count({'is_archived': {'$in': [None, False]}})
+        refs = loader.load_refs(db, patients, {
+            'client_id': ('clients', {'first_name': True, 'last_name': True}),
+            'vet_id': ('vets', {'suffix': True, 'first_name': True, 'last_name': True}),
+            'hospital_id': ('hospitals', {'name': True}),
+        })
 
         for patient in patients:
             patient['patient_id'] = patient.pop('_id')
 
-            client = db.clients.find_one(
-                {
-                    '_id': patient['client_id'],
-                },
-                projection={'first_name': True, 'last_name': True})
+            client = refs['client_id'].get(patient['client_id'])
             patient['client_name'] = '{} {}'.format(client['first_name'], client['last_name'])
 
-            vet = db.vets.find_one(
-                {
-                    '_id': patient['vet_id'],
-                },
-                projection={
-                    'suffix': True,
-                    'first_name': True,
-                    'last_name': True})
+            vet = refs['vet_id'].get(patient['vet_id'])
             if vet:
                 patient['vet_name'] = f"{vet['suffix']} {vet['first_name']} {vet['last_name']}"
             else:
                 patient['vet_name'] = ""
 
-            hospital = db.hospitals.find_one(
-                {
-                    '_id': patient['hospital_id'],
-                },
-                projection={'name': True})
+            hospital = refs['hospital_id'].get(patient['hospital_id'])
             if hospital:
                 patient['hospital_name'] = hospital.get('name', "")
             else:
                 patient['hospital_name'] = ""
 
-        return {'patients': patients, 'count': patients_count}, 200
+        return {'patients': patients, 'count': patients_count, 'cursor': cursor}, 200
 
     def post(self):
-        db = MongoClient(host=MONGO_HOST).db
+        db = mongo.get_db()
         args = self._parser_post.parse_args()
         args['phone'] = {k: v for k, v in
                          self._parser_phone.parse_args(req=args['phone']).items() if v is not None}
@@ -258,9 +271,13 @@ class Patients(Resource):
             client['email_address'], client['phone']['cell'], token)
 
         client['user_id'] = ObjectId(user_id)
+        client['client_name_normalized'] = search.client_name_key(client['first_name'], client['last_name'])
+        client['vet_ids'] = [patient['vet_id']] if patient['vet_id'] else []
         client_id = db.clients.insert_one(client).inserted_id
 
         patient['client_id'] = client_id
+        patient['name_normalized'] = search.normalize(patient['name'])
         patient_id = db.patients.insert_one(patient).inserted_id
+        counts.invalidate(db, 'patients')
 
         return {'patient_id': patient_id, 'client_id': client_id, 'confirmation': confirmation}, 200
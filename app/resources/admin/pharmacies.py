@@ -1,30 +1,29 @@
 import datetime
 
 from bson.objectid import ObjectId
-from flask_restful import Resource, reqparse
-from pymongo import MongoClient
+from flask_restful import Resource
 
+from app.common import archive
+from app.common import counts
+from app.common import mongo
+from app.common import paging
 from app.common import notification
 from app.common import parser
 from app.common import registration
-from app.common.env import *
 from app.common.fake_request import FakeRequest
 from app.common.types import strphone
 
 
 class Pharmacy(Resource):
-    def __init__(self):
-        super().__init__()
+    _parser_put = parser.Parser()
+    _parser_put.add_argument('name')
+    _parser_put.add_argument('email')
+    _parser_put.add_argument('phone', type=strphone)
+    _parser_put.add_argument('fax')
+    _parser_put.add_argument('address', type=FakeRequest)
+    _parser_put.add_argument('type')
 
-        self._parser_put = reqparse.RequestParser()
-        self._parser_put.add_argument('name')
-        self._parser_put.add_argument('email')
-        self._parser_put.add_argument('phone', type=strphone)
-        self._parser_put.add_argument('fax')
-        self._parser_put.add_argument('address', type=FakeRequest)
-        self._parser_put.add_argument('type')
-
-        self._parser_address = parser.address.copy()
+    _parser_address = parser.address.copy()
 
     def get(self, pharmacy_id):
         projection = {
@@ -38,10 +37,10 @@ class Pharmacy(Resource):
             '_id': False
         }
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         pharmacy = mongo_cli.db.pharmacies.find_one(
-            {'_id': pharmacy_id, 'is_archived': {'$in': [None, False]}},
+            {'_id': pharmacy_id, **archive.ACTIVE},
             projection=projection)
 
         if not pharmacy:
@@ -60,18 +59,19 @@ class Pharmacy(Resource):
 
         args['history.modified_on'] = datetime.datetime.utcnow()
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
         result = mongo_cli.db.pharmacies.update_one({'_id': pharmacy_id}, {'$set': args})
 
         return {'updated': bool(result.modified_count)}, 200
 
     def delete(self, pharmacy_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         result = mongo_cli.db.pharmacies.update_one({'_id': pharmacy_id},
                                                     {'$set': {
                                                         'is_archived': True,
                                                         'history.archived_on': datetime.datetime.utcnow()}})
+        counts.invalidate(mongo_cli.db, 'pharmacies')
 
         if result.modified_count:
             pharmacy = mongo_cli.db.pharmacies.find_one({'_id': pharmacy_id})
@@ -83,21 +83,20 @@ class Pharmacy(Resource):
 
 
 class Pharmacies(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_get = reqparse.RequestParser()
-        self._parser_get.add_argument('offset', type=int, default=0)
-        self._parser_get.add_argument('limit', type=int, default=20)
+    _parser_get = parser.Parser()
+    _parser_get.add_argument('offset', type=int, default=0)
+    _parser_get.add_argument('limit', type=int, default=20)
+    _parser_get.add_argument('cursor')
+    _parser_get.add_argument('count', choices=counts.MODES, default=counts.EXACT)
 
-        self._parser_post = reqparse.RequestParser()
-        self._parser_post.add_argument('name', required=True)
-        self._parser_post.add_argument('email', required=True)
-        self._parser_post.add_argument('phone', required=True, type=strphone)
-        self._parser_post.add_argument('address', type=FakeRequest, required=True)
-        self._parser_post.add_argument('type', required=True)
+    _parser_post = parser.Parser()
+    _parser_post.add_argument('name', required=True)
+    _parser_post.add_argument('email', required=True)
+    _parser_post.add_argument('phone', required=True, type=strphone)
+    _parser_post.add_argument('address', type=FakeRequest, required=True)
+    _parser_post.add_argument('type', required=True)
 
-        self._parser_address = parser.address.copy()
+    _parser_address = parser.address.copy()
 
     def get(self):
         projection = {
@@ -109,25 +108,30 @@ class Pharmacies(Resource):
             'type': True
         }
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         args = self._parser_get.parse_args()
-        pharmacies = list(mongo_cli.db.pharmacies.find({'is_archived': {'$in': [None, False]}},
-                                                       projection=projection, skip=args['offset'], limit=args['limit']))
+        pharmacies, cursor = paging.page(mongo_cli.db.pharmacies, archive.ACTIVE, [('_id', 1)], args['limit'],
+                                         cursor=args['cursor'], offset=args['offset'], projection=projection)
+
+        pharmacies_count = counts.count(mongo_cli.db, 'pharmacies', archive.ACTIVE, args['count'])
 
-        pharmacies_count = mongo_cli.db.pharmacies.count({'is_archived': {'$in': [None, False]}})
+        pharmacy_ids = [_['_id'] for _ in pharmacies]
+        hospitals = list(mongo_cli.db.hospitals.find(
+            {'$or': [
+                {'pharmacies.Retail': {'$in': pharmacy_ids}},
+                {'pharmacies.Compounded': {'$in': pharmacy_ids}},
+                {'pharmacies.502b': {'$in': pharmacy_ids}}]},
+            projection={'name': True, 'pharmacies': True, '_id': False})) if pharmacy_ids else []
 
         for pharmacy in pharmacies:
-            pharmacy['hospitals'] = list(mongo_cli.db.hospitals.find(
-                {'$or': [
-                    {'pharmacies.Retail': pharmacy['_id']},
-                    {'pharmacies.Compounded': pharmacy['_id']},
-                    {'pharmacies.502b': pharmacy['_id']}]},
-                projection={'name': True, '_id': False}))
+            pharmacy['hospitals'] = [
+                {'name': h['name']} for h in hospitals
+                if pharmacy['_id'] in {h['pharmacies'].get(t) for t in ('Retail', 'Compounded', '502b')}]
 
             pharmacy['pharmacy_id'] = pharmacy.pop('_id')
 
-        return {'pharmacies': pharmacies, 'count': pharmacies_count}, 200
+        return {'pharmacies': pharmacies, 'count': pharmacies_count, 'cursor': cursor}, 200
 
     def post(self):
         args = self._parser_post.parse_args()
@@ -143,8 +147,9 @@ class Pharmacies(Resource):
 
         args['user_id'] = ObjectId(user_id)
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
         pharmacy_id = mongo_cli.db.pharmacies.insert_one(args).inserted_id
+        counts.invalidate(mongo_cli.db, 'pharmacies')
 
         confirmation = notification.send_confirmation(
             args['name'], args['email'], args['phone'], token)
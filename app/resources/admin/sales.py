@@ -0,0 +1,22 @@
+from bson.objectid import ObjectId
+from flask_restful import Resource
+
+from app.common import mongo
+from app.common import parser
+from app.common import sales
+from app.common.datetime import strptime
+
+
+class Sales(Resource):
+    _parser_get = parser.Parser()
+    _parser_get.add_argument('from', type=strptime, dest='created_from')
+    _parser_get.add_argument('to', type=strptime, dest='created_to')
+    _parser_get.add_argument('group', choices=sales.GROUPS, default='day')
+    _parser_get.add_argument('hospital_id', type=ObjectId)
+    _parser_get.add_argument('pharmacy_id', type=ObjectId)
+    _parser_get.add_argument('type', choices=('one_time', 'subscription',), dest='order_type')
+
+    def get(self):
+        args = self._parser_get.parse_args()
+
+        return {'sales': sales.report(mongo.get_db(), **args)}, 200
@@ -1,21 +1,17 @@
-import requests
-from flask_restful import Resource, reqparse
+from flask_restful import Resource
 
-from app.common.env import *
+from app.common import parser
+from app.common import upstream
 
 
 class Register(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_post = reqparse.RequestParser()
-        self._parser_post.add_argument('email', required=True)
-        self._parser_post.add_argument('role', required=True)
+    _parser_post = parser.Parser()
+    _parser_post.add_argument('email', required=True)
+    _parser_post.add_argument('role', required=True)
 
     def post(self):
         args = self._parser_post.parse_args()
 
-        url = '{}/api/v1/auth/register'.format(AUTH_HOST)
-        resp = requests.post(url, json=args)
+        resp = upstream.auth.post('/api/v1/auth/register', json=args)
 
         return resp.json(), resp.status_code
@@ -1,39 +1,38 @@
 import datetime
 
 from bson.objectid import ObjectId
-from flask_restful import Resource, reqparse
-from pymongo import MongoClient
+from flask_restful import Resource
 
+from app.common import archive
+from app.common import counts
+from app.common import loader
+from app.common import mongo
 from app.common import notification
 from app.common import parser
 from app.common import registration
 from app.common.datetime import strptime
-from app.common.env import *
 from app.common.fake_request import FakeRequest
 
 
 class Vet(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_put = reqparse.RequestParser()
-        self._parser_put.add_argument('hospital_id', type=ObjectId)
-        self._parser_put.add_argument('suffix')
-        self._parser_put.add_argument('first_name')
-        self._parser_put.add_argument('last_name')
-        self._parser_put.add_argument('email_address')
-        self._parser_put.add_argument('specialty')
-        self._parser_put.add_argument('date_of_birth', type=strptime)
-        self._parser_put.add_argument('dea')
-        self._parser_put.add_argument('npi')
-        self._parser_put.add_argument('gender')
-        self._parser_put.add_argument('state_license')
-        self._parser_put.add_argument('is_hospital_admin', type=bool)
-        self._parser_put.add_argument('phone', type=FakeRequest)
-        self._parser_put.add_argument('address', type=FakeRequest)
-
-        self._parser_address = parser.address.copy()
-        self._parser_phone = parser.phone.copy()
+    _parser_put = parser.Parser()
+    _parser_put.add_argument('hospital_id', type=ObjectId)
+    _parser_put.add_argument('suffix')
+    _parser_put.add_argument('first_name')
+    _parser_put.add_argument('last_name')
+    _parser_put.add_argument('email_address')
+    _parser_put.add_argument('specialty')
+    _parser_put.add_argument('date_of_birth', type=strptime)
+    _parser_put.add_argument('dea')
+    _parser_put.add_argument('npi')
+    _parser_put.add_argument('gender')
+    _parser_put.add_argument('state_license')
+    _parser_put.add_argument('is_hospital_admin', type=bool)
+    _parser_put.add_argument('phone', type=FakeRequest)
+    _parser_put.add_argument('address', type=FakeRequest)
+
+    _parser_address = parser.address.copy()
+    _parser_phone = parser.phone.copy()
 
     def get(self, vet_id):
         projection = {
@@ -54,12 +53,12 @@ class Vet(Resource):
             '_id': False
         }
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         vet = mongo_cli.db.vets.find_one(
             {
                 '_id': vet_id,
-                'is_archived': {'$in': [None, False]}
+                **archive.ACTIVE
             },
             projection=projection)
 
@@ -68,7 +67,7 @@ class Vet(Resource):
 
         hospital = mongo_cli.db.hospitals.find_one(
             {
-                '_id': vet['hospital_id'], 'is_archived': {'$in': [None, False]}
+                '_id': vet['hospital_id'], **archive.ACTIVE
             },
             projection={'name': True, '_id': False})
         vet['hospital_name'] = hospital['name']
@@ -85,19 +84,20 @@ class Vet(Resource):
                                self._parser_address.parse_args(req=args['address']).items() if v is not None}
         args['history.modified_on'] = datetime.datetime.utcnow()
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         result = mongo_cli.db.vets.update_one({'_id': vet_id}, {'$set': args})
 
         return {'updated': bool(result.modified_count)}, 200
 
     def delete(self, vet_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         result = mongo_cli.db.vets.update_one({'_id': vet_id},
                                               {'$set': {
                                                   'is_archived': True,
                                                   'history.archived_on': datetime.datetime.utcnow()}})
+        counts.invalidate(mongo_cli.db, 'vets')
 
         if result.modified_count:
             vet = mongo_cli.db.vets.find_one({'_id': vet_id})
@@ -109,31 +109,29 @@ class Vet(Resource):
 
 
 class Vets(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_get = reqparse.RequestParser()
-        self._parser_get.add_argument('offset', type=int, default=0)
-        self._parser_get.add_argument('limit', type=int, default=20)
-
-        self._parser_post = reqparse.RequestParser()
-        self._parser_post.add_argument('hospital_id', type=ObjectId)
-        self._parser_post.add_argument('suffix')
-        self._parser_post.add_argument('first_name', required=True)
-        self._parser_post.add_argument('last_name', required=True)
-        self._parser_post.add_argument('email_address', required=True)
-        self._parser_post.add_argument('specialty')
-        self._parser_post.add_argument('date_of_birth', type=strptime)
-        self._parser_post.add_argument('dea')
-        self._parser_post.add_argument('pims_id')
-        self._parser_post.add_argument('gender')
-        self._parser_post.add_argument('state_license')
-        self._parser_post.add_argument('is_hospital_admin', required=True, type=bool)
-        self._parser_post.add_argument('phone', required=True, type=FakeRequest)
-        self._parser_post.add_argument('address', required=True, type=FakeRequest)
-
-        self._parser_address = parser.address.copy()
-        self._parser_phone = parser.phone.copy()
+    _parser_get = parser.Parser()
+    _parser_get.add_argument('offset', type=int, default=0)
+    _parser_get.add_argument('limit', type=int, default=20)
+    _parser_get.add_argument('count', choices=counts.MODES, default=counts.EXACT)
+
+    _parser_post = parser.Parser()
+    _parser_post.add_argument('hospital_id', type=ObjectId)
+    _parser_post.add_argument('suffix')
+    _parser_post.add_argument('first_name', required=True)
+    _parser_post.add_argument('last_name', required=True)
+    _parser_post.add_argument('email_address', required=True)
+    _parser_post.add_argument('specialty')
+    _parser_post.add_argument('date_of_birth', type=strptime)
+    _parser_post.add_argument('dea')
+    _parser_post.add_argument('pims_id')
+    _parser_post.add_argument('gender')
+    _parser_post.add_argument('state_license')
+    _parser_post.add_argument('is_hospital_admin', required=True, type=bool)
+    _parser_post.add_argument('phone', required=True, type=FakeRequest)
+    _parser_post.add_argument('address', required=True, type=FakeRequest)
+
+    _parser_address = parser.address.copy()
+    _parser_phone = parser.phone.copy()
 
     def get(self):
         projection = {
@@ -154,25 +152,21 @@ class Vets(Resource):
             'pims_id': True
         }
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         args = self._parser_get.parse_args()
-        vets = list(mongo_cli.db.vets.find({'is_archived': {'$in': [None, False]}},
+        vets = list(mongo_cli.db.vets.find(archive.ACTIVE,
                                            projection=projection, skip=args['offset'], limit=args['limit']))
 
-        vets_count = mongo_cli.db.vets.count({'is_archived': {'$in': [None, False]}})
+        vets_count = counts.count(mongo_cli.db, 'vets', archive.ACTIVE, args['count'])
+
+        hospitals = loader.load_refs(mongo_cli.db, vets, {
+            'hospital_id': ('hospitals', {'name': True})
+        })['hospital_id']
 
-        hospitals_cache = {}
         for vet in vets:
             vet['vet_id'] = vet.pop('_id')
-
-            hid = vet['hospital_id']
-            if hid not in hospitals_cache:
-                hospital = mongo_cli.db.hospitals.find_one(
-                    {'_id': hid},
-                    projection={'name': True, '_id': False})
-                hospitals_cache[hid] = hospital['name']
-            vet['hospital_name'] = hospitals_cache[hid]
+            vet['hospital_name'] = hospitals[vet['hospital_id']]['name']
 
         return {'vets': vets, 'count': vets_count}, 200
 
@@ -191,8 +185,9 @@ class Vets(Resource):
 
         args['user_id'] = ObjectId(user_id)
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
         vet_id = mongo_cli.db.vets.insert_one(args).inserted_id
+        counts.invalidate(mongo_cli.db, 'vets')
 
         confirmation = notification.send_confirmation(
             f"{args['first_name']} {args['last_name']}",
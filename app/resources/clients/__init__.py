@@ -1,6 +1,7 @@
 from flask import Blueprint
 from flask_restful import Api
 
+from app.common.json import output_json
 from app.resources.clients import care_team
 from app.resources.clients import clients
 from app.resources.clients import orders
@@ -12,6 +13,7 @@ from app.resources.clients import payments
 
 clients_bp = Blueprint('clients', __name__, url_prefix='/api/v1')
 clients_api = Api(clients_bp, prefix='/clients')
+clients_api.representations['application/json'] = output_json
 
 clients_api.add_resource(care_team.CareTeam, '/<oid:client_id>/care_team')
 
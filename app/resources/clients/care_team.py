@@ -1,17 +1,18 @@
 from flask_restful import Resource
-from pymongo import MongoClient
 
-from app.common.env import *
+from app.common import archive
+from app.common import loader
+from app.common import mongo
 
 
 class CareTeam(Resource):
     def get(self, client_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         orders = list(mongo_cli.db.orders.find(
-            {'client_id': client_id, 'is_archived': {'$in': [False, None]}}))
+            {'client_id': client_id, **archive.ACTIVE}))
         subscriptions = list(mongo_cli.db.subscriptions.find(
-            {'client_id': client_id, 'is_archived': {'$in': [False, None]}}))
+            {'client_id': client_id, **archive.ACTIVE}))
         vet_ids = {_['vet_id'] for _ in orders} | {_['vet_id']
                                                    for _ in subscriptions}
         vet_projection = {
@@ -23,9 +24,12 @@ class CareTeam(Resource):
             'address': True
         }
         vets = []
+        vet_docs = loader.load_by_ids(mongo_cli.db, 'vets', vet_ids,
+                                      projection=dict(vet_projection, is_archived=True))
         for vet_id in vet_ids:
-            vet = mongo_cli.db.vets.find_one({'_id': vet_id, 'is_archived': {
-                '$in': [False, None]}}, projection=vet_projection)
+            vet = vet_docs.get(vet_id)
+            if vet is None or vet.pop('is_archived', None):
+                continue
             vet['vet_id'] = vet.pop('_id')
             vet['phone'] = vet.pop('phone')['work']
             vet['name'] = '{} {}'.format(
@@ -46,10 +50,12 @@ class CareTeam(Resource):
             'address': True
         }
         pharmacies = []
+        pharmacy_docs = loader.load_by_ids(mongo_cli.db, 'pharmacies', pharmacy_ids,
+                                           projection=dict(pharmacy_projection, is_archived=True))
         for pharmacy_id in pharmacy_ids:
-            pharm = mongo_cli.db.pharmacies.find_one({'_id': pharmacy_id,
-                                                      'is_archived': {'$in': [False, None]}},
-                                                     projection=pharmacy_projection)
+            pharm = pharmacy_docs.get(pharmacy_id)
+            if pharm is None or pharm.pop('is_archived', None):
+                continue
             pharm['pharmacy_id'] = pharm.pop('_id')
             pharm['email_address'] = pharm.pop('email')
             pharmacies.append(pharm)
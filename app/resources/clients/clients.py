@@ -1,31 +1,33 @@
 import datetime
 
 from bson.objectid import ObjectId
-from flask_restful import Resource, abort, reqparse
-from pymongo import MongoClient
+from flask_restful import Resource, abort
 
+from app.common import archive
+from app.common import mongo
 from app.common import notification
 from app.common import parser
 from app.common import registration
+from app.common import search
 from app.common.datetime import strptime
-from app.common.env import *
 from app.common.fake_request import FakeRequest
+from app.common.types import Schema
 
+# pets are stored as sent, in the shape the client patients listing returns
+PETS = Schema('patient_id', 'client_id', 'vet_id', 'hospital_id')
 
-class Clients(Resource):
-    def __init__(self):
-        super().__init__()
 
-        self._parser = reqparse.RequestParser()
-        self._parser.add_argument('first_name', required=True)
-        self._parser.add_argument('last_name', required=True)
-        self._parser.add_argument('email_address', required=True)
-        self._parser.add_argument('phone', required=True, type=FakeRequest)
-        self._parser.add_argument('billing_address', type=FakeRequest)
-        self._parser.add_argument('shipping_address', type=FakeRequest)
+class Clients(Resource):
+    _parser = parser.Parser()
+    _parser.add_argument('first_name', required=True)
+    _parser.add_argument('last_name', required=True)
+    _parser.add_argument('email_address', required=True)
+    _parser.add_argument('phone', required=True, type=FakeRequest)
+    _parser.add_argument('billing_address', type=FakeRequest)
+    _parser.add_argument('shipping_address', type=FakeRequest)
 
-        self._parser_address = parser.address.copy()
-        self._parser_phone = parser.phone.copy()
+    _parser_address = parser.address.copy()
+    _parser_phone = parser.phone.copy()
 
     def post(self):
         args = self._parser.parse_args()
@@ -54,8 +56,10 @@ class Clients(Resource):
             return {'message': str(e)}, 400
 
         args['user_id'] = ObjectId(user_id)
+        args['client_name_normalized'] = search.client_name_key(args['first_name'], args['last_name'])
+        args['vet_ids'] = []
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
         client_id = mongo_cli.db.clients.insert_one(args).inserted_id
 
         confirmation = notification.send_confirmation(
@@ -66,32 +70,29 @@ class Clients(Resource):
 
 
 class Client(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_put = reqparse.RequestParser()
-        self._parser_put.add_argument('first_name')
-        self._parser_put.add_argument('last_name')
-        self._parser_put.add_argument('gender')
-        self._parser_put.add_argument('image_url')
-        self._parser_put.add_argument('date_of_birth', type=strptime)
-        self._parser_put.add_argument('billing_address', type=FakeRequest)
-        self._parser_put.add_argument('shipping_address', type=FakeRequest)
-        # self._parser_put.add_argument('email_address')
-        self._parser_put.add_argument('phone', type=FakeRequest)
-        self._parser_put.add_argument('pets', type=list)
-        self._parser_put.add_argument('email_opt_out', type=bool)
-        self._parser_put.add_argument('sms_opt_out', type=bool)
-        self._parser_put.add_argument('card', type=FakeRequest)
-
-        self._parser_card = reqparse.RequestParser()
-        self._parser_card.add_argument('number', required=True)
-        self._parser_card.add_argument('expiry_date', required=True)
-        self._parser_card.add_argument('cardholder_name', required=True)
-        self._parser_card.add_argument('type')
-
-        self._parser_address = parser.address.copy()
-        self._parser_phone = parser.phone.copy()
+    _parser_put = parser.Parser()
+    _parser_put.add_argument('first_name')
+    _parser_put.add_argument('last_name')
+    _parser_put.add_argument('gender')
+    _parser_put.add_argument('image_url')
+    _parser_put.add_argument('date_of_birth', type=strptime)
+    _parser_put.add_argument('billing_address', type=FakeRequest)
+    _parser_put.add_argument('shipping_address', type=FakeRequest)
+    # _parser_put.add_argument('email_address')
+    _parser_put.add_argument('phone', type=FakeRequest)
+    _parser_put.add_argument('pets', type=PETS, action='append')
+    _parser_put.add_argument('email_opt_out', type=bool)
+    _parser_put.add_argument('sms_opt_out', type=bool)
+    _parser_put.add_argument('card', type=FakeRequest)
+
+    _parser_card = parser.Parser()
+    _parser_card.add_argument('number', required=True)
+    _parser_card.add_argument('expiry_date', required=True)
+    _parser_card.add_argument('cardholder_name', required=True)
+    _parser_card.add_argument('type')
+
+    _parser_address = parser.address.copy()
+    _parser_phone = parser.phone.copy()
 
     def get(self, client_id):
         projection = {
@@ -100,9 +101,9 @@ class Client(Resource):
             'is_archived': False
         }
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
         client = mongo_cli.db.clients.find_one(
-            {'_id': client_id, 'is_archived': {'$in': [False, None]}},
+            {'_id': client_id, **archive.ACTIVE},
             projection=projection)
         if not client:
             abort(404)
@@ -127,7 +128,7 @@ class Client(Resource):
 
         if 'shipping_address' not in client:
             order = mongo_cli.db.orders.find_one(
-                {'client_id': client_id, 'is_archived': {'$in': [False, None]}}
+                {'client_id': client_id, **archive.ACTIVE}
             )
             if order:
                 client['shipping_address'] = order['shipping_address']
@@ -143,7 +144,7 @@ class Client(Resource):
         if args.get('card') is not None:
             args['card'] = self._parser_card.parse_args(req=args['card'])[-4:]
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
         client = mongo_cli.db.clients.find_one({'_id': client_id})
 
         if args.get('shipping_address') is not None:
@@ -170,6 +171,10 @@ class Client(Resource):
         elif isinstance(args.get('phone'), str):
             args['phone'] = {"cell": args.get('phone')}
 
+        if 'first_name' in args or 'last_name' in args:
+            args['client_name_normalized'] = search.client_name_key(
+                args.get('first_name', client.get('first_name')), args.get('last_name', client.get('last_name')))
+
         args['history.modified_on'] = datetime.datetime.utcnow()
 
         result = mongo_cli.db.clients.update_one(
@@ -178,7 +183,7 @@ class Client(Resource):
         return {'updated': bool(result.modified_count)}, 200
 
     def delete(self, client_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         result = mongo_cli.db.clients.update_one({'_id': client_id},
                                                  {'$set': {
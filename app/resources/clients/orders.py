@@ -1,22 +1,22 @@
 import datetime
 
-from flask_restful import Resource, abort, reqparse
-from pymongo import MongoClient
+from flask_restful import Resource, abort
 
-from app.common.env import *
+from app.common import archive
+from app.common import counts
+from app.common import loader
+from app.common import mongo
+from app.common import parser
 
 
 class Orders(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_get = reqparse.RequestParser()
-        self._parser_get.add_argument('type')
+    _parser_get = parser.Parser()
+    _parser_get.add_argument('type')
 
     def get(self, client_id):
         args = {k: v for k, v in self._parser_get.parse_args().items() if v is not None}
         args['client_id'] = client_id
-        args['is_archived'] = {'$in': [False, None]}
+        args.update(archive.ACTIVE)
 
         if args.get('type'):
             args['order_type'] = args.pop('type')
@@ -26,21 +26,23 @@ class Orders(Resource):
             'is_archived': False
         }
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
         orders = list(mongo_cli.db.orders.find(args, projection=projection))
 
+        refs = loader.load_refs(mongo_cli.db, orders, {
+            'patient_id': ('patients', {'name': True}),
+            'order_contents.product_id': ('products', {'product_name': True, 'image_url': True}),
+        })
+
         for order in orders:
             order['order_id'] = order.pop('_id')
 
-            patient = mongo_cli.db.patients.find_one(
-                {'_id': order['patient_id']},
-                {'name': True})
+            patient = refs['patient_id'].get(order['patient_id'])
             if patient:
                 order['patient_name'] = patient['name']
 
             for product in order['order_contents']:
-                _ = mongo_cli.db.products.find_one(
-                    {'_id': product['product_id']})
+                _ = refs['order_contents.product_id'].get(product['product_id'])
                 product['product_name'] = _['product_name'] if _ else None
                 product['image_url'] = _['image_url'] if _ else None
 
@@ -48,15 +50,12 @@ class Orders(Resource):
 
 
 class Order(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_put = reqparse.RequestParser()
-        self._parser_put.add_argument('comments')
-        self._parser_put.add_argument('is_satisfied', required=True, type=bool)
+    _parser_put = parser.Parser()
+    _parser_put.add_argument('comments')
+    _parser_put.add_argument('is_satisfied', required=True, type=bool)
 
     def get(self, client_id, order_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         projection = {
             'history': False,
@@ -66,7 +65,7 @@ class Order(Resource):
 
         order = mongo_cli.db.orders.find_one(
             {'_id': order_id, 'client_id': client_id,
-             'is_archived': {'$in': [False, None]}},
+             **archive.ACTIVE},
             projection=projection
         )
         if not order:
@@ -90,8 +89,9 @@ class Order(Resource):
         args['timestamp'] = datetime.datetime.utcnow()
         args['is_feedback_read'] = False
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
         result = mongo_cli.db.orders.update_one(
             {'_id': order_id, 'client_id': client_id}, {'$set': {'feedback': args}})
+        counts.invalidate(mongo_cli.db, 'orders')
 
         return {'updated': bool(result.modified_count)}, 200
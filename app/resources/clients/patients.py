@@ -1,30 +1,36 @@
 import datetime
 
 from flask_restful import Resource
-from pymongo import MongoClient
 
-from app.common.env import *
+from app.common import archive
+from app.common import counts
+from app.common import mongo
+from app.common import search
 
 
 class Patient(Resource):
     def delete(self, client_id, patient_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
-        result = mongo_cli.db.patients.update_one(
+        mongo_cli = mongo.get_client()
+        before = mongo_cli.db.patients.find_one_and_update(
             {'_id': patient_id, 'client_id': client_id},
             {
                 '$set': {
                     'is_archived': True,
                     'history.archived_on': datetime.datetime.utcnow()
                 }
-            }
+            },
+            projection={'vet_id': True}
         )
+        counts.invalidate(mongo_cli.db, 'patients')
+        if before is not None:
+            search.remove_client_vets(mongo_cli.db, [(client_id, before.get('vet_id'))])
 
-        return {'deleted': bool(result.modified_count)}, 200
+        return {'deleted': before is not None}, 200
 
 
 class Patients(Resource):
     def get(self, client_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         projection = {
             'history': False,
@@ -32,7 +38,7 @@ class Patients(Resource):
         }
 
         pets = list(mongo_cli.db.patients.find(
-            {'client_id': client_id, 'is_archived': {'$in': [False, None]}},
+            {'client_id': client_id, **archive.ACTIVE},
             projection=projection)
         )
 
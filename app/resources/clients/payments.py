@@ -1,27 +1,27 @@
 import datetime
 
-from flask_restful import Resource, reqparse
-from pymongo import MongoClient
+from flask_restful import Resource
 
-from app.common.env import *
+from app.common import archive
+from app.common import mongo
+from app.common import parser
 from app.common.fake_request import FakeRequest
 
 
 class Payments(Resource):
-    def __init__(self):
-        self._parser_post = reqparse.RequestParser()
-        self._parser_post.add_argument('card', type=FakeRequest, required=True)
+    _parser_post = parser.Parser()
+    _parser_post.add_argument('card', type=FakeRequest, required=True)
 
-        self._parser_card = reqparse.RequestParser()
-        self._parser_card.add_argument('card_number', required=True)
-        self._parser_card.add_argument('expiry_date', required=True)
-        self._parser_card.add_argument('cardholder_name', required=True)
+    _parser_card = parser.Parser()
+    _parser_card.add_argument('card_number', required=True)
+    _parser_card.add_argument('expiry_date', required=True)
+    _parser_card.add_argument('cardholder_name', required=True)
 
     def get(self, client_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         order = mongo_cli.db.orders.find_one(
-            {'client_id': client_id, 'is_archived': {'$in': [False, None]}},
+            {'client_id': client_id, **archive.ACTIVE},
             sort=[('history.created_on', -1)])
 
         if order:
@@ -37,7 +37,7 @@ class Payments(Resource):
         args = self._parser_post.parse_args()
         card = self._parser_card.parse_args(req=args['card'])
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
         result = mongo_cli.db.clients.update_one(
             {'_id': client_id},
             {'$set': {
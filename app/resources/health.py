@@ -0,0 +1,21 @@
+from flask_restful import Resource
+
+from app.common import indexes
+from app.common import mongo
+from app.common import upstream
+
+
+class Mongo(Resource):
+    def get(self):
+        return mongo.stats(), 200
+
+
+class Upstreams(Resource):
+    def get(self):
+        return upstream.stats(), 200
+
+
+class Indexes(Resource):
+    def get(self):
+        absent = indexes.missing()
+        return {'missing': absent}, 503 if absent else 200
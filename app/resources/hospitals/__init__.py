@@ -1,12 +1,14 @@
 from flask import Blueprint
 from flask_restful import Api
 
+from app.common.json import output_json
 from app.resources.hospitals import hospitals
 from app.resources.hospitals import products
 from app.resources.hospitals import vets
 
 hospitals_bp = Blueprint('hospitals', __name__, url_prefix='/api/v1')
 hospitals_api = Api(hospitals_bp, prefix='/hospitals')
+hospitals_api.representations['application/json'] = output_json
 
 hospitals_api.add_resource(hospitals.Hospital, '/<oid:hospital_id>')
 
@@ -1,29 +1,26 @@
 import datetime
 
-from flask_restful import Resource, reqparse
-from pymongo import MongoClient
+from flask_restful import Resource
 
+from app.common import archive
+from app.common import mongo
 from app.common import parser
-from app.common.env import *
 from app.common.fake_request import FakeRequest
 from app.common.types import strphone
 
 
 class Hospital(Resource):
-    def __init__(self):
-        super().__init__()
+    _parser_put = parser.Parser()
+    _parser_put.add_argument('name')
+    _parser_put.add_argument('phone', type=strphone)
+    _parser_put.add_argument('fax')
+    _parser_put.add_argument('email')
+    _parser_put.add_argument('address', type=FakeRequest)
 
-        self._parser_put = reqparse.RequestParser()
-        self._parser_put.add_argument('name')
-        self._parser_put.add_argument('phone', type=strphone)
-        self._parser_put.add_argument('fax')
-        self._parser_put.add_argument('email')
-        self._parser_put.add_argument('address', type=FakeRequest)
-
-        self._parser_address = parser.address.copy()
+    _parser_address = parser.address.copy()
 
     def get(self, hospital_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         projection = {
             '_id': False,
@@ -34,14 +31,14 @@ class Hospital(Resource):
         }
 
         hospital = mongo_cli.db.hospitals.find_one(
-            {'_id': hospital_id, 'is_archived': {'$in': [False, None]}}, projection=projection)
+            {'_id': hospital_id, **archive.ACTIVE}, projection=projection)
         if hospital is None:
             return {}, 200
         else:
             return hospital, 200
 
     def put(self, hospital_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         args = {k: v for k, v in self._parser_put.parse_args().items() if v is not None}
         if 'address' in args:
@@ -1,18 +1,19 @@
-from flask_restful import Resource, reqparse, abort
-from pymongo import MongoClient
+from flask_restful import Resource, abort
 
-from app.common.env import *
+from app.common import archive
+from app.common import formulary
+from app.common import mongo
+from app.common import parser
 
 
 class Products(Resource):
-    def __init__(self):
-        self._parser_get = reqparse.RequestParser()
-        self._parser_get.add_argument('type')
-        self._parser_get.add_argument('category')
-        self._parser_get.add_argument('brand', action='append')
+    _parser_get = parser.Parser()
+    _parser_get.add_argument('type')
+    _parser_get.add_argument('category')
+    _parser_get.add_argument('brand', action='append')
 
     def get(self, hospital_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         projection = {
             "product_name": True,
@@ -26,68 +27,36 @@ class Products(Resource):
             "manufacturer_name": True
         }
 
-        results = []
-
-        try:
-            formulary = mongo_cli.db.hospitals.find_one(
-                {
-                    '_id': hospital_id,
-                    'is_archived': {'$in': [False, None]}
-                },
-                projection={'_id': False, 'formulary.product_id': True}
-            ).get('formulary')
-        except:
+        hospital = mongo_cli.db.hospitals.find_one({'_id': hospital_id, **archive.ACTIVE},
+                                                   projection=formulary.HOSPITAL_PROJECTION)
+        if hospital is None:
             abort(400)
 
         args = {k: v for k, v in self._parser_get.parse_args().items() if v is not None}
-        args['is_archived'] = {'$in': [False, None]}
+        args.update(archive.ACTIVE)
         if args.get('brand') is not None:
             args['manufacturer_name'] = {'$in': args.pop('brand')}
+        args['_id'] = {'$in': formulary.product_ids(mongo_cli.db, hospital)}
 
-        for p in formulary:
-            args['_id'] = p['product_id']
-            product = mongo_cli.db.products.find_one(args, projection=projection)
-            if product:
-                results.append(product)
+        results = list(mongo_cli.db.products.find(args, projection=projection, sort=[('product_name', 1)]))
 
         return {'products': results}, 200
 
 
 class Product(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_put = reqparse.RequestParser()
-        self._parser_put.add_argument('strength', required=True)
-        self._parser_put.add_argument('retail_price', required=True, dest='price')
+    _parser_put = parser.Parser()
+    _parser_put.add_argument('strength', required=True)
+    _parser_put.add_argument('retail_price', required=True, dest='price')
 
     def put(self, hospital_id, product_id):
         args = self._parser_put.parse_args()
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
-        hospital = mongo_cli.db.hospitals.find_one(
-            {'_id': hospital_id, 'is_archived': {'$in': [False, None]}})
-        if hospital:
-            try:
-                formulary = hospital['formulary']
-                for product in formulary:
-                    if product['product_id'] == product_id:
-                        for option in product['available_options']:
-                            if option['strength'] == args['strength']:
-                                option['price'] = args.pop('price')
-                                break
-                    if not args.get('price'):
-                        break
-            except TypeError:
-                abort(400, message='Bad request')
-            except KeyError:
-                abort(400, message='Bad request')
-        else:
+        mongo_cli = mongo.get_client()
+        hospital = mongo_cli.db.hospitals.find_one({'_id': hospital_id, **archive.ACTIVE},
+                                                   projection=formulary.HOSPITAL_PROJECTION)
+        if hospital is None:
             abort(400, message='Hospital not found')
 
-        result = mongo_cli.db.hospitals.update_one(
-            {'_id': hospital_id},
-            {'$set': {'formulary': formulary}}
-        )
+        updated = formulary.set_price(mongo_cli.db, hospital, product_id, args['strength'], args['price'])
 
-        return {'updated': bool(result.modified_count)}, 200
+        return {'updated': updated}, 200
@@ -1,14 +1,15 @@
 import datetime
 
-from flask_restful import Resource, reqparse
-from pymongo import MongoClient
+from flask_restful import Resource
 
-from app.common.env import *
+from app.common import archive
+from app.common import mongo
+from app.common import parser
 
 
 class Vets(Resource):
     def get(self, hospital_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         projection = {
             'first_name': True,
@@ -21,7 +22,7 @@ class Vets(Resource):
         vets = [v for v in mongo_cli.db.vets.find(
             {
                 'hospital_id': hospital_id,
-                'is_archived': {'$in': [False, None]}
+                **archive.ACTIVE
             },
             projection=projection)]
 
@@ -33,14 +34,11 @@ class Vets(Resource):
 
 
 class Vet(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_put = reqparse.RequestParser()
-        self._parser_put.add_argument('is_hospital_admin', type=bool, required=True)
+    _parser_put = parser.Parser()
+    _parser_put.add_argument('is_hospital_admin', type=bool, required=True)
 
     def put(self, hospital_id, vet_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         args = self._parser_put.parse_args()
         args['history.modified_on'] = datetime.datetime.utcnow()
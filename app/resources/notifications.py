@@ -1,24 +1,21 @@
-import requests
 from bson.objectid import ObjectId
-from flask_restful import Resource, abort, reqparse
-from pymongo import MongoClient
+from flask_restful import Resource, abort
 
-from app.common.env import *
+from app.common import mongo
+from app.common import parser
+from app.common import upstream
 
 
 class Registration(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser = reqparse.RequestParser()
-        self._parser.add_argument('type', required=True)
-        self._parser.add_argument('client_id')
+    _parser = parser.Parser()
+    _parser.add_argument('type', required=True)
+    _parser.add_argument('client_id')
 
     def post(self):
         args = self._parser.parse_args()
 
         if args['type'] == 'client':
-            mongo_cli = MongoClient(host=MONGO_HOST)
+            mongo_cli = mongo.get_client()
 
             client = mongo_cli.db.clients.find_one(
                 {'_id': ObjectId(args['client_id'])})
@@ -37,8 +34,7 @@ class Registration(Resource):
                 }
             }
 
-            email_endpoint = NOTIFICATION_HOST + '/api/v1/notifications/emails'
-            resp = requests.post(email_endpoint, json=body)
+            resp = upstream.notification.post('/api/v1/notifications/emails', json=body)
             email_sent = True if resp.status_code == 200 else False
 
             body = {
@@ -47,8 +43,7 @@ class Registration(Resource):
                 'message': 'Thanks for getting started with Zolutia!'
             }
 
-            sms_endpoint = NOTIFICATION_HOST + '/api/v1/notifications/sms'
-            resp = requests.post(sms_endpoint, data=body)
+            resp = upstream.notification.post('/api/v1/notifications/sms', data=body)
             sms_sent = True if resp.status_code == 200 else False
         else:
             email_sent = False
@@ -58,16 +53,13 @@ class Registration(Resource):
 
 
 class Orders(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser = reqparse.RequestParser()
-        self._parser.add_argument('order_id', required=True)
+    _parser = parser.Parser()
+    _parser.add_argument('order_id', required=True)
 
     def post(self):
         args = self._parser.parse_args()
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         order = mongo_cli.db.orders.find_one(
             {'_id': ObjectId(args['order_id'])})
@@ -89,8 +81,7 @@ class Orders(Resource):
             }
         }
 
-        email_endpoint = NOTIFICATION_HOST + '/api/v1/notifications/emails'
-        resp = requests.post(email_endpoint, json=body)
+        resp = upstream.notification.post('/api/v1/notifications/emails', json=body)
         email_sent = True if resp.status_code == 200 else False
 
         body = {
@@ -99,8 +90,7 @@ class Orders(Resource):
             'message': 'Thanks for ordering from Zolutia!'
         }
 
-        sms_endpoint = NOTIFICATION_HOST + '/api/v1/notifications/sms'
-        resp = requests.post(sms_endpoint, data=body)
+        resp = upstream.notification.post('/api/v1/notifications/sms', data=body)
         sms_sent = True if resp.status_code == 200 else False
 
         return {"email_sent": email_sent, "sms_sent": sms_sent}, 200
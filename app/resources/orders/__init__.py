@@ -1,9 +1,12 @@
 from flask import Blueprint
 from flask_restful import Api
 
+from app.common.json import output_json
 from app.resources.orders import orders
 
 orders_bp = Blueprint('orders', __name__, url_prefix='/api/v1')
 orders_api = Api(orders_bp, prefix='/orders')
+orders_api.representations['application/json'] = output_json
 
 orders_api.add_resource(orders.Orders, '')
+orders_api.add_resource(orders.Batch, '/batch')
@@ -1,104 +1,136 @@
 import datetime
 
 from bson.objectid import ObjectId
-from flask_restful import Resource, abort, reqparse
-from pymongo import MongoClient
-
+from flask_restful import Resource, abort
+from pymongo.errors import BulkWriteError
+from werkzeug.exceptions import HTTPException
+
+from app.common import archive
+from app.common import counters
+from app.common import counts
+from app.common import loader
+from app.common import mongo
 from app.common import notification
+from app.common import parser
+from app.common import pricing
+from app.common import product_types
+from app.common import sales
 from app.common.datetime import strptime
 from app.common.env import *
 from app.common.fake_request import FakeRequest
 
-mongo_cli = MongoClient(host=MONGO_HOST, connect=False)
+
+
+def _subscription(args, plan, now):
+    """The subscription a subscription order starts: its second box ships in 90 days, then the rest of
+    the plan every 90 days, repeating the last box once the plan runs out."""
+    subscription = {
+        'vet_id': args['vet_id'],
+        'client_id': args['client_id'],
+        'patient_id': args['patient_id'],
+        'hospital_id': args['hospital_id'],
+        'subscription_status': 'Active',
+        'is_archived': False,
+        'history': {'created_on': now},
+        'treatment_plan_id': args['treatment_plan_id'],
+        'boxes': plan['boxes'],
+        'upcoming_box_no': plan['boxes'][min(1, len(plan['boxes']) - 1)]['box_no'],
+        'upcoming_shipment_date': now + datetime.timedelta(days=90),
+    }
+
+    future_boxes = []
+    for box in plan['boxes'][2:]:
+        if len(future_boxes) == 3:
+            break
+        date = future_boxes[-1]['shipment_date'] \
+            if future_boxes else subscription['upcoming_shipment_date']
+        date += datetime.timedelta(days=90)
+        future_boxes.append(
+            {'box_no': box['box_no'], 'shipment_date': date})
+
+    last_box = plan['boxes'][-1]
+    while len(future_boxes) < 3:
+        date = future_boxes[-1]['shipment_date'] \
+            if future_boxes else subscription['upcoming_shipment_date']
+        date += datetime.timedelta(days=90)
+        future_boxes.append(
+            {'box_no': last_box['box_no'], 'shipment_date': date})
+
+    subscription['future_boxes'] = future_boxes
+
+    return subscription
+
+
+def _pending(args, order_number, now):
+    """Fill in the fields of a new order waiting for its pharmacy."""
+    args['history'] = {
+        'created_on': now,
+    }
+
+    args['order_number'] = order_number
+
+    args['order_status'] = 'pending'
+    args['shipping_date'] = now + datetime.timedelta(days=4)
+    args['delivery_date'] = None
+    args['tracking_number'] = None
+    args['tracking_status'] = None
+    args['box_no'] = '1'
+    args['is_archived'] = False
+    return args
 
 
 class Orders(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_post = reqparse.RequestParser()
-        self._parser_post.add_argument('vet_id', required=True, type=ObjectId)
-        self._parser_post.add_argument('client_id', required=True, type=ObjectId)
-        self._parser_post.add_argument('patient_id', required=True, type=ObjectId)
-        self._parser_post.add_argument('hospital_id', required=True, type=ObjectId)
-        self._parser_post.add_argument('treatment_plan_id', type=ObjectId)
-        self._parser_post.add_argument('order_contents', type=FakeRequest, action='append')
-        self._parser_post.add_argument('subtotal_price')
-        self._parser_post.add_argument('shipping_method', required=True)
-        self._parser_post.add_argument('shipping_amount', required=True)
-        self._parser_post.add_argument('shipping_address', required=True, type=FakeRequest)
-        self._parser_post.add_argument('tax', required=True)
-        self._parser_post.add_argument('total_price')
-        self._parser_post.add_argument(
-            'order_type', required=False, default='one_time',
-            choices=('one_time', 'subscription',), dest='type')
-
-        self._parser_content = reqparse.RequestParser()
-        self._parser_content.add_argument('product_id', required=True, type=ObjectId)
-        self._parser_content.add_argument('strength', required=True)
-        self._parser_content.add_argument('instructions')
-        self._parser_content.add_argument('quantity', required=True, type=int)
-        self._parser_content.add_argument('expires', required=True, type=strptime)
-        self._parser_content.add_argument('auto_refill', required=True, type=bool)
-        self._parser_content.add_argument('refills', required=True, type=int)
-
-        self._parser_address = reqparse.RequestParser()
-        self._parser_address.add_argument('street_1', required=True)
-        self._parser_address.add_argument('street_2')
-        self._parser_address.add_argument('city', required=True)
-        self._parser_address.add_argument('state', required=True)
-        self._parser_address.add_argument('zip', required=True)
-        self._parser_address.add_argument('zip4', required=True)
+    _parser_post = parser.Parser()
+    _parser_post.add_argument('vet_id', required=True, type=ObjectId)
+    _parser_post.add_argument('client_id', required=True, type=ObjectId)
+    _parser_post.add_argument('patient_id', required=True, type=ObjectId)
+    _parser_post.add_argument('hospital_id', required=True, type=ObjectId)
+    _parser_post.add_argument('treatment_plan_id', type=ObjectId)
+    _parser_post.add_argument('order_contents', type=FakeRequest, action='append')
+    _parser_post.add_argument('subtotal_price')
+    _parser_post.add_argument('shipping_method', required=True)
+    _parser_post.add_argument('shipping_amount', required=True)
+    _parser_post.add_argument('shipping_address', required=True, type=FakeRequest)
+    _parser_post.add_argument('tax', required=True)
+    _parser_post.add_argument('total_price')
+    _parser_post.add_argument(
+        'order_type', required=False, default='one_time',
+        choices=('one_time', 'subscription',), dest='type')
+
+    _parser_content = parser.Parser()
+    _parser_content.add_argument('product_id', required=True, type=ObjectId)
+    _parser_content.add_argument('strength', required=True)
+    _parser_content.add_argument('instructions')
+    _parser_content.add_argument('quantity', required=True, type=int)
+    _parser_content.add_argument('expires', required=True, type=strptime)
+    _parser_content.add_argument('auto_refill', required=True, type=bool)
+    _parser_content.add_argument('refills', required=True, type=int)
+
+    _parser_address = parser.Parser()
+    _parser_address.add_argument('street_1', required=True)
+    _parser_address.add_argument('street_2')
+    _parser_address.add_argument('city', required=True)
+    _parser_address.add_argument('state', required=True)
+    _parser_address.add_argument('zip', required=True)
+    _parser_address.add_argument('zip4', required=True)
 
     def post(self):
+        db = mongo.get_db()
         args = self._parser_post.parse_args()
 
         if args['type'] == 'subscription':
             if 'treatment_plan_id' not in args:
                 abort(400, message='Missing treatment_plan_id for subscription order')
 
-            plan = mongo_cli.db.treatment_plans.find_one(
-                {'_id': args['treatment_plan_id'], 'is_archived': {'$in': [None, False]}})
+            plan = db.treatment_plans.find_one(
+                {'_id': args['treatment_plan_id'], **archive.ACTIVE})
             if not plan:
                 abort(400, message='Treatment plan not found')
 
             first_box = plan['boxes'][0]
 
-            subscription = {
-                'vet_id': args['vet_id'],
-                'client_id': args['client_id'],
-                'patient_id': args['patient_id'],
-                'hospital_id': args['hospital_id'],
-                'subscription_status': 'Active',
-                'is_archived': False,
-                'history': {'created_on': datetime.datetime.utcnow()},
-                'treatment_plan_id': args['treatment_plan_id'],
-                'boxes': plan['boxes'],
-                'upcoming_box_no': plan['boxes'][min(1, len(plan['boxes']) - 1)]['box_no'],
-                'upcoming_shipment_date': datetime.datetime.utcnow() + datetime.timedelta(days=90),
-            }
-
-            future_boxes = []
-            for box in plan['boxes'][2:]:
-                if len(future_boxes) == 3:
-                    break
-                date = future_boxes[-1]['shipment_date'] \
-                    if future_boxes else subscription['upcoming_shipment_date']
-                date += datetime.timedelta(days=90)
-                future_boxes.append(
-                    {'box_no': box['box_no'], 'shipment_date': date})
-
-            last_box = plan['boxes'][-1]
-            while len(future_boxes) < 3:
-                date = future_boxes[-1]['shipment_date'] \
-                    if future_boxes else subscription['upcoming_shipment_date']
-                date += datetime.timedelta(days=90)
-                future_boxes.append(
-                    {'box_no': last_box['box_no'], 'shipment_date': date})
-
-            subscription['future_boxes'] = future_boxes
-
-            sub_id = mongo_cli.db.subscriptions.insert_one(subscription).inserted_id
+            subscription = _subscription(args, plan, datetime.datetime.utcnow())
+            sub_id = db.subscriptions.insert_one(subscription).inserted_id
             args['subscription_id'] = sub_id
             args['order_contents'] = first_box['items']
         elif args.get('order_contents'):
@@ -109,69 +141,21 @@ class Orders(Resource):
         else:
             abort(400, message='Missing order_contents for one time order')
 
-        subtotal = 0.0
-        for p in args['order_contents']:
-            pipeline = [  # wtf i've done
-                {'$match': {'_id': args['hospital_id']}},
-                {'$unwind': '$formulary'},
-                {'$match': {'formulary.product_id': p['product_id']}},
-                {'$unwind': '$formulary.available_options'},
-                {'$match': {'formulary.available_options.strength': p.get('strength', p.get('size'))}}
-            ]
-
-            try:
-                product = list(mongo_cli.db.hospitals.aggregate(pipeline))[0]
-            except BaseException:
-                abort(400, message='Bad request')
-            p['product_price'] = product['formulary']['available_options']['price']
-            subtotal += float(p['product_price']) * int(p['quantity'])
-            total = subtotal + float(args['tax']) + float(args['shipping_amount'])
-
-            args['subtotal_price'] = str(round(subtotal, 2))
-            args['total_price'] = str(round(total, 2))
-
-        product_types = set()
-        for p in args['order_contents']:
-            product = mongo_cli.db.products.find_one({'_id': p['product_id']})
-            product_types.add(product['type'].lower())
-
-        if {'otc'} == product_types:
-            args['pharmacy_type'] = 'OTC'
-        elif '502b' in product_types:
-            args['pharmacy_type'] = '502b'
-        elif 'compounded' in product_types:
-            args['pharmacy_type'] = 'Compounded'
-        else:
-            args['pharmacy_type'] = 'Retail'
-
-        hospital = mongo_cli.db.hospitals.find_one(
-            {'_id': args['hospital_id']}, projection={'pharmacies': True})
-
-        if args['pharmacy_type'] != 'OTC':
-            args['pharmacy_id'] = hospital['pharmacies'][args['pharmacy_type']]
-        else:
-            args['pharmacy_id'] = None
+        try:
+            engine = pricing.PricingEngine.load(
+                db, args['hospital_id'], [p['product_id'] for p in args['order_contents']])
+            args.update(engine.quote(args['order_contents'], args['tax'], args['shipping_amount']))
+        except pricing.PricingError:
+            abort(400, message='Bad request')
 
         args['shipping_address'] = self._parser_address.parse_args(req=args['shipping_address'])
 
-        args['history'] = {
-            'created_on': datetime.datetime.utcnow(),
-        }
-
-        args['order_number'] = 100001
-
-        last_order = mongo_cli.db.orders.find_one({}, sort=[('order_number', -1)])
-        if last_order:
-            args['order_number'] = last_order['order_number'] + 1
+        _pending(args, counters.order_numbers.next(db), datetime.datetime.utcnow())
+        product_types.annotate(db, [args])
 
-        args['order_status'] = 'pending'
-        args['shipping_date'] = datetime.datetime.utcnow() + datetime.timedelta(days=4)
-        args['delivery_date'] = None
-        args['tracking_number'] = None
-        args['tracking_status'] = None
-        args['box_no'] = '1'
-
-        order_id = mongo_cli.db.orders.insert_one(args).inserted_id
+        order_id = db.orders.insert_one(args).inserted_id
+        counts.invalidate(db, 'orders')
+        sales.add(db, [args])
 
         if args['pharmacy_id']:
             confirmation = notification.notify_pharmacy_order(
@@ -188,12 +172,127 @@ class Orders(Resource):
             'confirmation': confirmation
         }
 
-        client = mongo_cli.db.clients.find_one({'_id': args['client_id']})
+        client = db.clients.find_one({'_id': args['client_id']})
         order['client_name'] = '{} {}'.format(client['first_name'], client['last_name'])
-        patient = mongo_cli.db.patients.find_one({'_id': args['patient_id']})
+        patient = db.patients.find_one({'_id': args['patient_id']})
         order['patient_name'] = patient['name']
 
         if args['type'] == 'subscription':
             notification.notify_client_subscription(args['client_id'], order['shipping_date'])
 
         return order, 200
+
+
+class Batch(Resource):
+    """Create up to ORDERS_BATCH_MAX orders in one request.
+
+    Orders are validated one by one, but treatment plans, formularies and products are loaded once
+    for the whole batch, order numbers are reserved with one counter update and the orders go in
+    with one insert. An invalid order does not stop the others: the response lists, by position in
+    the request, either the created order or why it was refused.
+    """
+    _parser_post = parser.Parser()
+    _parser_post.add_argument('orders', type=FakeRequest, action='append', required=True)
+
+    @staticmethod
+    def _parse(item):
+        args = Orders._parser_post.parse_args(req=item)
+
+        if args['type'] == 'subscription':
+            if args['treatment_plan_id'] is None:
+                abort(400, message='Missing treatment_plan_id for subscription order')
+        elif args.get('order_contents'):
+            args['order_contents'] = [Orders._parser_content.parse_args(req=c)
+                                      for c in args['order_contents']]
+        else:
+            abort(400, message='Missing order_contents for one time order')
+
+        args['shipping_address'] = Orders._parser_address.parse_args(req=args['shipping_address'])
+        return args
+
+    def post(self):
+        db = mongo.get_db()
+        items = self._parser_post.parse_args()['orders']
+        if len(items) > ORDERS_BATCH_MAX:
+            abort(400, message=f'At most {ORDERS_BATCH_MAX} orders per batch')
+
+        now = datetime.datetime.utcnow()
+        orders, failures = {}, {}
+        for i, item in enumerate(items):
+            try:
+                orders[i] = self._parse(item)
+            except HTTPException as e:
+                failures[i] = parser.error_message(e)
+
+        plans = loader.load_by_ids(db, 'treatment_plans', [args['treatment_plan_id'] for args in orders.values()
+                                                           if args['type'] == 'subscription'])
+        for i, args in list(orders.items()):
+            if args['type'] != 'subscription':
+                continue
+            plan = plans.get(args['treatment_plan_id'])
+            if not plan or plan.get('is_archived'):
+                failures[i] = 'Treatment plan not found'
+                del orders[i]
+                continue
+            args['order_contents'] = [dict(item) for item in plan['boxes'][0]['items']]
+
+        products = {}
+        for args in orders.values():
+            products.setdefault(args['hospital_id'], set()).update(p['product_id'] for p in args['order_contents'])
+        engines = {}
+        for hospital_id, product_ids in products.items():
+            try:
+                engines[hospital_id] = pricing.PricingEngine.load(db, hospital_id, list(product_ids))
+            except pricing.PricingError as e:
+                engines[hospital_id] = e
+
+        for i, args in list(orders.items()):
+            try:
+                engine = engines[args['hospital_id']]
+                if isinstance(engine, pricing.PricingError):
+                    raise engine
+                args.update(engine.quote(args['order_contents'], args['tax'], args['shipping_amount']))
+            except pricing.PricingError as e:
+                failures[i] = str(e)
+                del orders[i]
+
+        numbers = counters.order_numbers.allocate(db, len(orders)) if orders else []
+        for args, number in zip(orders.values(), numbers):
+            _pending(args, number, now)
+        product_types.annotate(db, orders.values())
+
+        subscriptions = {i: _subscription(args, plans[args['treatment_plan_id']], now)
+                         for i, args in orders.items() if args['type'] == 'subscription'}
+        if subscriptions:
+            ids = db.subscriptions.insert_many(list(subscriptions.values())).inserted_ids
+            for i, sub_id in zip(subscriptions, ids):
+                orders[i]['subscription_id'] = sub_id
+
+        if orders:
+            positions = list(orders)
+            try:
+                db.orders.insert_many(list(orders.values()), ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get('writeErrors', []):
+                    failures[positions[error['index']]] = error['errmsg']
+                orphans = [orders.pop(i).get('subscription_id') for i in positions if i in failures]
+                db.subscriptions.delete_many({'_id': {'$in': [_ for _ in orphans if _ is not None]}})
+            counts.invalidate(db, 'orders')
+            sales.add(db, orders.values())
+
+        notification.notify_orders(list(orders.values()), subscriptions_started=True)
+
+        results = []
+        for i in range(len(items)):
+            if i in failures:
+                results.append({'index': i, 'message': failures[i]})
+                continue
+            results.append({
+                'index': i,
+                'order_id': orders[i]['_id'],
+                'order_number': orders[i]['order_number'],
+                'shipping_date': orders[i]['shipping_date'],
+                'subscription_id': orders[i].get('subscription_id'),
+            })
+
+        return {'orders': results, 'created': len(orders), 'failed': len(failures)}, 200
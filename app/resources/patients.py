@@ -1,53 +1,128 @@
 import datetime
+import json
 
 from bson.objectid import ObjectId
-from flask_restful import Resource, reqparse
-from pymongo import MongoClient
+from flask import request
+from flask_restful import Resource
+from pymongo.errors import BulkWriteError
+from werkzeug.exceptions import HTTPException
 
+from app.common import counts
+from app.common import mongo
+from app.common import parser
+from app.common import search
 from app.common.datetime import strptime
 from app.common.env import *
-from app.common.fake_request import FakeRequest
 
 
 class Patients(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_root = reqparse.RequestParser()
-        self._parser_root.add_argument(
-            'patients', required=True, type=dict, action='append')
-
-        self._parser_patients = reqparse.RequestParser()
-        self._parser_patients.add_argument('name', required=True)
-        self._parser_patients.add_argument(
-            'client_id', required=True, type=ObjectId)
-        self._parser_patients.add_argument(
-            'vet_id', required=True, type=ObjectId)
-        self._parser_patients.add_argument(
-            'hospital_id', required=True, type=ObjectId)
-        self._parser_patients.add_argument('species', required=True)
-        self._parser_patients.add_argument('breed', required=True)
-        self._parser_patients.add_argument('age', required=True)
-        self._parser_patients.add_argument(
-            'birthday', required=True, type=strptime)
-        self._parser_patients.add_argument('weight', required=True)
-        self._parser_patients.add_argument('gender', required=True)
+    _parser_root = parser.Parser()
+    _parser_root.add_argument(
+        'patients', required=True, type=dict, action='append')
+
+    _parser_patients = parser.Parser()
+    _parser_patients.add_argument('name', required=True)
+    _parser_patients.add_argument(
+        'client_id', required=True, type=ObjectId)
+    _parser_patients.add_argument(
+        'vet_id', required=True, type=ObjectId)
+    _parser_patients.add_argument(
+        'hospital_id', required=True, type=ObjectId)
+    _parser_patients.add_argument('species', required=True)
+    _parser_patients.add_argument('breed', required=True)
+    _parser_patients.add_argument('age', required=True)
+    _parser_patients.add_argument(
+        'birthday', required=True, type=strptime)
+    _parser_patients.add_argument('weight', required=True)
+    _parser_patients.add_argument('gender', required=True)
+    _parser_root.nest('patients', _parser_patients)
 
     def post(self):
-        db = MongoClient(host=MONGO_HOST).db
+        db = mongo.get_db()
         root_args = self._parser_root.parse_args()
         args = []
 
-        for arg in root_args['patients']:
-            patient = self._parser_patients.parse_args(req=FakeRequest(arg))
+        for patient in root_args['patients']:
             patient['history'] = {
                 'created_on': datetime.datetime.now(),
                 'modified_on': datetime.datetime.now()
             }
             patient['is_archived'] = False
+            patient['name_normalized'] = search.normalize(patient['name'])
 
             args.append(patient)
 
         resp = db.patients.insert_many(args)
+        counts.invalidate(db, 'patients')
+        search.add_client_vets(db, [(p['client_id'], p['vet_id']) for p in args])
 
         return {'inserted': True if len(resp.inserted_ids) > 0 else False}, 200
+
+
+def _fail(report, line_no, message):
+    report['failed'] += 1
+    if len(report['errors']) < PATIENTS_IMPORT_MAX_ERRORS:
+        report['errors'].append({'line': line_no, 'message': message})
+
+
+def _insert(db, chunk, report):
+    """Insert a chunk of (line number, patient) pairs unordered, so a rejected patient only loses its own line."""
+    if not chunk:
+        return
+    patients = [patient for _, patient in chunk]
+    rejected = set()
+    try:
+        db.patients.insert_many(patients, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get('writeErrors', []):
+            rejected.add(error['index'])
+            _fail(report, chunk[error['index']][0], error['errmsg'])
+
+    inserted = [patient for i, patient in enumerate(patients) if i not in rejected]
+    report['inserted'] += len(inserted)
+    search.add_client_vets(db, [(p['client_id'], p['vet_id']) for p in inserted])
+
+
+class Import(Resource):
+    """Import patients from an NDJSON body, one patient object per line.
+
+    The body is read line by line and inserted PATIENTS_IMPORT_CHUNK patients at a time, so uploads
+    of any size are held one chunk at a time and a bad line does not stop the lines after it. Refused
+    lines are reported by line number, the first PATIENTS_IMPORT_MAX_ERRORS of them with the reason.
+    """
+
+    def post(self):
+        db = mongo.get_db()
+        report = {'inserted': 0, 'failed': 0, 'errors': []}
+        chunk = []
+
+        for line_no, line in enumerate(request.stream, 1):
+            if not line.strip():
+                continue
+            try:
+                patient = json.loads(line)
+                if not isinstance(patient, dict):
+                    raise ValueError('expected an object')
+                patient = Patients._parser_patients.parse_args(req=patient)
+            except ValueError as e:
+                _fail(report, line_no, f'Invalid JSON: {e}')
+                continue
+            except HTTPException as e:
+                _fail(report, line_no, parser.error_message(e))
+                continue
+
+            now = datetime.datetime.now()
+            patient['history'] = {'created_on': now, 'modified_on': now}
+            patient['is_archived'] = False
+            patient['name_normalized'] = search.normalize(patient['name'])
+            chunk.append((line_no, patient))
+
+            if len(chunk) == PATIENTS_IMPORT_CHUNK:
+                _insert(db, chunk, report)
+                chunk = []
+
+        _insert(db, chunk, report)
+        if report['inserted']:
+            counts.invalidate(db, 'patients')
+
+        return report, 200
@@ -1,45 +1,47 @@
 import datetime
 
-import requests
 from bson.objectid import ObjectId
-from flask_restful import Resource, reqparse
-from pymongo import MongoClient
+from flask_restful import Resource
+from pymongo import ReturnDocument
 
+from app.common import counts
+from app.common import mongo
 from app.common import notification
-from app.common.env import *
+from app.common import parser
+from app.common import sales
+from app.common import upstream
 
 class Payments(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser = reqparse.RequestParser()
-        self._parser.add_argument('order_id', required='True', type=ObjectId)
-        self._parser.add_argument('credit_card_name', required='True')
-        self._parser.add_argument('credit_card_number', required='True')
-        self._parser.add_argument('credit_card_expiry_month', required='True')
-        self._parser.add_argument('credit_card_expiry_year', required='True')
-        self._parser.add_argument('credit_card_cvv', required='True')
+    _parser = parser.Parser()
+    _parser.add_argument('order_id', required='True', type=ObjectId)
+    _parser.add_argument('credit_card_name', required='True')
+    _parser.add_argument('credit_card_number', required='True')
+    _parser.add_argument('credit_card_expiry_month', required='True')
+    _parser.add_argument('credit_card_expiry_year', required='True')
+    _parser.add_argument('credit_card_cvv', required='True')
 
     def post(self):
-        db = MongoClient(host=MONGO_HOST).db
+        db = mongo.get_db()
         args = self._parser.parse_args()
 
         order = db.orders.find_one({'_id': args['order_id']})
         client = db.clients.find_one({'_id': order['client_id']})
 
-        payment_endpoint = f"{PAYMENT_HOST}/api/v2/transactions"
-        payload = args
+        payload = dict(args)
         payload['order_id'] = str(payload['order_id'])
-        resp = requests.post(payment_endpoint, json=payload)
+        resp = upstream.payment.post('/api/v2/transactions', json=payload)
         result = resp.json()
         status = {'result': result['message']}
         if resp.status_code :
-            db.orders.update_one({'_id': args['order_id']}, {'$set': {
+            before = db.orders.find_one_and_update({'_id': args['order_id']}, {'$set': {
                 'card_last4': args['credit_card_number'][-4:],
                 'card_expiry': f"{args['credit_card_expiry_month']}/{args['credit_card_expiry_year']}",
                 'order_status': 'processing',
                 'cardholder_name': args['credit_card_name'],
-                'reference_number': result['reference_number']}})
+                'reference_number': result['reference_number']}},
+                projection=sales.FIELDS, return_document=ReturnDocument.BEFORE)
+            counts.invalidate(db, 'orders')
+            sales.change(db, before, {'order_status': 'processing'})
 
             if order['type'] == 'subscription':
                 address = order['billing_address'] if 'billing_address' in order else order['shipping_address']
@@ -74,8 +76,8 @@ class Payments(Resource):
                     'next': str(datetime.datetime.utcnow() + datetime.timedelta(days=90)),
                     'description': f"{client['first_name']} {client['last_name']} Order number {order['order_number']}"
                 }
-                r = requests.post(f"{PAYMENT_HOST}/api/v2/customers", json=payload,
-                                  headers={'Content-Type': 'application/json'})
+                r = upstream.payment.post('/api/v2/customers', json=payload,
+                                          headers={'Content-Type': 'application/json'})
                 if r.status_code == 200:
                     db.orders.update_one(
                         {'_id': order['_id']}, {'$set': {'customer_number': r.json().get('customer_code')}})
@@ -1,11 +1,14 @@
 from flask import Blueprint
 from flask_restful import Api
 
+from app.common.json import output_json
 from app.resources.pharmacies import orders
 from app.resources.pharmacies import pharmacies
+from app.resources.pharmacies import sales
 
 pharmacies_bp = Blueprint('pharmacies', __name__, url_prefix='/api/v1')
 pharmacies_api = Api(pharmacies_bp, prefix='/pharmacies')
+pharmacies_api.representations['application/json'] = output_json
 
 pharmacies_api.add_resource(
     pharmacies.Pharmacy, '/<oid:pharmacy_id>')
@@ -14,3 +17,8 @@ pharmacies_api.add_resource(
     orders.Order, '/<oid:pharmacy_id>/orders/<oid:order_id>')
 pharmacies_api.add_resource(
     orders.Orders, '/<oid:pharmacy_id>/orders')
+pharmacies_api.add_resource(
+    orders.Export, '/<oid:pharmacy_id>/orders/export')
+
+pharmacies_api.add_resource(
+    sales.Sales, '/<oid:pharmacy_id>/sales')
@@ -1,22 +1,27 @@
 import datetime
 
-from flask_restful import Resource, abort, reqparse
-from pymongo import MongoClient
-
+from bson.objectid import ObjectId
+from flask_restful import Resource, abort
+from pymongo import ReturnDocument
+
+from app.common import archive
+from app.common import counts
+from app.common import export
+from app.common import loader
+from app.common import mongo
 from app.common import notification
-from app.common.env import *
+from app.common import parser
+from app.common import sales
+from app.common.datetime import strptime
 
 
 class Order(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_put = reqparse.RequestParser()
-        self._parser_put.add_argument('status', dest='order_status')
-        self._parser_put.add_argument('tracking_number')
+    _parser_put = parser.Parser()
+    _parser_put.add_argument('status', dest='order_status')
+    _parser_put.add_argument('tracking_number')
 
     def get(self, pharmacy_id, order_id):
-        args = {'pharmacy_id': pharmacy_id, '_id': order_id, 'is_archived': {'$in': [False, None]}}
+        args = {'pharmacy_id': pharmacy_id, '_id': order_id, **archive.ACTIVE}
 
         projection = {
             'is_archived': False,
@@ -25,7 +30,7 @@ class Order(Resource):
             '_id': False
         }
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
         order = mongo_cli.db.orders.find_one(args, projection=projection)
 
         if not order:
@@ -45,8 +50,11 @@ class Order(Resource):
         hospital = mongo_cli.db.hospitals.find_one({'_id': order['hospital_id']})
         order['hospital_name'] = hospital['name']
 
+        products = loader.load_by_ids(mongo_cli.db, 'products',
+                                      [_['product_id'] for _ in order['order_contents']],
+                                      projection={'product_name': True, 'image_url': True, 'type': True})
         for product in order['order_contents']:
-            p = mongo_cli.db.products.find_one({'_id': product['product_id']})
+            p = products[product['product_id']]
             product['product_name'] = p['product_name']
             product['image_url'] = p['image_url']
             product['type'] = p['type']
@@ -61,9 +69,12 @@ class Order(Resource):
         args['history.modified_on'] = datetime.datetime.utcnow()
         args['order_status'] = args['order_status'].lower()
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
-        result = mongo_cli.db.orders.update_one(
-            {'_id': order_id, 'pharmacy_id': pharmacy_id}, {'$set': args})
+        mongo_cli = mongo.get_client()
+        before = mongo_cli.db.orders.find_one_and_update(
+            {'_id': order_id, 'pharmacy_id': pharmacy_id}, {'$set': args},
+            projection=sales.FIELDS, return_document=ReturnDocument.BEFORE)
+        counts.invalidate(mongo_cli.db, 'orders')
+        sales.change(mongo_cli.db, before, args)
 
         order = mongo_cli.db.orders.find_one({'_id': order_id},
                                              {'order_number': 1, 'client_id': 1, 'tracking_number': 1})
@@ -73,12 +84,12 @@ class Order(Resource):
         if client_id and order_no and tracking_number:
             notification.notify_client_shipping(client_id, order_no, tracking_number)
 
-        return {'updated': bool(result.modified_count)}, 200
+        return {'updated': before is not None}, 200
 
 
 class Orders(Resource):
     def get(self, pharmacy_id):
-        args = {'pharmacy_id': pharmacy_id, 'is_archived': {'$in': [False, None]}}
+        args = {'pharmacy_id': pharmacy_id, **archive.ACTIVE}
 
         projection = {
             'ordered_date': True,
@@ -90,27 +101,48 @@ class Orders(Resource):
             'order_number': True
         }
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
         orders = list(mongo_cli.db.orders.find(args, projection=projection))
 
+        refs = loader.load_refs(mongo_cli.db, orders, {
+            'client_id': ('clients', {'first_name': True, 'last_name': True, 'email_address': True}),
+            'patient_id': ('patients', {'name': True}),
+            'vet_id': ('vets', {'first_name': True, 'last_name': True}),
+            'hospital_id': ('hospitals', {'name': True}),
+        })
+
         for order in orders:
             order['order_id'] = order.pop('_id')
 
-            client = mongo_cli.db.clients.find_one({'_id': order['client_id']})
+            client = refs['client_id'].get(order['client_id'])
             order['client_name'] = '{} {}'.format(client['first_name'], client['last_name'])
             order['client_email'] = client['email_address'] if client else ""
             order.pop('client_id')
 
-            patient = mongo_cli.db.patients.find_one({'_id': order['patient_id']})
+            patient = refs['patient_id'].get(order['patient_id'])
             order['patient_name'] = patient['name'] if patient else ""
             order.pop('patient_id')
 
-            vet = mongo_cli.db.vets.find_one({'_id': order['vet_id']})
+            vet = refs['vet_id'].get(order['vet_id'])
             order['vet_name'] = '{} {}'.format(vet['first_name'], vet['last_name']) if vet else ""
             order.pop('vet_id')
 
-            hospital = mongo_cli.db.hospitals.find_one({'_id': order['hospital_id']})
+            hospital = refs['hospital_id'].get(order['hospital_id'])
             order['hospital_name'] = hospital['name'] if hospital else ""
             order.pop('hospital_id')
 
         return {'orders': orders}, 200
+
+
+class Export(Resource):
+    _parser_get = parser.Parser()
+    _parser_get.add_argument('format', choices=export.FORMATS, default=export.CSV)
+    _parser_get.add_argument('from', type=strptime, dest='created_from')
+    _parser_get.add_argument('to', type=strptime, dest='created_to')
+    _parser_get.add_argument('hospital_id', type=ObjectId)
+
+    def get(self, pharmacy_id):
+        args = self._parser_get.parse_args()
+        fmt = args.pop('format')
+
+        return export.response(mongo.get_db(), export.query(pharmacy_id=pharmacy_id, **args), fmt, 'orders')
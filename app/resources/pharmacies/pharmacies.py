@@ -1,29 +1,26 @@
 import datetime
 
-from flask_restful import Resource, abort, reqparse
-from pymongo import MongoClient
+from flask_restful import Resource, abort
 
+from app.common import archive
+from app.common import mongo
 from app.common import parser
-from app.common.env import *
 from app.common.fake_request import FakeRequest
 from app.common.types import strphone
 
 
 class Pharmacy(Resource):
-    def __init__(self):
-        super().__init__()
+    _parser_put = parser.Parser()
+    _parser_put.add_argument('name')
+    _parser_put.add_argument('phone', type=strphone)
+    _parser_put.add_argument('fax')
+    _parser_put.add_argument('image_url')
+    _parser_put.add_argument('address', type=FakeRequest)
 
-        self._parser_put = reqparse.RequestParser()
-        self._parser_put.add_argument('name')
-        self._parser_put.add_argument('phone', type=strphone)
-        self._parser_put.add_argument('fax')
-        self._parser_put.add_argument('image_url')
-        self._parser_put.add_argument('address', type=FakeRequest)
-
-        self._parser_address = parser.address.copy()
+    _parser_address = parser.address.copy()
 
     def get(self, pharmacy_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         projection = {
             'is_archived': False,
@@ -31,7 +28,7 @@ class Pharmacy(Resource):
             '_id': False
         }
 
-        pharmacy = mongo_cli.db.pharmacies.find_one({'_id': pharmacy_id, 'is_archived': {'$in': [None, False]}},
+        pharmacy = mongo_cli.db.pharmacies.find_one({'_id': pharmacy_id, **archive.ACTIVE},
                                                     projection=projection)
 
         if not pharmacy:
@@ -50,7 +47,7 @@ class Pharmacy(Resource):
 
         args['history.modified_on'] = datetime.datetime.utcnow()
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
         result = mongo_cli.db.pharmacies.update_one({'_id': pharmacy_id}, {'$set': args})
 
         return {'updated': bool(result.modified_count)}, 200
@@ -1,6 +1,7 @@
 from flask import Blueprint
 from flask_restful import Api
 
+from app.common.json import output_json
 from app.resources.vets import clients
 from app.resources.vets import orders
 from app.resources.vets import patients
@@ -11,6 +12,7 @@ from app.resources.vets import vets
 
 vets_bp = Blueprint('vets', __name__, url_prefix='/api/v1')
 vets_api = Api(vets_bp, prefix='/vets')
+vets_api.representations['application/json'] = output_json
 
 vets_api.add_resource(clients.Clients, '/<oid:vet_id>/clients/<oid:client_id>')
 
@@ -18,6 +20,7 @@ vets_api.add_resource(orders.Orders, '/<oid:vet_id>/orders')
 vets_api.add_resource(orders.Order, '/<oid:vet_id>/orders/<oid:order_id>')
 vets_api.add_resource(orders.Feedbacks, '/<oid:vet_id>/feedbacks')
 vets_api.add_resource(orders.Feedback, '/<oid:vet_id>/feedbacks/<oid:order_id>')
+vets_api.add_resource(orders.Summary, '/<oid:vet_id>/summary')
 
 vets_api.add_resource(
     patients.Patients, '/<oid:vet_id>/patients')
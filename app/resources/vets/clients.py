@@ -1,12 +1,12 @@
 from flask_restful import Resource
-from pymongo import MongoClient
 
-from app.common.env import *
+from app.common import archive
+from app.common import mongo
 
 
 class Clients(Resource):
     def get(self, vet_id, client_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         if mongo_cli.db.patients.count({'vet_id': vet_id, 'client_id': client_id}) == 0:
             return {}, 200
@@ -25,11 +25,11 @@ class Clients(Resource):
         }
 
         client = mongo_cli.db.clients.find_one(
-            {'_id': client_id, 'is_archived': {'$in': [False, None]}},
+            {'_id': client_id, **archive.ACTIVE},
             projection=projection)
 
         patients = mongo_cli.db.patients.find(
-            {'client_id': client_id, 'is_archived': {'$in': [False, None]}},
+            {'client_id': client_id, **archive.ACTIVE},
             projection=patient_projection)
 
         client['patients'] = []
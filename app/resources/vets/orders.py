@@ -1,104 +1,96 @@
 import datetime
 
-from flask_restful import Resource, reqparse
-from pymongo import MongoClient
-
+from flask_restful import Resource
+from pymongo import ReturnDocument
+
+from app.common import archive
+from app.common import counts
+from app.common import loader
+from app.common import mongo
+from app.common import paging
 from app.common import parser
+from app.common import product_types
+from app.common import sales
 from app.common.env import *
 from app.common.fake_request import FakeRequest
 
+OPEN_STATUSES = ['pending', 'processing']
+CLOSED_STATUSES = ['shipped', 'delivered', 'fulfilled']
 
-class Orders(Resource):
-    def __init__(self):
-        super().__init__()
 
-        self._parser_get = reqparse.RequestParser()
-        self._parser_get.add_argument('type', choices=('rx', 'otc',))
-        self._parser_get.add_argument(
-            'status', dest='order_status', choices=('open', 'closed',))
-        self._parser_get.add_argument('offset', type=int, default=0)
-        self._parser_get.add_argument('limit', type=int, default=20)
+class Orders(Resource):
+    _parser_get = parser.Parser()
+    _parser_get.add_argument('type', choices=('rx', 'otc',))
+    _parser_get.add_argument(
+        'status', dest='order_status', choices=('open', 'closed',))
+    _parser_get.add_argument('offset', type=int, default=0)
+    _parser_get.add_argument('limit', type=int, default=20)
+    _parser_get.add_argument('cursor')
+    _parser_get.add_argument('count', choices=counts.MODES, default=counts.EXACT)
 
     def get(self, vet_id):
         args = {k: v for k, v in self._parser_get.parse_args().items() if v is not None}
         args['vet_id'] = vet_id
-        args['is_archived'] = {'$in': [False, None]}
+        args.update(archive.ACTIVE)
 
         skip = args.pop('offset')
         limit = args.pop('limit')
+        cursor = args.pop('cursor', None)
+        count = args.pop('count')
 
-        order_type = None
-        if args.get('type'):
-            order_type = args.pop('type')
+        if 'type' in args:
+            args['has_rx'] = args.pop('type') == 'rx'
 
         if 'order_status' in args:
             if args['order_status'] == 'open':
-                args['order_status'] = {'$in': ['pending', 'processing']}
+                args['order_status'] = {'$in': OPEN_STATUSES}
             elif args['order_status'] == 'closed':
-                args['order_status'] = {'$in': ['shipped', 'delivered', 'fulfilled']}
-
-        mongo_cli = MongoClient(host=MONGO_HOST)
-        orders = list(mongo_cli.db.orders.find(args, limit=limit, skip=skip))
-        orders_count = mongo_cli.db.orders.count({'vet_id': vet_id, 'is_archived': {'$in': [False, None]}})
-
-        if order_type:
-            for order in orders[:]:
-                rx_flag = False
-                for product_ref in order['order_contents']:
-                    product = mongo_cli.db.products.find_one(
-                        {'_id': product_ref['product_id'], 'is_archived': {'$in': [False, None]}})
-                    if product and product['type'].lower() == 'rx':
-                        rx_flag = True
-                        if order_type.lower() == 'rx':
-                            break
-                if rx_flag and order_type.lower() != 'rx':
-                    orders.remove(order)
-                elif not rx_flag and order_type.lower() == 'rx':
-                    orders.remove(order)
+                args['order_status'] = {'$in': CLOSED_STATUSES}
+
+        mongo_cli = mongo.get_client()
+        orders, cursor = paging.page(mongo_cli.db.orders, args, [('_id', 1)], limit, cursor=cursor, offset=skip)
+        orders_count = counts.count(mongo_cli.db, 'orders', args, count)
+
+        refs = loader.load_refs(mongo_cli.db, orders, {
+            'client_id': ('clients', {'first_name': True, 'last_name': True, 'is_archived': True}),
+            'patient_id': ('patients', {'name': True, 'is_archived': True}),
+            'order_contents.product_id': ('products', {'image_url': True, 'type': True, 'product_name': True,
+                                                       'is_archived': True}),
+        })
+        products = refs['order_contents.product_id']
 
         for order in orders:
             order['order_id'] = order.pop('_id')
 
-            client = mongo_cli.db.clients.find_one(
-                {
-                    '_id': order['client_id'],
-                    'is_archived': {'$in': [None, False]}
-                },
-                projection={'first_name': True, 'last_name': True}) or {}
+            client = refs['client_id'].get(order['client_id']) or {}
+            if client.get('is_archived'):
+                client = {}
             order['client_name'] = '{} {}'.format(client.get('first_name'), client.get('last_name'))
 
-            patient = mongo_cli.db.patients.find_one(
-                {
-                    '_id': order['patient_id'],
-                    'is_archived': {'$in': [None, False]}
-                },
-                projection={'name': True}) or {}
+            patient = refs['patient_id'].get(order['patient_id']) or {}
+            if patient.get('is_archived'):
+                patient = {}
             order['patient_name'] = patient.get('name')
 
             for product in order['order_contents']:
-                _ = mongo_cli.db.products.find_one(
-                    {'_id': product['product_id']})
+                _ = products.get(product['product_id'])
                 product['image_url'] = _['image_url'] if _ else None
                 product['type'] = _['type'] if _ else None
                 product['product_name'] = _['product_name'] if _ else None
 
-        return {'orders': orders, 'count': orders_count}, 200
+        return {'orders': orders, 'count': orders_count, 'cursor': cursor}, 200
 
 
 class Order(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_put = reqparse.RequestParser()
-        self._parser_put.add_argument('order_contents', type=FakeRequest,
-                                      action='append', required=True)
-
-        self._parser_order = parser.order.copy()
+    _parser_put = parser.Parser()
+    _parser_put.add_argument('order_contents', type=FakeRequest,
+                             action='append', required=True)
+    _parser_put.nest('order_contents', parser.order)
 
     def put(self, vet_id, order_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
         order = mongo_cli.db.orders.find_one(
-            {'_id': order_id, 'order_status': {'$in': ['pending', 'processing']}})
+            {'_id': order_id, 'order_status': {'$in': OPEN_STATUSES}})
         if not order:
             return {'updated': False}, 200
 
@@ -106,12 +98,8 @@ class Order(Resource):
 
         subtotal = 0.0
 
-        prods = []
         for product in args['order_contents']:
-            product = self._parser_order.parse_args(req=product)
-            prods.append(product)
             subtotal += float(product['product_price'])  # * int(product['quantity'])
-        args['order_contents'] = prods
 
         args['subtotal_price'] = str(round(subtotal, 2))
 
@@ -119,16 +107,20 @@ class Order(Resource):
         args['total_price'] = str(round(total, 2))
 
         args['history.modified_on'] = datetime.datetime.utcnow()
+        args.update(product_types.fields(mongo_cli.db, args['order_contents']))
 
-        result = mongo_cli.db.orders.update_one(
-            {'_id': order_id, 'vet_id': vet_id}, {'$set': args})
+        before = mongo_cli.db.orders.find_one_and_update(
+            {'_id': order_id, 'vet_id': vet_id}, {'$set': args},
+            projection=sales.FIELDS, return_document=ReturnDocument.BEFORE)
+        counts.invalidate(mongo_cli.db, 'orders')
+        sales.change(mongo_cli.db, before, args)
 
-        return {'updated': bool(result.modified_count)}, 200
+        return {'updated': before is not None}, 200
 
 
 class Feedbacks(Resource):
     def get(self, vet_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         projection = {
             'client_id': True,
@@ -142,28 +134,23 @@ class Feedbacks(Resource):
             {
                 'vet_id': vet_id,
                 'feedback.is_feedback_read': False,
-                'is_archived': {'$in': [None, False]}
+                **archive.ACTIVE
             },
             projection=projection))
 
+        refs = loader.load_refs(mongo_cli.db, orders, {
+            'client_id': ('clients', {'first_name': True, 'last_name': True, 'is_archived': True}),
+            'patient_id': ('patients', {'name': True, 'is_archived': True}),
+        })
+
         for order in orders:
             order['order_id'] = order.pop('_id')
-            client = mongo_cli.db.clients.find_one(
-                {
-                    '_id': order['client_id'],
-                    'is_archived': {'$in': [None, False]}
-                },
-                projection={'first_name': True, 'last_name': True})
-            if client:
+            client = refs['client_id'].get(order['client_id'])
+            if client and not client.get('is_archived'):
                 order['client_name'] = '{} {}'.format(client['first_name'], client['last_name'])
 
-            patient = mongo_cli.db.patients.find_one(
-                {
-                    '_id': order['patient_id'],
-                    'is_archived': {'$in': [None, False]}
-                },
-                projection={'name': True})
-            if patient:
+            patient = refs['patient_id'].get(order['patient_id'])
+            if patient and not patient.get('is_archived'):
                 order['patient_name'] = patient['name']
 
         return {'orders': orders}, 200
@@ -171,7 +158,7 @@ class Feedbacks(Resource):
 
 class Feedback(Resource):
     def put(self, vet_id, order_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         payload = {
             'feedback.is_feedback_read': True,
@@ -180,5 +167,50 @@ class Feedback(Resource):
 
         result = mongo_cli.db.orders.update_one(
             {'_id': order_id, 'vet_id': vet_id}, {'$set': payload})
+        counts.invalidate(mongo_cli.db, 'orders')
 
         return {'updated': bool(result.modified_count)}, 200
+
+
+def _summary(db, vet_id):
+    """Badge counts of a vet's dashboard from one $facet over their orders, plus their active subscriptions."""
+    pipeline = [
+        {'$match': {'vet_id': vet_id, **archive.ACTIVE}},
+        {'$facet': {
+            'statuses': [
+                {'$group': {'_id': '$order_status', 'count': {'$sum': 1}}},
+            ],
+            'types': [
+                {'$group': {'_id': '$has_rx', 'count': {'$sum': 1}}},
+            ],
+            'unread_feedback': [
+                {'$match': {'feedback.is_feedback_read': False}},
+                {'$count': 'count'},
+            ],
+        }},
+    ]
+    facets = next(db.orders.aggregate(pipeline), {})
+
+    statuses = {row['_id']: row['count'] for row in facets.get('statuses', [])}
+    types = {row['_id']: row['count'] for row in facets.get('types', [])}
+    unread = facets.get('unread_feedback') or [{'count': 0}]
+
+    return {
+        'open': sum(statuses.get(s, 0) for s in OPEN_STATUSES),
+        'closed': sum(statuses.get(s, 0) for s in CLOSED_STATUSES),
+        'rx': types.get(True, 0),
+        'otc': types.get(False, 0),
+        'unread_feedback': unread[0]['count'],
+        'active_subscriptions': db.subscriptions.count(
+            {'vet_id': vet_id, 'subscription_status': 'Active', **archive.ACTIVE}),
+    }
+
+
+class Summary(Resource):
+    def get(self, vet_id):
+        db = mongo.get_db()
+
+        summary = counts.cached(db, f'vet_summary:{vet_id}', ['orders', 'subscriptions'],
+                                lambda: _summary(db, vet_id), seconds=VET_SUMMARY_CACHE_SECONDS)
+
+        return summary, 200
@@ -1,52 +1,58 @@
-from bson.regex import Regex
-from flask_restful import Resource, reqparse
-from pymongo import MongoClient
+from flask_restful import Resource
 
+from app.common import archive
+from app.common import loader
+from app.common import mongo
+from app.common import parser
+from app.common import search
 from app.common.env import *
 
 
 class Patients(Resource):
     def get(self, vet_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         patients = list(mongo_cli.db.patients.find(
-            {'vet_id': vet_id, 'is_archived': {'$in': [False, None]}},
+            {'vet_id': vet_id, **archive.ACTIVE},
             projection={'history': False, 'is_archived': False}))
 
+        clients = loader.load_refs(mongo_cli.db, patients, {
+            'client_id': ('clients', {'first_name': True, 'last_name': True, 'status': True, 'is_archived': True})
+        })['client_id']
+        clients = {k: v for k, v in clients.items() if not v.get('is_archived')}
+        orders_count = loader.count_by(mongo_cli.db, 'orders', 'client_id', clients.keys(), archive.ACTIVE)
+
         for patient in patients:
             patient['patient_id'] = patient.pop('_id')
 
-            client = mongo_cli.db.clients.find_one({
-                '_id': patient['client_id'],
-                'is_archived': {'$in': [False, None]}})
+            client = clients.get(patient['client_id'])
             patient['client_name'] = '{} {}'.format(client['first_name'], client['last_name'])
             patient['client_status'] = client['status']
-
-            orders_count = mongo_cli.db.orders.count({
-                'client_id': client['_id'],
-                'is_archived': {'$in': [False, None]}})
-            patient['client_pending_orders'] = bool(orders_count)
+            patient['client_pending_orders'] = bool(orders_count.get(client['_id']))
 
         return {'patients': patients}, 200
 
 
 class PatientOrders(Resource):
     def get(self, vet_id, patient_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         orders = list(mongo_cli.db.orders.find(
             {
                 'vet_id': vet_id,
                 'patient_id': patient_id,
-                'is_archived': {'$in': [False, None]}
+                **archive.ACTIVE
             },
             projection={'history': False, 'is_archived': False}))
 
+        products = loader.load_refs(mongo_cli.db, orders, {
+            'order_contents.product_id': ('products', {'image_url': True, 'type': True, 'product_name': True})
+        })['order_contents.product_id']
+
         for order in orders:
             order['order_id'] = order.pop('_id')
             for product in order['order_contents']:
-                _ = mongo_cli.db.products.find_one(
-                    {'_id': product['product_id']})
+                _ = products.get(product['product_id'])
                 product['image_url'] = _['image_url'] if _ else None
                 product['type'] = _['type'] if _ else None
                 product['product_name'] = _['product_name'] if _ else None
@@ -55,11 +61,10 @@ class PatientOrders(Resource):
 
 
 class PatientSearch(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_get = reqparse.RequestParser()
-        self._parser_get.add_argument('query', required=True)
+    _parser_get = parser.Parser()
+    _parser_get.add_argument('query', required=True)
+    _parser_get.add_argument('offset', type=int, default=0)
+    _parser_get.add_argument('limit', type=int, default=20)
 
     def get(self, vet_id):
         args = self._parser_get.parse_args()
@@ -67,50 +72,49 @@ class PatientSearch(Resource):
         if not args['query']:
             return {'results': []}, 200
 
-        regex = Regex(pattern='^{}.*'.format(args['query']), flags='si')
-
-        mongo_cli = MongoClient(host=MONGO_HOST)
-        results = list(mongo_cli.db.patients.find(
+        mongo_cli = mongo.get_client()
+        client_ids = [c['_id'] for c in mongo_cli.db.clients.find(
             {
-                'vet_id': vet_id,
-                'name': regex,
-                'is_archived': {'$in': [False, None]}
+                'vet_ids': vet_id,
+                'client_name_normalized': search.prefix_range(args['query']),
+                **archive.ACTIVE
             },
-            projection={'history': False, 'is_archived': False}))
+            projection={'_id': True}, sort=[('client_name_normalized', 1)], limit=PATIENT_SEARCH_MAX_CLIENTS)]
 
-        result_ids = {_['_id'] for _ in results}
-
-        clients = mongo_cli.db.clients.aggregate([
-            {'$project': {'client_name': {'$concat': ['$first_name', ' ', '$last_name']}, 'email_address': True}},
-            {'$match': {'is_archived': {'$in': [False, None]}, 'client_name': regex}}])
-
-        for client in clients:
-            pets = list(mongo_cli.db.patients.find({
+        results = list(mongo_cli.db.patients.aggregate([
+            {'$match': {
                 'vet_id': vet_id,
-                'client_id': client['_id'],
-                'is_archived': {'$in': [False, None]}
-            }, projection={'is_archived': False, 'history': False}))
-
-            for pet in pets:
-                if pet['_id'] not in result_ids:
-                    pet['client_name'] = client['client_name']
-                    pet['client_email'] = client['email_address']
-                    results.append(pet)
-                    result_ids.add(pet['_id'])
+                '$or': [{'name_normalized': search.prefix_range(args['query'])}, {'client_id': {'$in': client_ids}}],
+                **archive.ACTIVE
+            }},
+            {'$sort': {'name': 1, '_id': 1}},
+            {'$skip': args['offset']},
+            {'$limit': args['limit']},
+            {'$lookup': {'from': 'clients', 'localField': 'client_id', 'foreignField': '_id', 'as': 'client'}},
+            {'$project': {'history': False, 'is_archived': False, 'name_normalized': False}},
+            # Mongo 3.4 has no $lookup pipeline, so the joined clients are trimmed to the live ones'
+            # name and email before leaving the server
+            {'$addFields': {'client': {'$map': {
+                'input': {'$filter': {'input': '$client', 'as': 'c', 'cond': {'$eq': ['$$c.is_archived', False]}}},
+                'as': 'c',
+                'in': {'first_name': '$$c.first_name', 'last_name': '$$c.last_name',
+                       'email_address': '$$c.email_address'},
+            }}}},
+        ]))
+
+        clients = {}
+        for res in results:
+            client = res.pop('client')
+            if client:
+                clients[res['client_id']] = client[0]
+        orders_count = loader.count_by(mongo_cli.db, 'orders', 'client_id', clients.keys(), archive.ACTIVE)
 
         for res in results:
-            if 'client_name' not in res:
-                client = mongo_cli.db.clients.find_one({
-                    '_id': res['client_id'],
-                    'is_archived': {'$in': [False, None]}})
+            client = clients.get(res['client_id'])
+            if client:
                 res['client_name'] = '{} {}'.format(client['first_name'], client['last_name'])
                 res['client_email'] = client['email_address']
-
-            orders_count = mongo_cli.db.orders.count({
-                'client_id': client['_id'],
-                'is_archived': {'$in': [False, None]}})
-            res['client_pending_orders'] = bool(orders_count)
-
+            res['client_pending_orders'] = bool(orders_count.get(res['client_id']))
             res['client_status'] = 'Pending'
 
         return {'results': results}, 200
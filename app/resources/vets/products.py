@@ -1,30 +1,73 @@
 from bson.objectid import ObjectId
-from flask_restful import Resource, abort, reqparse
-from pymongo import MongoClient
-
-from app.common.env import *
+from flask_restful import Resource, abort
+
+from app.common import archive
+from app.common import formulary
+from app.common import loader
+from app.common import mongo
+from app.common import parser
+
+PRODUCT_PROJECTION = {
+    "product_name": True,
+    "image_url": True,
+    "ndc": True,
+    "stc": True,
+    "description": True,
+    "type": True,
+    "category": True,
+    "manufacturer_name": True,
+    "is_archived": True
+}
+
+
+def _vet_hospital(db, vet):
+    if vet.get('hospital_id') is None:
+        abort(500, message='Vet\'s data is incorrect')
+
+    hospital = db.hospitals.find_one({'_id': vet['hospital_id'], **archive.ACTIVE},
+                                     projection=formulary.HOSPITAL_PROJECTION)
+    if hospital is None:
+        abort(404, message='Hospital not found')
+
+    return hospital
+
+
+def _with_options(db, hospital, product_ids, listed_only=False):
+    """Live products in `product_ids` order, with the hospital's available_options where it lists them."""
+    products = loader.load_by_ids(db, 'products', product_ids, projection=PRODUCT_PROJECTION)
+    entries = formulary.entries(db, hospital, products.keys())
+
+    results = []
+    for product_id in product_ids:
+        product = products.get(product_id)
+        if product is None or product.pop('is_archived', None):
+            continue
+        if product_id in entries:
+            product['available_options'] = entries[product_id]['available_options']
+        elif listed_only:
+            continue
+        product['product_id'] = product.pop('_id')
+        results.append(product)
+    return results
 
 
 class Products(Resource):
-    def __init__(self):
-        self._parser_get = reqparse.RequestParser()
-        self._parser_get.add_argument('offset', type=int, default=0)
-        self._parser_get.add_argument('limit', type=int, default=20)
-        self._parser_get.add_argument('type')
-        self._parser_get.add_argument('ids')
-        self._parser_get.add_argument('category')
-        self._parser_get.add_argument('brand', action='append')
+    _parser_get = parser.Parser()
+    _parser_get.add_argument('offset', type=int, default=0)
+    _parser_get.add_argument('limit', type=int, default=20)
+    _parser_get.add_argument('type')
+    _parser_get.add_argument('ids')
+    _parser_get.add_argument('category')
+    _parser_get.add_argument('brand', action='append')
 
     def get(self, vet_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
-        vet = mongo_cli.db.vets.find_one({'_id': vet_id, 'is_archived': {'$in': [False, None]}})
+        vet = mongo_cli.db.vets.find_one({'_id': vet_id, **archive.ACTIVE})
         if vet is None:
             abort(404, message='No such vet')
 
-        hospital_id = vet['hospital_id']
-        if hospital_id is None:
-            abort(500, message='Vet\'s data is incorrect')
+        hospital = _vet_hospital(mongo_cli.db, vet)
 
         projection = {
             "product_name": True,
@@ -43,57 +86,17 @@ class Products(Resource):
         limit = args.pop('limit')
 
         if 'ids' in args:
-            product_ids = args['ids'].split(';')
+            product_ids = [ObjectId(_) for _ in args['ids'].split(';')]
+            return {'products': _with_options(mongo_cli.db, hospital, product_ids)}, 200
 
-            hospital = mongo_cli.db.hospitals.find_one({'_id': hospital_id})
-
-            projection = {
-                "product_name": True,
-                "image_url": True,
-                "ndc": True,
-                "stc": True,
-                "description": True,
-                "type": True,
-                "category": True,
-                "manufacturer_name": True
-            }
-
-            products = list()
-            for product_id in product_ids:
-                product = mongo_cli.db.products.find_one(
-                    {
-                        '_id': ObjectId(product_id),
-                        'is_archived': {'$in': [False, None]}
-                    },
-                    projection=projection)
-
-                product['product_id'] = product.pop('_id')
-
-                for prod in hospital['formulary']:
-                    if prod['product_id'] == product['product_id']:
-                        product['available_options'] = prod['available_options']
-
-                products.append(product)
-
-            return {'products': products}, 200
-
-        try:
-            formulary = mongo_cli.db.hospitals.find_one(
-                {'_id': hospital_id, 'is_archived': {'$in': [False, None]}},
-                projection={'formulary.product_id': True,
-                            'formulary.available_options': True}).get('formulary')
-        except AttributeError:
-            abort(404, message='Hospital not found')
-
-        if not formulary:
+        product_ids = formulary.product_ids(mongo_cli.db, hospital)
+        if not product_ids:
             return {'results': [], 'count': 0}
 
-        product_ids = [_['product_id'] for _ in formulary]
-        available_options = {item['product_id']: item['available_options'] for item in formulary}
         brands = mongo_cli.db.products.distinct('manufacturer_name', {'_id': {'$in': product_ids}})
         categories = mongo_cli.db.products.distinct('category', {'_id': {'$in': product_ids}})
         args['_id'] = {'$in': product_ids}
-        args['is_archived'] = {'$in': [False, None]}
+        args.update(archive.ACTIVE)
 
         if args.get('brand') is not None:
             args['manufacturer_name'] = {'$in': args.pop('brand')}
@@ -102,8 +105,9 @@ class Products(Resource):
         products = list(mongo_cli.db.products.find(args, projection=projection,
                                                    skip=skip, limit=limit, sort=[("product_name", 1)]))
 
+        entries = formulary.entries(mongo_cli.db, hospital, [item['_id'] for item in products])
         for item in products:
-            item['available_options'] = available_options[item['_id']]
+            item['available_options'] = entries[item['_id']]['available_options']
 
         return {'results': products, 'count': formulary_count,
                 'brands': brands, 'categories': categories}, 200
@@ -111,57 +115,27 @@ class Products(Resource):
 
 class Product(Resource):
     def get(self, vet_id, product_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
-        vet = mongo_cli.db.vets.find_one({'_id': vet_id, 'is_archived': {'$in': [False, None]}})
+        vet = mongo_cli.db.vets.find_one({'_id': vet_id, **archive.ACTIVE})
         if vet is None:
             abort(404, message='No such vet')
 
-        hospital_id = vet['hospital_id']
-        if hospital_id is None:
-            abort(500, message='Vet\'s data is incorrect')
-        else:
-            hospital = mongo_cli.db.hospitals.find_one({'_id': hospital_id})
-
-        projection = {
-            "product_name": True,
-            "image_url": True,
-            "ndc": True,
-            "stc": True,
-            "description": True,
-            "type": True,
-            "category": True,
-            "manufacturer_name": True
-        }
+        hospital = _vet_hospital(mongo_cli.db, vet)
 
-        if mongo_cli.db.hospitals.count({
-            '_id': hospital_id,
-            'formulary.product_id': product_id}) == 0:
+        product = _with_options(mongo_cli.db, hospital, [product_id], listed_only=True)
+        if not product:
             return {}, 200
 
-        product = mongo_cli.db.products.find_one(
-            {
-                '_id': ObjectId(product_id),
-                'is_archived': {'$in': [False, None]}
-            },
-            projection=projection)
-
-        for prod in hospital['formulary']:
-            if prod['product_id'] == product['_id']:
-                product['available_options'] = prod['available_options']
-
-        product['product_id'] = product.pop('_id')
-
-        return product, 200
+        return product[0], 200
 
 
 class MultipleProducts(Resource):
-    def __init__(self):
-        self._parser_get = reqparse.RequestParser()
-        self._parser_get.add_argument('ids', required=True)
+    _parser_get = parser.Parser()
+    _parser_get.add_argument('ids', required=True)
 
     def get(self, vet_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
         args = self._parser_get.parse_args()
         product_ids = []
         if 'ids' in args:
@@ -169,47 +143,12 @@ class MultipleProducts(Resource):
         else:
             abort(404, message='Pass list of product ids')
 
-        vet = mongo_cli.db.vets.find_one({'_id': vet_id, 'is_archived': {'$in': [False, None]}})
+        vet = mongo_cli.db.vets.find_one({'_id': vet_id, **archive.ACTIVE})
         if vet is None:
             abort(404, message='No such vet')
 
-        hospital_id = vet['hospital_id']
-        if hospital_id is None:
-            abort(500, message='Vet\'s data is incorrect')
-        else:
-            hospital = mongo_cli.db.hospitals.find_one({'_id': hospital_id})
+        hospital = _vet_hospital(mongo_cli.db, vet)
 
-        projection = {
-            "product_name": True,
-            "image_url": True,
-            "ndc": True,
-            "stc": True,
-            "description": True,
-            "type": True,
-            "category": True,
-            "manufacturer_name": True
-        }
-        #
-        # if mongo_cli.db.hospitals.count({
-        #     '_id': hospital_id,
-        #         'formulary.product_id': {'$in': product_ids}}) == 0:
-        #     return {}, 200
-
-        products = list()
-        for product_id in product_ids:
-            product = mongo_cli.db.products.find_one(
-                {
-                    '_id': ObjectId(product_id),
-                    'is_archived': {'$in': [False, None]}
-                },
-                projection=projection)
-
-            product['product_id'] = product.pop('_id')
-
-            for prod in hospital['formulary']:
-                if prod['product_id'] == product['product_id']:
-                    product['available_options'] = prod['available_options']
-
-            products.append(product)
+        products = _with_options(mongo_cli.db, hospital, [ObjectId(_) for _ in product_ids])
 
         return {'products': products}, 200
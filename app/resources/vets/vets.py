@@ -1,49 +1,49 @@
 import datetime
 
 from bson.objectid import ObjectId
-from flask_restful import Resource, reqparse
-from pymongo import MongoClient
+from flask_restful import Resource
 
+from app.common import archive
+from app.common import counts
+from app.common import mongo
 from app.common import parser
-from app.common.env import *
 from app.common.fake_request import FakeRequest
 
 
 class Vets(Resource):
-    def __init__(self):
-        super().__init__()
-
-        self._parser_post = reqparse.RequestParser()
-        object_id_post_fields = ['user_id', 'hospital_id']
-        for field in object_id_post_fields:
-            self._parser_post.add_argument(field, required=True, type=ObjectId)
-        str_post_fields = ['first_name', 'last_name', 'email_address']
-        for field in str_post_fields:
-            self._parser_post.add_argument(field, required=True)
-        self._parser_post.add_argument('phone', type=FakeRequest, required=True)
-
-        self._parser_address = parser.address.copy()
-        self._parser_phone = parser.phone.copy()
-
-        self._parser_put = reqparse.RequestParser()
-        object_id_put_fields = ['user_id', 'hospital_id']
-        for field in object_id_put_fields:
-            self._parser_put.add_argument(field, type=ObjectId)
-        str_put_fields = ['first_name', 'last_name', 'dea', 'npi', 'state_license', 'image_url', 'specialty', 'title']
-        for field in str_put_fields:
-            self._parser_put.add_argument(field)
-        fr_put_fields = ['phone', 'address']
-        for field in fr_put_fields:
-            self._parser_put.add_argument(field, type=FakeRequest)
+    _parser_post = parser.Parser()
+    _parser_post.add_argument('user_id', required=True, type=ObjectId)
+    _parser_post.add_argument('hospital_id', required=True, type=ObjectId)
+    _parser_post.add_argument('first_name', required=True)
+    _parser_post.add_argument('last_name', required=True)
+    _parser_post.add_argument('email_address', required=True)
+    _parser_post.add_argument('phone', type=FakeRequest, required=True)
+
+    _parser_address = parser.address.copy()
+    _parser_phone = parser.phone.copy()
+
+    _parser_put = parser.Parser()
+    _parser_put.add_argument('user_id', type=ObjectId)
+    _parser_put.add_argument('hospital_id', type=ObjectId)
+    _parser_put.add_argument('first_name')
+    _parser_put.add_argument('last_name')
+    _parser_put.add_argument('dea')
+    _parser_put.add_argument('npi')
+    _parser_put.add_argument('state_license')
+    _parser_put.add_argument('image_url')
+    _parser_put.add_argument('specialty')
+    _parser_put.add_argument('title')
+    _parser_put.add_argument('phone', type=FakeRequest)
+    _parser_put.add_argument('address', type=FakeRequest)
 
     def get(self, vet_id):
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
 
         projection_fields = ['_id', 'fax', 'treatment_plan_templates', 'history', 'is_archived']
         vet_projection = {field: False for field in projection_fields}
 
         vet = mongo_cli.db.vets.find_one(
-            {'_id': ObjectId(vet_id), 'is_archived': {'$in': [False, None]}},
+            {'_id': ObjectId(vet_id), **archive.ACTIVE},
             projection=vet_projection)
 
         return vet, 200
@@ -53,9 +53,11 @@ class Vets(Resource):
         args['phone'] = self._parser_phone.parse_args(req=args['phone'])
         args['address'] = self._parser_address.parse_args(req=args['address'])
         args['history'] = {'created_on': datetime.datetime.utcnow()}
+        args['is_archived'] = False
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
         vet_id = mongo_cli.db.vets.insert_one(args).inserted_id
+        counts.invalidate(mongo_cli.db, 'vets')
 
         return {'vet_id': vet_id}, 200
 
@@ -72,7 +74,7 @@ class Vets(Resource):
                                self._parser_address.parse_args(req=args['address']).items() if v is not None}
         args['history.modified_on'] = datetime.datetime.utcnow()
 
-        mongo_cli = MongoClient(host=MONGO_HOST)
+        mongo_cli = mongo.get_client()
         resp = mongo_cli.db.vets.update_one({'_id': ObjectId(vet_id)}, {'$set': args})
 
         return {'updated': bool(resp.modified_count)}, 200
@@ -1,9 +1,190 @@
+import sys
+import time
+
+import schedule
 from flask_script import Manager, Server
 
 from app.app import app
+from app.common import archive
+from app.common import catalog
+from app.common import formulary
+from app.common import indexes
+from app.common import jobs
+from app.common import json
+from app.common import mongo
+from app.common import outbox
+from app.common import paging
+from app.common import parser
+from app.common import pricing
+from app.common import product_types
+from app.common import renewals
+from app.common import sales
+from app.common import search
+from app.common.env import *
 
 manager = Manager(app)
 manager.add_command('runserver', Server(host='0.0.0.0', port='5000'))
 
+
+@manager.option('-w', '--workers', dest='workers', type=int, default=outbox.OUTBOX_WORKERS)
+@manager.option('--once', dest='once', action='store_true', default=False,
+                help='Exit when the outbox is empty instead of polling')
+def dispatch_notifications(workers, once):
+    """Deliver queued email and SMS notifications"""
+    outbox.Dispatcher(workers=workers).run(once=once)
+
+
+@manager.option('--once', dest='once', action='store_true', default=False,
+                help='Exit when no job is queued instead of polling')
+def run_jobs(once):
+    """Run queued background jobs such as catalog imports"""
+    jobs.Worker().run(once=once)
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=renewals.RENEWALS_BATCH_SIZE)
+@manager.option('--at', dest='at', help='Keep running and renew every day at this UTC time (HH:MM)')
+def renew_subscriptions(batch_size, at):
+    """Create the orders of subscriptions whose upcoming box is due and roll their schedules forward"""
+    def renew():
+        db = mongo.get_db()
+        indexes.ensure(db, ['subscriptions', 'orders'])
+        totals = renewals.run(db, batch_size=batch_size)
+        print(f"renewed {totals['renewed']}, already ordered {totals['skipped']}, failed {totals['failed']}")
+
+    if not at:
+        return renew()
+    schedule.every().day.at(at).do(renew)
+    while True:
+        schedule.run_pending()
+        time.sleep(30)
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000)
+def rebuild_sales(batch_size):
+    """Recompute the daily_sales rollups behind the sales reports from all orders"""
+    db = mongo.get_db()
+    indexes.ensure(db, ['daily_sales'])
+    print(f'{sales.rebuild(db, batch_size=batch_size)} daily sales buckets')
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000)
+def backfill_client_search(batch_size):
+    """Populate the normalized client and patient names and vet_ids used by the vet searches"""
+    db = mongo.get_db()
+    indexes.ensure(db, ['clients', 'patients'])
+    print(f'{search.backfill_clients(db, batch_size)} clients updated')
+    print(f'{search.backfill_patients(db, batch_size)} patients updated')
+
+
+@manager.command
+def create_indexes():
+    """Build every registered index that is missing, in the background"""
+    archived = catalog.dedupe(mongo.get_db())
+    if archived:
+        print(f'archived {archived} duplicate products')
+    for name in indexes.ensure():
+        print(f'created {name}')
+
+
+@manager.command
+def check_indexes():
+    """Report missing, unused and unregistered indexes; exits 1 if any are missing"""
+    absent = indexes.missing()
+    usage = indexes.usage()
+    for label, names in (('missing', absent), ('unused', usage['unused']), ('unregistered', usage['unregistered'])):
+        for name in names:
+            print(f'{label}: {name}')
+    if absent:
+        sys.exit(1)
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000)
+@manager.option('-p', '--pause', dest='pause', type=float, default=0.1, help='Seconds to sleep between batches')
+@manager.option('-c', '--collection', dest='collections', action='append', choices=archive.COLLECTIONS,
+                help='Limit the backfill to this collection; may be repeated')
+def backfill_archived(batch_size, pause, collections):
+    """Set is_archived to False on every document where it is missing or null"""
+    db = mongo.get_db()
+    for name in collections or archive.COLLECTIONS:
+        print(f'{name}: {archive.backfill(db, name, batch_size, pause)} documents updated')
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000)
+@manager.option('-p', '--pause', dest='pause', type=float, default=0.1, help='Seconds to sleep between batches')
+@manager.option('-a', '--all', dest='recompute', action='store_true', default=False,
+                help='Recompute every order, not only those without the fields')
+def backfill_order_types(batch_size, pause, recompute):
+    """Set has_rx and product_types on orders written before they were stored"""
+    db = mongo.get_db()
+    indexes.ensure(db, ['orders'])
+    updated = product_types.backfill(db, batch_size=batch_size, pause=pause, recompute=recompute)
+    print(f'orders: {updated} updated')
+
+
+@manager.option('-r', '--rounds', dest='rounds', type=int, default=20)
+def benchmark_archived(rounds):
+    """Explain and time the listing queries with the legacy and equality is_archived predicates"""
+    for label, summary in archive.benchmark(mongo.get_db(), rounds=rounds).items():
+        print(f"{label:<20} {summary['plan']:<50} keys={summary['keys_examined']} "
+              f"docs={summary['docs_examined']} returned={summary['returned']} median={summary['median_ms']}ms")
+
+
+@manager.option('-n', '--count', dest='count', type=int, default=1000000,
+                help='Size of the synthetic bench_orders collection, seeded on first run')
+@manager.option('-l', '--limit', dest='limit', type=int, default=20)
+@manager.option('--host', dest='host', default=BENCH_MONGO_HOST, help='Mongo URI of the bench database')
+@manager.option('--database', dest='database', default=BENCH_MONGO_DB, help='Database seeded with bench_orders')
+def benchmark_paging(count, limit, host, database):
+    """Time offset and cursor pagination from page 1 to page 5000"""
+    db = mongo.get_bench_db(host, database)
+    for number, timings in paging.benchmark(db, count=count, limit=limit).items():
+        print(f"page {number:>5}: offset {timings['offset_ms']:>9}ms  cursor {timings['cursor_ms']:>7}ms")
+
+
+@manager.option('-r', '--rounds', dest='rounds', type=int, default=200)
+def benchmark_json(rounds):
+    """Time response encoding of orders and products listings per JSON backend"""
+    for label, timings in json.benchmark(rounds=rounds).items():
+        sizes = timings.pop('bytes')
+        print(label + ': ' + '  '.join(f"{name} {us}us/{sizes[name]}B" for name, us in timings.items()))
+
+
+@manager.option('-p', '--products', dest='products', type=int, default=2000)
+@manager.option('-r', '--rounds', dest='rounds', type=int, default=1000)
+def benchmark_pricing(products, rounds):
+    """Time building a hospital's pricing index and quoting an order against it"""
+    timings = pricing.benchmark(products=products, rounds=rounds)
+    print(f"build {timings['build_ms']}ms  quote {timings['quote_us']}us")
+
+
+@manager.option('-r', '--rounds', dest='rounds', type=int, default=500)
+def benchmark_parsers(rounds):
+    """Time request body validation with per-request parsers against the compiled class-level parsers"""
+    for label, timings in parser.benchmark(rounds=rounds).items():
+        print(f"{label:<15} before {timings['before_us']:>8}us  after {timings['after_us']:>8}us")
+
+
+@manager.option('path', help='Local catalog file, in the same format as the admin upload')
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int, default=catalog.CATALOG_CHUNK_SIZE)
+def import_products(path, chunk_size):
+    """Load a product catalog from a local file and publish it as the default formulary"""
+    db = mongo.get_db()
+    started = time.time()
+    with open(path, encoding='utf-8-sig') as f:
+        summary = catalog.ingest(db, f, chunk_size)
+    formulary.publish_default(db)
+    print(f"{summary['parsed']} rows parsed, {summary['upserted']} upserted, {summary['skipped']} skipped, "
+          f"{summary['failed']} failed in {time.time() - started:.1f}s")
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000)
+def migrate_formulary(batch_size):
+    """Move embedded hospital formularies into the formulary collection, while the API is live"""
+    db = mongo.get_db()
+    indexes.ensure(db, ['formulary'])
+    inheriting, custom = formulary.migrate(db, batch_size)
+    print(f'{inheriting} hospitals inherit the default formulary, {custom} keep their own')
+
+
 if __name__ == '__main__':
     manager.run()